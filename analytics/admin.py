@@ -1,3 +1,15 @@
 from django.contrib import admin
+from .models import AIInsight, SurplusCell
 
-# Register your models here.
+
+@admin.register(AIInsight)
+class AIInsightAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'listings_considered', 'generated_at')
+    list_filter = ('status',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(SurplusCell)
+class SurplusCellAdmin(admin.ModelAdmin):
+    list_display = ('cell_y', 'cell_x', 'hour_of_week', 'food_type', 'completed_kg', 'expired_kg')
+    list_filter = ('food_type',)
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class AnalyticsConfig(AppConfig):
     name = "analytics"
+
+    def ready(self):
+        from django.conf import settings
+        if getattr(settings, 'AI_WARM_UP', False):
+            import threading
+            from foodsaver.ai_core import warm_up
+            threading.Thread(target=warm_up, name='ai-warm-up', daemon=True).start()
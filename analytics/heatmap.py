@@ -0,0 +1,232 @@
+"""
+Where and when surplus appears: the heatmap of finished listings.
+
+Listings are counted once they are completed or expired, into
+``SurplusCell`` rows keyed by grid cell (the donor's location floored to
+``HEATMAP_CELL_DEGREES``), hour of the week (local time the listing was
+posted) and food type, plus "any hour" and "any food" rows. ``roll_up``
+adds the listings not counted yet, in batches: each batch flips
+``Listing.rolled_up`` with a conditional UPDATE in the same transaction as
+one batched upsert of its cell increments, so a listing is counted exactly
+once even with runs overlapping. It runs as a periodic job and on
+the listings about to be archived. ``rebuild`` recomputes every cell from
+live and archived listings.
+
+``tile`` serves one Web Mercator (slippy map) tile by summing the cells in
+its bounding box, merging neighbours so no tile is more than
+``HEATMAP_TILE_CELLS`` across: its cost grows with the cells shown, never
+with listing history. Listings of donors without a location are not
+mapped; a donor who moves keeps their history in the old cell.
+"""
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from listings.models import ArchivedListing, Listing
+
+from .models import SurplusCell
+
+FINISHED = ('completed', 'expired')
+FOOD_TYPES = frozenset(code for code, _ in Listing.FOOD_TYPES)
+MAX_ZOOM = 22
+
+# What a listing contributes, read from Listing or ArchivedListing
+ROW_FIELDS = ('status', 'food_type', 'quantity_kg', 'created_at', 'donor__latitude', 'donor__longitude')
+
+
+def _cell(degrees):
+    # Rounded first so that e.g. 0.29 / 0.01 = 28.999999999999996 lands in cell 29
+    return math.floor(round(degrees / settings.HEATMAP_CELL_DEGREES, 9))
+
+
+def _edge(cells):
+    return math.ceil(round(cells, 9))
+
+
+def cell_of(lat, lng):
+    return _cell(lat), _cell(lng)
+
+
+def hour_of_week(when):
+    local = timezone.localtime(when)
+    return local.weekday() * 24 + local.hour
+
+
+def _totals():
+    # completed_kg, expired_kg, completed_listings, expired_listings per cell key
+    return defaultdict(lambda: [0.0, 0.0, 0, 0])
+
+
+def _add(totals, rows):
+    """Add ``ROW_FIELDS`` rows to ``totals``; returns how many were mapped."""
+    mapped = 0
+    for status, food_type, kg, created_at, lat, lng in rows:
+        if lat is None or lng is None:
+            continue
+        cell_y, cell_x = cell_of(lat, lng)
+        for hour in (hour_of_week(created_at), SurplusCell.ANY_HOUR):
+            for food in (food_type, SurplusCell.ANY_FOOD):
+                cell = totals[(cell_y, cell_x, hour, food)]
+                if status == 'completed':
+                    cell[0] += kg
+                    cell[2] += 1
+                else:
+                    cell[1] += kg
+                    cell[3] += 1
+        mapped += 1
+    return mapped
+
+
+COLUMNS = (
+    'cell_y', 'cell_x', 'hour_of_week', 'food_type',
+    'completed_kg', 'expired_kg', 'completed_listings', 'expired_listings',
+)
+
+
+def _bump(totals):
+    """Add ``totals`` to their cells in one statement per batch, creating cells as needed."""
+    # Django's bulk upsert can only overwrite; each row here adds to what is stored, atomically
+    table = connection.ops.quote_name(SurplusCell._meta.db_table)
+    added = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in COLUMNS[4:])
+    sql = (
+        f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))}) "
+        f"ON CONFLICT (food_type, hour_of_week, cell_y, cell_x) DO UPDATE SET {added}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(*key, *values) for key, values in totals.items()])
+
+
+def roll_up(listing_ids=None, batch_size=500):
+    """Count finished listings not in the heatmap yet (only ``listing_ids`` if given). Returns how many."""
+    pending = Listing.objects.filter(status__in=FINISHED, rolled_up=False)
+    if listing_ids is not None:
+        pending = pending.filter(pk__in=listing_ids)
+    counted = 0
+    while True:
+        with transaction.atomic():
+            rows = list(pending.order_by('pk').values_list('pk', *ROW_FIELDS)[:batch_size])
+            if not rows:
+                return counted
+            ids = [row[0] for row in rows]
+            # Claim the batch; if an overlapping run took some of it, undo and pick again
+            if pending.filter(pk__in=ids).update(rolled_up=True) != len(ids):
+                transaction.set_rollback(True)
+                continue
+            totals = _totals()
+            _add(totals, (row[1:] for row in rows))
+            _bump(totals)
+        counted += len(rows)
+
+
+def rebuild():
+    """Recompute every cell from live and archived listings. Returns the number of listings mapped."""
+    totals = _totals()
+    with transaction.atomic():
+        # Mark first: listings finishing from here on are left to roll_up
+        Listing.objects.filter(status__in=FINISHED, rolled_up=False).update(rolled_up=True)
+        mapped = 0
+        for source in (Listing.objects.filter(rolled_up=True), ArchivedListing.objects.all()):
+            rows = source.filter(status__in=FINISHED).values_list(*ROW_FIELDS)
+            mapped += _add(totals, rows.iterator(chunk_size=5000))
+        SurplusCell.objects.all().delete()
+        SurplusCell.objects.bulk_create(
+            [
+                SurplusCell(
+                    cell_y=cell_y, cell_x=cell_x, hour_of_week=hour, food_type=food_type,
+                    completed_kg=values[0], expired_kg=values[1],
+                    completed_listings=values[2], expired_listings=values[3],
+                )
+                for (cell_y, cell_x, hour, food_type), values in totals.items()
+            ],
+            batch_size=1000,
+        )
+    return mapped
+
+
+def _ranges(value, upper):
+    """The integers in a list like ``"1,3-5"``, each below ``upper``."""
+    chosen = set()
+    for part in value.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f"Not a number or range: {part!r}")
+        if not 0 <= first <= last < upper:
+            raise ValueError(f"Out of range 0-{upper - 1}: {part!r}")
+        chosen.update(range(first, last + 1))
+    return chosen
+
+
+def hours_of_week(days='', hours=''):
+    """Hours of the week for ``days`` (0 = Monday) and ``hours`` (0-23) lists; None when neither is given."""
+    if not days and not hours:
+        return None
+    days = _ranges(days, 7) if days else range(7)
+    hours = _ranges(hours, 24) if hours else range(24)
+    return sorted(day * 24 + hour for day in days for hour in hours)
+
+
+def tile_bounds(z, x, y):
+    """``(south, west, north, east)`` in degrees of a Web Mercator tile."""
+    n = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return latitude(y + 1), x / n * 360 - 180, latitude(y), (x + 1) / n * 360 - 180
+
+
+def tile(z, x, y, food_type=None, hours=None):
+    """
+    The heatmap in tile ``z/x/y`` as a JSON-ready dict.
+
+    ``cells`` rows follow ``fields``: the south-west corner of each (merged)
+    cell, ``cell_degrees`` on a side, and its totals. ``food_type`` and
+    ``hours`` (hours of the week) narrow what is summed.
+    """
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"No tile {z}/{x}/{y}")
+    if food_type is not None and food_type not in FOOD_TYPES:
+        raise ValueError(f"Unknown food type: {food_type!r}")
+
+    size = settings.HEATMAP_CELL_DEGREES
+    south, west, north, east = tile_bounds(z, x, y)
+    # Each cell belongs to the tile its south-west corner is in
+    rows = (_edge(south / size), _edge(north / size) - 1)
+    columns = (_edge(west / size), _edge(east / size) - 1)
+    across = max(rows[1] - rows[0], columns[1] - columns[0]) + 1
+    merge = max(1, math.ceil(across / settings.HEATMAP_TILE_CELLS))
+
+    cells = SurplusCell.objects.filter(
+        food_type=SurplusCell.ANY_FOOD if food_type is None else food_type,
+        hour_of_week__in=[SurplusCell.ANY_HOUR] if hours is None else hours,
+        cell_y__range=rows, cell_x__range=columns,
+    )
+    sums = cells.values('cell_y', 'cell_x').annotate(
+        completed=Sum('completed_kg'), expired=Sum('expired_kg'),
+        listings=Sum(F('completed_listings') + F('expired_listings')),
+    ).values_list('cell_y', 'cell_x', 'completed', 'expired', 'listings')
+
+    merged = defaultdict(lambda: [0.0, 0.0, 0])
+    for cell_y, cell_x, completed, expired, listings in sums:
+        row = rows[0] + (cell_y - rows[0]) // merge * merge
+        column = columns[0] + (cell_x - columns[0]) // merge * merge
+        totals = merged[(row, column)]
+        totals[0] += completed
+        totals[1] += expired
+        totals[2] += listings
+    return {
+        'tile': [z, x, y],
+        'cell_degrees': round(size * merge, 9),
+        'fields': ['lat', 'lng', 'completed_kg', 'expired_kg', 'listings'],
+        'cells': [
+            [round(row * size, 6), round(column * size, 6), round(completed, 2), round(expired, 2), listings]
+            for (row, column), (completed, expired, listings) in sorted(merged.items())
+        ],
+    }
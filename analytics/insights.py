@@ -0,0 +1,231 @@
+"""
+Batch generation of AI insights for every organisation.
+
+``generate_all`` gathers recent listing context for every donor and NGO,
+packs several organisations into each model call (bounded by an estimated
+token budget), runs the calls on a bounded thread pool and upserts one
+``AIInsight`` row per organisation. Dashboards read those rows instead of
+calling the model during the request.
+
+``LocalStandInModel`` mimics the Gemini client offline, for dry runs and
+for sizing a run against a fixed wall-clock budget.
+"""
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from foodsaver import ai_core
+from listings.models import Claim, Listing
+
+from .models import AIInsight
+
+logger = logging.getLogger(__name__)
+
+# Rough prompt size estimate; good enough to keep calls under the model limit
+CHARS_PER_TOKEN = 4
+
+# Each organisation's history is compacted to this many characters in a batched prompt
+ORG_CONTEXT_CHARS = 800
+
+BATCH_HEADER = (
+    "You are an AI Food Waste Analyst for a food rescue network. Below is recent "
+    "donation data for several organisations, each introduced by '### ORG <id>'.\n"
+    f"For each organisation: {ai_core.INSTRUCTIONS}\n"
+    "Respond with only a JSON object mapping each organisation id (as a string) to its insight.\n\n"
+)
+
+_ORG_RE = re.compile(r'^### ORG (\d+)$', re.MULTILINE)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+@dataclass
+class RunStats:
+    organisations: int = 0
+    calls: int = 0
+    stored: int = 0
+    failed: int = 0
+    skipped: int = 0
+    no_history: int = 0
+    elapsed: float = 0.0
+    errors: list = field(default_factory=list)
+
+
+class LocalStandInModel:
+    """Offline stand-in with the ``generate_content(prompt).text`` interface of the Gemini model."""
+
+    status = 'mock'
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        insights = {
+            org_id: f"Stand-in insight for organisation {org_id}: expect surplus similar to last week."
+            for org_id in _ORG_RE.findall(prompt)
+        }
+        return type('Response', (), {'text': json.dumps(insights)})()
+
+
+def collect_contexts(days=90, per_org=None):
+    """Map user id → listing rows from the last ``days`` (newest first, optionally capped) for all donors and NGOs."""
+    User = get_user_model()
+    since = timezone.now() - timedelta(days=days)
+    food_types = dict(Listing.FOOD_TYPES)
+    contexts = {
+        user_id: [] for user_id in
+        User.objects.filter(role__in=('donor', 'claimant')).values_list('id', flat=True).iterator()
+    }
+
+    def add(owner_id, created_at, quantity, food_type):
+        rows = contexts.get(owner_id)
+        if rows is not None and (per_org is None or len(rows) < per_org):
+            rows.append({
+                'date': created_at.strftime("%Y-%m-%d"),
+                'quantity': quantity,
+                'food_type': food_types.get(food_type, food_type),
+            })
+
+    donor_rows = Listing.objects.filter(created_at__gte=since).order_by('donor_id', '-created_at').values_list(
+        'donor_id', 'created_at', 'quantity_kg', 'food_type'
+    )
+    for row in donor_rows.iterator(chunk_size=5000):
+        add(*row)
+
+    claim_rows = Claim.objects.filter(claimed_at__gte=since).order_by('claimant_id', '-listing__created_at').values_list(
+        'claimant_id', 'listing__created_at', 'listing__quantity_kg', 'listing__food_type'
+    )
+    for row in claim_rows.iterator(chunk_size=5000):
+        add(*row)
+    return contexts
+
+
+def recent_context(user, days=90):
+    """Listing context for a single organisation, in the same shape as ``collect_contexts``."""
+    since = timezone.now() - timedelta(days=days)
+    if user.role == 'donor':
+        rows = Listing.objects.filter(donor=user, created_at__gte=since)
+    else:
+        rows = Listing.objects.filter(claims__claimant=user, created_at__gte=since).distinct()
+    return [
+        {
+            'date': listing.created_at.strftime("%Y-%m-%d"),
+            'quantity': listing.quantity_kg,
+            'food_type': listing.get_food_type_display(),
+        }
+        for listing in rows.only('created_at', 'quantity_kg', 'food_type').order_by('-created_at')
+    ]
+
+
+def store(user_id, prediction, status='real', listings_considered=0):
+    """Save a single freshly generated insight."""
+    AIInsight.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'prediction': prediction,
+            'status': status,
+            'listings_considered': listings_considered,
+            'generated_at': timezone.now(),
+        },
+    )
+
+
+def pack_batches(contexts, token_budget=6000, max_orgs=25):
+    """Group organisations into prompts that each stay under ``token_budget`` estimated tokens."""
+    header_tokens = estimate_tokens(BATCH_HEADER)
+    batch, batch_tokens = [], header_tokens
+    for org_id, rows in contexts.items():
+        block = f"### ORG {org_id}\n{ai_core.format_context(rows, budget=ORG_CONTEXT_CHARS)}\n"
+        tokens = estimate_tokens(block)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_orgs):
+            yield batch
+            batch, batch_tokens = [], header_tokens
+        batch.append((org_id, len(rows), block))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def parse_response(text):
+    """Pull the JSON object out of a model reply (tolerating code fences and chatter)."""
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        raise ValueError("no JSON object in model response")
+    return {str(k): str(v) for k, v in json.loads(text[start:end + 1]).items()}
+
+
+def _run_batch(model, batch, cutoff):
+    if cutoff is not None and time.monotonic() > cutoff:
+        return None
+    prompt = BATCH_HEADER + ''.join(block for _, _, block in batch)
+    return parse_response(model.generate_content(prompt).text)
+
+
+def generate_all(model=None, workers=8, token_budget=6000, max_orgs=25, days=90, deadline=None):
+    """
+    Generate and store insights for every organisation.
+
+    ``deadline`` (seconds) stops starting new calls once exceeded; the
+    organisations not reached keep their previous insight. Organisations
+    with no listings in the last ``days`` are not sent to the model.
+    """
+    started = time.monotonic()
+    model = model or ai_core.get_model()
+    status = getattr(model, 'status', 'real')
+    contexts = collect_contexts(days=days)
+    stats = RunStats(organisations=len(contexts))
+    # Nothing to predict from: leave these out of the prompts (and keep any older insight)
+    contexts = {org_id: rows for org_id, rows in contexts.items() if rows}
+    stats.no_history = stats.organisations - len(contexts)
+    batches = list(pack_batches(contexts, token_budget=token_budget, max_orgs=max_orgs))
+
+    cutoff = started + deadline if deadline is not None else None
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='insights') as pool:
+        futures = {pool.submit(_run_batch, model, batch, cutoff): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                insights = future.result()
+            except Exception as e:
+                stats.calls += 1
+                stats.failed += len(batch)
+                stats.errors.append(str(e))
+                logger.warning("Insight batch of %d organisations failed: %s", len(batch), e)
+                continue
+            if insights is None:
+                stats.skipped += len(batch)
+                continue
+            stats.calls += 1
+            for org_id, considered, _ in batch:
+                text = insights.get(str(org_id))
+                if text:
+                    results[org_id] = (text, considered)
+                else:
+                    stats.failed += 1
+
+    now = timezone.now()
+    rows = [
+        AIInsight(user_id=org_id, prediction=text, status=status, listings_considered=considered, generated_at=now)
+        for org_id, (text, considered) in results.items()
+    ]
+    AIInsight.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['prediction', 'status', 'listings_considered', 'generated_at'],
+    )
+    stats.stored = len(rows)
+    stats.elapsed = time.monotonic() - started
+    return stats
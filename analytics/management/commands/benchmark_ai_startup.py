@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+from foodsaver.benchmarking import summary_ms
+
+# Run in a fresh interpreter per sample, so every import is paid again.
+# Prints {"startup": s, "first_call": s, "rss": [after startup, after first call]}
+# as JSON, RSS being the peak so far in bytes.
+PROBE = """
+import json, resource, sys, time
+
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+start = time.perf_counter()
+import django
+django.setup()
+from foodsaver import ai_core
+if {eager}:
+    ai_core.get_model()
+startup = time.perf_counter() - start
+startup_rss = peak_rss()
+
+start = time.perf_counter()
+ai_core.get_model()
+first_call = time.perf_counter() - start
+
+print(json.dumps({{'startup': startup, 'first_call': first_call, 'rss': [startup_rss, peak_rss()]}}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare lazy and eager initialisation of the AI client (foodsaver.ai_core): time to set up "
+        "Django and import ai_core, time of the first get_model() call and peak RSS after each, "
+        "measured in --repeat fresh interpreters. Eager is what AI_WARM_UP does (minus its thread). Makes no "
+        "API calls and needs no database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help="Fresh interpreters per mode.")
+
+    def probe(self, eager):
+        env = dict(os.environ, PYTHONWARNINGS='ignore')
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE.format(eager=eager)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(out.splitlines()[-1])
+
+    def handle(self, *args, **options):
+        for label, eager in (('lazy', False), ('eager', True)):
+            samples = [self.probe(eager) for _ in range(options['repeat'])]
+            startup = sorted(sample['startup'] for sample in samples)
+            first_call = sorted(sample['first_call'] for sample in samples)
+            self.stdout.write(f"{label:6} startup     {summary_ms(startup)}")
+            self.stdout.write(f"{label:6} first call  {summary_ms(first_call)}")
+            for index, moment in enumerate(('startup', 'first call')):
+                rss = sorted(sample['rss'][index] for sample in samples)
+                self.stdout.write(f"{label:6} peak RSS after {moment:10} {rss[len(rss) // 2] / 2**20:6.1f} MiB (median)")
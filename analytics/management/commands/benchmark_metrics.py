@@ -0,0 +1,64 @@
+import time
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from foodsaver import metrics
+from foodsaver.benchmarking import scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-observation overhead of foodsaver.metrics with timeit (best of --repeat "
+        "runs of --number calls each), the query timer's cost on SELECT 1 and the time to render "
+        "/metrics. Runs against a throwaway database and leaves METRICS_DIR alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=1_000_000, help="Calls per timeit run.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def per_call_us(self, func, number):
+        return min(timeit.repeat(func, number=number, repeat=self.repeat)) / number * 1e6
+
+    def handle(self, *args, **options):
+        number, self.repeat = options['number'], options['repeat']
+        histogram, counter = metrics.REQUEST_DURATION, metrics.OTP_VERIFICATIONS
+        child = histogram.labels('listing_api', 'GET', '200')
+        cases = (
+            ('labels().observe()', lambda: histogram.labels('listing_api', 'GET', '200').observe(0.0123)),
+            ('labels().inc()', lambda: counter.labels('verified').inc()),
+            ('timing plus observe', lambda: histogram.labels('listing_api', 'GET', '200').observe(
+                time.perf_counter() - time.perf_counter())),
+            ('child.observe()', lambda: child.observe(0.0123)),
+            ('maybe_flush (not due)', metrics.maybe_flush),
+            ('empty call (baseline)', lambda: None),
+        )
+        # Nothing measured here may reach the shared totals of the real processes
+        with scratch_database(), override_settings(METRICS_DIR=None):
+            try:
+                metrics.exporter.next_flush = float('inf')
+                for label, func in cases:
+                    self.stdout.write(f"{label:28} {self.per_call_us(func, number):8.3f} us")
+
+                queries = max(number // 50, 1)
+                with connection.cursor() as cursor:
+                    timed = self.per_call_us(lambda: cursor.execute('SELECT 1'), queries)
+                connection.execute_wrappers.remove(metrics._time_query)
+                try:
+                    with connection.cursor() as cursor:
+                        bare = self.per_call_us(lambda: cursor.execute('SELECT 1'), queries)
+                finally:
+                    connection.execute_wrappers.append(metrics._time_query)
+                self.stdout.write(f"{'query timer on SELECT 1':28} {bare:8.2f} us bare, {timed:.2f} us timed")
+
+                start = time.perf_counter()
+                for _ in range(100):
+                    metrics.render()
+                self.stdout.write(f"{'render /metrics':28} {(time.perf_counter() - start) * 10:8.2f} ms")
+            finally:
+                for metric in metrics.REGISTRY.values():
+                    metric.reset()
+                metrics.exporter.next_flush = 0.0
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from analytics import insights
+
+
+class Command(BaseCommand):
+    help = "Generate and store AI surplus insights for every donor and NGO (run nightly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent model calls.")
+        parser.add_argument('--token-budget', type=int, default=6000, help="Estimated prompt tokens per call.")
+        parser.add_argument('--orgs-per-call', type=int, default=25, help="Most organisations packed into one call.")
+        parser.add_argument('--days', type=int, default=90, help="How far back to look for listings.")
+        parser.add_argument('--deadline', type=float, default=None,
+                            help="Stop starting new calls after this many seconds.")
+        parser.add_argument('--model', choices=('gemini', 'local'), default='gemini',
+                            help="'local' uses an offline stand-in model for dry runs.")
+
+    def handle(self, *args, **options):
+        model = insights.LocalStandInModel() if options['model'] == 'local' else None
+        stats = insights.generate_all(
+            model=model,
+            workers=options['workers'],
+            token_budget=options['token_budget'],
+            max_orgs=options['orgs_per_call'],
+            days=options['days'],
+            deadline=options['deadline'],
+        )
+        for error in stats.errors[:5]:
+            self.stderr.write(f"  {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {stats.stored}/{stats.organisations} insights in {stats.calls} calls "
+            f"({stats.failed} failed, {stats.skipped} skipped, {stats.no_history} without recent listings) "
+            f"in {stats.elapsed:.1f}s."
+        ))
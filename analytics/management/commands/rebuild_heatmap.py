@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from analytics.heatmap import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the surplus heatmap from live and archived listings (e.g. after changing HEATMAP_CELL_DEGREES)."
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the heatmap from {count} finished listings."))
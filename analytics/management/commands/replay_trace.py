@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foodsaver import traces
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a request trace recorded with TRACE_FILE against this project's database "
+        "and report throughput, errors and latency per view. Point it at a seeded copy: "
+        "POSTs are replayed too unless --get-only is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help="Trace file written by TraceMiddleware.")
+        parser.add_argument('--speed', type=float, default=1.0, help="Replay this many times faster (e.g. 1 to 50).")
+        parser.add_argument('--workers', type=int, default=8, help="Requests in flight at once.")
+        parser.add_argument('--get-only', action='store_true', help="Skip requests that change data.")
+
+    def handle(self, *args, **options):
+        if settings.TRACE_FILE:
+            raise CommandError("Unset TRACE_FILE first, or the replay would be recorded too.")
+        if options['speed'] <= 0 or options['workers'] < 1:
+            raise CommandError("--speed must be positive and --workers at least 1.")
+        try:
+            entries = traces.read_trace(options['trace'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {options['trace']}: {e}")
+
+        replayer = traces.Replayer(entries, options['speed'], options['workers'], options['get_only'])
+        elapsed = replayer.run()
+        for role in sorted(replayer.unmapped_roles):
+            self.stderr.write(f"  No active '{role}' user to replay as; those requests were sent signed out.")
+        per_view, total = traces.report(replayer.results, elapsed)
+        if total is None:
+            self.stdout.write("Nothing to replay.")
+            return
+
+        header = f"{'view':40} {'requests':>8} {'req/s':>8} {'errors':>7} {'4xx':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        self.stdout.write(header)
+        for row in per_view + [total]:
+            self.stdout.write(f"{row[0][:40]:40} {row[1]:8d} {row[2]:8.1f} {row[3]:7d} {row[4]:6d} "
+                              f"{row[5]:8.1f} {row[6]:8.1f} {row[7]:8.1f}")
+        behind = max(lateness for *_, lateness in replayer.results)
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {total[1]} requests in {elapsed:.1f}s at {options['speed']:g}x "
+            f"with {options['workers']} workers; at worst {behind * 1000:.0f} ms behind schedule."
+        ))
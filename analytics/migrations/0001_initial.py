@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('users', '0006_user_trust_evidence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIInsight',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ai_insight', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('prediction', models.TextField()),
+                ('status', models.CharField(choices=[('real', 'Generated'), ('mock', 'Stand-in model'), ('error', 'Error')], default='real', max_length=10)),
+                ('listings_considered', models.PositiveIntegerField(default=0)),
+                ('generated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'AI insight',
+                'verbose_name_plural': 'AI insights',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurplusCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_y', models.IntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('hour_of_week', models.PositiveSmallIntegerField()),
+                ('food_type', models.CharField(blank=True, max_length=20)),
+                ('completed_kg', models.FloatField(default=0)),
+                ('expired_kg', models.FloatField(default=0)),
+                ('completed_listings', models.PositiveIntegerField(default=0)),
+                ('expired_listings', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('food_type', 'hour_of_week', 'cell_y', 'cell_x'), name='surplus_cell_key')],
+            },
+        ),
+    ]
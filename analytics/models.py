@@ -1,3 +1,67 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class AIInsight(models.Model):
+    """
+    Latest AI surplus insight for an organisation (donor or NGO).
+
+    Written in bulk by ``manage.py generate_insights``; dashboards only read it.
+    """
+    STATUS_CHOICES = (
+        ('real', 'Generated'),
+        ('mock', 'Stand-in model'),
+        ('error', 'Error'),
+    )
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='ai_insight')
+    prediction = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='real')
+    listings_considered = models.PositiveIntegerField(default=0)
+    generated_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'AI insight'
+        verbose_name_plural = 'AI insights'
+
+    def as_prediction(self):
+        """The dict shape returned by ``get_surplus_prediction``, for templates."""
+        return {
+            'prediction': self.prediction,
+            'status': self.status,
+            'generated_at': self.generated_at,
+        }
+
+    def __str__(self):
+        return f"Insight for user #{self.user_id} ({self.generated_at:%Y-%m-%d %H:%M})"
+
+
+class SurplusCell(models.Model):
+    """
+    Kg of finished listings in one grid cell, hour of the week and food type.
+
+    Each listing is also added to the cell's "any hour" and "any food" rows,
+    so unfiltered heatmaps read one row per cell. Maintained incrementally by
+    ``analytics.heatmap``; heatmap tiles read only these rows, never listing
+    history.
+    """
+    ANY_HOUR = 168
+    ANY_FOOD = ''
+
+    cell_y = models.IntegerField()  # floor(latitude / HEATMAP_CELL_DEGREES)
+    cell_x = models.IntegerField()  # floor(longitude / HEATMAP_CELL_DEGREES)
+    hour_of_week = models.PositiveSmallIntegerField()  # 0 = Monday 00:00-01:00 local time; ANY_HOUR for all
+    food_type = models.CharField(max_length=20, blank=True)  # ANY_FOOD for all
+    completed_kg = models.FloatField(default=0)
+    expired_kg = models.FloatField(default=0)
+    completed_listings = models.PositiveIntegerField(default=0)
+    expired_listings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index tiles read by: one filter combination, a range of rows, then of columns
+            models.UniqueConstraint(fields=['food_type', 'hour_of_week', 'cell_y', 'cell_x'], name='surplus_cell_key'),
+        ]
+
+    def __str__(self):
+        return f"Cell ({self.cell_y}, {self.cell_x}) hour {self.hour_of_week} {self.food_type or 'any food'}"
@@ -0,0 +1,25 @@
+import logging
+
+from jobs.queue import periodic
+
+from . import heatmap, insights
+
+logger = logging.getLogger(__name__)
+
+
+@periodic(24 * 60 * 60)
+def generate_insights():
+    """Nightly AI surplus insights for every donor and NGO (as ``manage.py generate_insights``)."""
+    stats = insights.generate_all()
+    logger.info(
+        "Stored %d/%d insights in %d calls (%d failed) in %.1fs",
+        stats.stored, stats.organisations, stats.calls, stats.failed, stats.elapsed,
+    )
+
+
+@periodic(5 * 60)
+def roll_up_heatmap():
+    """Add listings completed or expired since the last run to the surplus heatmap."""
+    counted = heatmap.roll_up()
+    if counted:
+        logger.info("Added %d finished listings to the heatmap", counted)
@@ -1,3 +1,464 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from foodsaver import ai_core, aio, metrics, storage, traces
+from foodsaver.templatetags import responsive_images
+from users.models import User
+from foodsaver.microcache import MicroCache, micro_cache
+
+from listings.models import Listing
+
+from . import heatmap, insights, views
+from .models import AIInsight, SurplusCell
+
+
+def _history(rows, days=180, seed=1):
+    rng = random.Random(seed)
+    start = date(2026, 1, 1)
+    return [
+        {
+            'date': (start + timedelta(days=rng.randrange(days))).isoformat(),
+            'quantity': round(rng.uniform(0.5, 40), 1),
+            'food_type': rng.choice(['Cooked Meals', 'Bakery', 'Vegetables', 'Fruits', 'Dairy']),
+        }
+        for _ in range(rows)
+    ]
+
+
+class PromptCompactionTests(SimpleTestCase):
+    def test_prompt_length_is_bounded_for_10k_rows(self):
+        short = ai_core.build_prompt(_history(10))
+        prompt = ai_core.build_prompt(_history(10_000))
+        overhead = len(ai_core.build_prompt([])) - len(ai_core.format_context([]))
+        self.assertLessEqual(len(prompt), ai_core.CONTEXT_CHAR_BUDGET + overhead)
+        self.assertLessEqual(len(ai_core.format_context(_history(10_000), budget=800)), 800)
+        self.assertIn('By food type', prompt)
+        self.assertNotIn('By food type', short)
+
+    def test_compaction_keeps_totals_and_anomalies(self):
+        data = [{'date': '2026-03-02', 'quantity': 10, 'food_type': 'Bakery'} for _ in range(20)]
+        data += [{'date': f'2026-03-{d:02d}', 'quantity': 5, 'food_type': 'Fruits'} for d in range(3, 31)]
+        context = ai_core.compact_context(data)
+        self.assertIn('48 donations, 340kg in total', context)
+        self.assertIn('2026-03-02 (Mon): 200kg', context)
+
+
+class FakeInsightModel:
+    """Answers every organisation in a prompt, except that it raises for prompts naming ``fail_for`` and leaves out ``omit``."""
+
+    status = 'real'
+
+    def __init__(self, fail_for=(), omit=(), run=1):
+        self.fail_for, self.omit, self.run = set(fail_for), set(omit), run
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def generate_content(self, prompt):
+        orgs = [int(org_id) for org_id in insights._ORG_RE.findall(prompt)]
+        with self.lock:
+            self.prompts.append(orgs)
+        if self.fail_for & set(orgs):
+            raise RuntimeError("quota exceeded")
+        text = json.dumps({org_id: f"Run {self.run} insight for {org_id}" for org_id in orgs if org_id not in self.omit})
+        return type('Response', (), {'text': f"```json\n{text}\n```"})()
+
+
+class InsightGenerationTests(TestCase):
+    def setUp(self):
+        self.orgs = []
+        for n in range(5):
+            donor = User.objects.create(username=f'donor{n}', role='donor')
+            Listing.objects.create(
+                donor=donor, food_type='cooked', quantity_kg=n + 1, description='Rice',
+                expiry_time=timezone.now() + timedelta(hours=2),
+            )
+            self.orgs.append(donor.pk)
+        self.quiet = User.objects.create(username='quiet', role='claimant').pk
+
+    def test_organisations_are_batched_and_quiet_ones_left_out(self):
+        model = FakeInsightModel()
+        stats = insights.generate_all(model=model, workers=2, max_orgs=2)
+        self.assertEqual(len(model.prompts), 3)
+        self.assertTrue(all(len(orgs) <= 2 for orgs in model.prompts))
+        self.assertEqual(sorted(org for orgs in model.prompts for org in orgs), self.orgs)
+        self.assertEqual((stats.organisations, stats.no_history, stats.calls, stats.stored), (6, 1, 3, 5))
+        self.assertFalse(AIInsight.objects.filter(user_id=self.quiet).exists())
+
+    def test_failed_batches_and_missing_answers_are_counted(self):
+        with self.assertLogs('analytics.insights', 'WARNING'):
+            stats = insights.generate_all(
+                model=FakeInsightModel(fail_for=[self.orgs[0]], omit=[self.orgs[4]]), workers=1, max_orgs=2,
+            )
+        # orgs 0 and 1 shared the failing call; 4 was left out of its answer
+        self.assertEqual((stats.calls, stats.failed, stats.stored), (3, 3, 2))
+        self.assertEqual(stats.errors, ["quota exceeded"])
+        self.assertEqual(sorted(AIInsight.objects.values_list('user_id', flat=True)), self.orgs[2:4])
+
+    def test_rerun_updates_rows_in_place(self):
+        insights.generate_all(model=FakeInsightModel(run=1), workers=2, max_orgs=2)
+        stats = insights.generate_all(model=FakeInsightModel(run=2), workers=2, max_orgs=2)
+        self.assertEqual(stats.stored, 5)
+        self.assertEqual(AIInsight.objects.count(), 5)
+        self.assertEqual(
+            set(AIInsight.objects.values_list('prediction', flat=True)),
+            {f"Run 2 insight for {org_id}" for org_id in self.orgs},
+        )
+
+
+class FakeStreamingModel:
+    """Streams ``chunks`` one at a time, recording how many were produced and whether the stream was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.produced = 0
+        self.closed = False
+
+    def generate_content(self, prompt, stream=False):
+        def stream_chunks():
+            try:
+                for text in self.chunks:
+                    self.produced += 1
+                    yield type('Chunk', (), {'text': text})()
+            finally:
+                self.closed = True
+        return type('Response', (), {'__iter__': lambda response: stream_chunks()})()
+
+
+class PredictionStreamTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='donor', role='donor'))
+        self.model = FakeStreamingModel(['Expect ', 'more ', 'rice ', 'on Friday.'])
+        patcher = mock.patch.object(ai_core, 'get_model', return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_token_is_sent_before_the_model_finishes(self):
+        response = self.client.get(reverse('predict_surplus_stream'))
+        first = next(iter(response.streaming_content))
+        self.assertEqual(first.decode(), 'event: token\ndata: "Expect "\n\n')
+        self.assertEqual(self.model.produced, 1)
+        response.close()
+
+    def test_closing_the_response_closes_the_model_stream(self):
+        response = self.client.get(reverse('predict_surplus_stream'))
+        next(iter(response.streaming_content))
+        response.close()  # what the server does when the client goes away
+        self.assertTrue(self.model.closed)
+        self.assertEqual(self.model.produced, 1)
+        self.assertFalse(AIInsight.objects.exists())
+
+    def test_finished_stream_is_stored(self):
+        response = self.client.get(reverse('predict_surplus_stream'))
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith('event: done\ndata: ""\n\n'))
+        self.assertTrue(self.model.closed)
+        self.assertEqual(AIInsight.objects.get().prediction, 'Expect more rice on Friday.')
+
+
+class MicroCacheTests(SimpleTestCase):
+    def setUp(self):
+        views.predict_surplus.micro_cache.clear()
+
+    def test_concurrent_requests_share_one_computation(self):
+        calls = []
+
+        def slow_prediction():
+            calls.append(1)
+            time.sleep(0.5)
+            return {'prediction': 'More bread on Mondays', 'status': 'real'}
+
+        factory = RequestFactory()
+        barrier = threading.Barrier(1000)
+        bodies = []
+
+        def client():
+            request = factory.get('/analytics/predict/')
+            request.user = AnonymousUser()
+            barrier.wait()
+            bodies.append(views.predict_surplus(request).content)
+
+        with mock.patch.object(views, 'get_surplus_prediction', slow_prediction):
+            threads = [threading.Thread(target=client) for _ in range(1000)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(bodies), 1000)
+        self.assertEqual(set(bodies), {b'{"message": "More bread on Mondays"}'})
+
+    def test_failed_predictions_are_not_cached(self):
+        answers = iter([
+            {'prediction': 'AI Experience Error: quota exceeded', 'status': 'error'},
+            {'prediction': 'More bread on Mondays', 'status': 'real'},
+            {'prediction': 'Fewer apples in June', 'status': 'real'},
+        ])
+        with mock.patch.object(views, 'get_surplus_prediction', lambda: next(answers)):
+            failed = self.client.get('/analytics/predict/')
+            self.assertIn('no-store', failed['Cache-Control'])
+            self.assertEqual(self.client.get('/analytics/predict/').json(), {'message': 'More bread on Mondays'})
+            self.assertEqual(self.client.get('/analytics/predict/').json(), {'message': 'More bread on Mondays'})
+
+    def test_stale_response_is_served_while_one_refresh_runs(self):
+        store = MicroCache(ttl=0, stale=60, max_entries=10)
+        versions = iter(['v1', 'v2', 'v3'])
+        refreshed = threading.Event()
+
+        def render():
+            response = HttpResponse(next(versions))
+            if response.content == b'v2':
+                refreshed.set()
+            return response, True
+
+        self.assertEqual(store.get('k', render).content, b'v1')
+        self.assertEqual(store.get('k', render).content, b'v1')  # stale: served at once, refreshed behind
+        self.assertTrue(refreshed.wait(5))
+        while store._flights:
+            time.sleep(0.01)
+        self.assertEqual(store._entries['k'].content, b'v2')
+
+    def test_refresh_renders_a_new_anonymous_request(self):
+        seen = []
+
+        @micro_cache(ttl=0, stale=60, anonymous_only=False)
+        def view(request, tile):
+            seen.append((request, request.user, request.path, request.GET.dict(), request.get_host(), tile))
+            return HttpResponse(str(len(seen)))
+
+        request = RequestFactory().get('/tiles/3/', {'food_type': 'bakery'})
+        request.user = mock.Mock(is_authenticated=True)
+        with mock.patch('foodsaver.microcache.close_old_connections') as close_old_connections:
+            self.assertEqual(view(request, 3).content, b'1')
+            self.assertEqual(view(request, 3).content, b'1')  # stale: refreshed behind
+            while view.micro_cache._flights or len(seen) < 2:
+                time.sleep(0.01)
+        close_old_connections.assert_called_once_with()
+        refresh, user, path, query, host, tile = seen[1]
+        self.assertIsNot(refresh, request)
+        self.assertIsInstance(user, AnonymousUser)
+        self.assertEqual((path, query, host, tile), ('/tiles/3/', {'food_type': 'bakery'}, 'testserver', 3))
+        self.assertEqual(view.micro_cache._entries['/tiles/3/?food_type=bakery'].content, b'2')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        for metric in metrics.REGISTRY.values():
+            metric.reset()
+
+    def test_histogram_exposition(self):
+        with mock.patch.object(ai_core, 'API_KEY', ''):
+            ai_core.get_surplus_prediction()
+        text = metrics.render()
+        self.assertIn('# TYPE foodsaver_ai_prediction_duration_seconds histogram', text)
+        self.assertIn('foodsaver_ai_prediction_duration_seconds_bucket{status="error",le="0.25"} 1', text)
+        self.assertIn('foodsaver_ai_prediction_duration_seconds_bucket{status="error",le="+Inf"} 1', text)
+        self.assertIn('foodsaver_ai_prediction_duration_seconds_count{status="error"} 1', text)
+        self.assertIn('foodsaver_jobs_due 0', text)
+
+    def test_totals_from_every_process(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            other = {'foodsaver_otp_verifications_total': [[['verified'], 2]]}
+            with open(os.path.join(directory, f'{os.getpid() + 1}.json'), 'w') as f:
+                json.dump(other, f)
+            metrics.OTP_VERIFICATIONS.labels('verified').inc()
+            text = metrics.render()
+            self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
+        self.assertIn('foodsaver_otp_verifications_total{outcome="verified"} 3', text)
+
+    @override_settings(METRICS_BEARER_TOKEN='s3cret')
+    def test_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        AIInsight.objects.exists()
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn(
+            'foodsaver_http_request_duration_seconds_count{view="metrics",method="GET",status="403"} 1',
+            response.content.decode(),
+        )
+        self.assertIn('foodsaver_db_query_duration_seconds_count{alias="default"}', response.content.decode())
+
+
+class GatherReadsTests(TransactionTestCase):
+    def read(self):
+        return threading.get_ident(), Listing.objects.count()
+
+    def test_reads_run_at_once_on_their_own_connections(self):
+        donor = User.objects.create(username='donor', role='donor')
+        Listing.objects.create(donor=donor, food_type='cooked', quantity_kg=1, description='Rice',
+                               expiry_time=timezone.now() + timedelta(hours=1))
+        started = threading.Barrier(3, timeout=5)
+
+        def overlapping():
+            started.wait()  # times out unless all three calls are in flight together
+            return self.read()
+
+        # The in-memory test database is shared between connections here (no transaction)
+        with mock.patch.object(aio, '_in_request_thread_if_shared', return_value=None):
+            results = async_to_sync(aio.gather_reads)(*[(overlapping,)] * 3)
+        self.assertEqual([count for _, count in results], [1, 1, 1])
+        self.assertEqual(len({thread for thread, _ in results}), 3)
+        self.assertNotIn(threading.get_ident(), {thread for thread, _ in results})
+
+    def test_reads_stay_on_the_request_thread_inside_a_transaction(self):
+        with transaction.atomic():
+            results = async_to_sync(aio.gather_reads)((self.read,), (self.read,))
+        self.assertEqual(results, [(threading.get_ident(), 0)] * 2)
+
+
+class TraceTests(TransactionTestCase):
+    def test_record_and_replay(self):
+        donor = User.objects.create_user('donor', password='pw', role='donor')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.jsonl')
+            with override_settings(TRACE_FILE=path):
+                self.client.get('/listings/api/search/', {'q': 'biryani', 'lat': '12.97161'})
+                self.client.force_login(donor)
+                self.client.get('/listings/dashboard/')
+                self.client.get(f'/users/profile/{donor.pk}/')
+                self.client.get('/analytics/heatmap/12/2926/1706.json')
+            entries = traces.read_trace(path)
+
+        search, dashboard, profile, tile = entries
+        self.assertEqual((search['v'], search['q'], search['u']), ('listing_search', {'q': 'xxxxxxx', 'lat': '12.97'}, ''))
+        self.assertEqual((dashboard['v'], dashboard['r'], dashboard['s']), ('donor_dashboard', 'donor', 200))
+        self.assertEqual(dashboard['u'], traces.pseudonym(donor.pk))
+        self.assertEqual(profile['k'], {'user_id': traces.pseudonym(donor.pk)})  # no raw user ids
+        self.assertEqual(tile['k'], {'z': '12', 'x': '2926', 'y': '1706'})
+
+        replayer = traces.Replayer(entries, speed=50, workers=2)
+        per_view, total = traces.report(replayer.results, replayer.run())
+        self.assertEqual(
+            sorted(row[0] for row in per_view), ['donor_dashboard', 'heatmap_tile', 'listing_search', 'profile_view'],
+        )
+        self.assertEqual(total[1], 4)
+        # The dashboard ran signed in, and the profile URL named the user standing in for the donor
+        self.assertEqual([status for _, status, _, _ in replayer.results], [200, 200, 200, 200])
+
+
+class HeatmapTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create_user('donor', password='pw', role='donor', latitude=28.705, longitude=77.103)
+        self.elsewhere = User.objects.create_user('far', password='pw', role='donor', latitude=-33.87, longitude=151.21)
+        views.heatmap_tile.micro_cache.clear()
+
+    def _listing(self, donor, status, kg, food_type='cooked'):
+        listing = Listing.objects.create(
+            donor=donor, food_type=food_type, quantity_kg=kg, description='Rice',
+            expiry_time=timezone.now() + timedelta(hours=2),
+        )
+        Listing.objects.filter(pk=listing.pk).update(status=status)
+        return listing
+
+    def test_finished_listings_are_counted_once(self):
+        self._listing(self.donor, 'completed', 5)
+        self._listing(self.donor, 'expired', 2)
+        self._listing(self.donor, 'active', 9)
+        self.assertEqual(heatmap.roll_up(), 2)
+        self.assertEqual(heatmap.roll_up(), 0)
+        self.assertEqual(SurplusCell.objects.count(), 4)  # the hour and any hour, cooked and any food
+        cell = SurplusCell.objects.get(hour_of_week=SurplusCell.ANY_HOUR, food_type=SurplusCell.ANY_FOOD)
+        self.assertEqual((cell.cell_y, cell.cell_x), (2870, 7710))
+        self.assertEqual((cell.completed_kg, cell.expired_kg, cell.completed_listings, cell.expired_listings), (5, 2, 1, 1))
+
+        self._listing(self.donor, 'completed', 1.5)
+        heatmap.roll_up()
+        cell.refresh_from_db()
+        self.assertEqual(cell.completed_kg, 6.5)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        for n in range(6):
+            self._listing(self.donor if n % 2 else self.elsewhere, ('completed', 'expired')[n % 3 == 0], n + 1,
+                          food_type=('cooked', 'raw')[n % 2])
+        heatmap.roll_up(batch_size=4)
+        incremental = sorted(SurplusCell.objects.values_list(
+            'cell_y', 'cell_x', 'hour_of_week', 'food_type', 'completed_kg', 'expired_kg'))
+        self.assertEqual(heatmap.rebuild(), 6)
+        self.assertEqual(sorted(SurplusCell.objects.values_list(
+            'cell_y', 'cell_x', 'hour_of_week', 'food_type', 'completed_kg', 'expired_kg')), incremental)
+
+    def test_tile_reads_only_rollups(self):
+        listing = self._listing(self.donor, 'completed', 4)
+        self._listing(self.donor, 'expired', 3, food_type='raw')
+        self._listing(self.elsewhere, 'completed', 8)
+        heatmap.roll_up()
+        hour = heatmap.hour_of_week(listing.created_at)
+        # The z=10 tile containing the donor
+        url = reverse('heatmap_tile', kwargs={'z': 10, 'x': 731, 'y': 426})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['fields'], ['lat', 'lng', 'completed_kg', 'expired_kg', 'listings'])
+        self.assertEqual(data['cells'], [[28.7, 77.1, 4, 3, 2]])
+        self.assertIn('max-age', response['Cache-Control'])
+
+        only_raw = self.client.get(url, {'food_type': 'raw', 'days': '0-6', 'hours': f'{hour % 24}'}).json()
+        self.assertEqual(only_raw['cells'], [[28.7, 77.1, 0, 3, 1]])
+        whole_world = self.client.get(reverse('heatmap_tile', kwargs={'z': 0, 'x': 0, 'y': 0})).json()
+        self.assertEqual(len(whole_world['cells']), 2)
+        self.assertEqual(self.client.get(url, {'hours': '25'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('heatmap_tile', kwargs={'z': 1, 'x': 2, 'y': 0})).status_code, 400)
+
+
+class StaticAssetTests(SimpleTestCase):
+    def setUp(self):
+        source, self.root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (source, self.root):
+            self.addCleanup(shutil.rmtree, directory)
+        os.makedirs(os.path.join(source, 'images'))
+        os.makedirs(os.path.join(source, 'css'))
+        from PIL import Image
+
+        Image.new('RGB', (600, 300), (30, 120, 60)).save(os.path.join(source, 'images', 'hero.png'))
+        with open(os.path.join(source, 'css', 'site.css'), 'w') as fh:
+            fh.write('.hero { background: url("../images/hero.png"); }\n' * 50)
+        overridden = override_settings(STATICFILES_DIRS=[source], STATIC_ROOT=self.root, DEBUG=False)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        for cached in (responsive_images._variant_url, responsive_images.srcset_for):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def served(self, url):
+        return os.path.join(self.root, url.removeprefix('/static/'))
+
+    def test_collectstatic_writes_hashed_names_that_resolve(self):
+        call_command('collectstatic', interactive=False, verbosity=0, stdout=io.StringIO(), ignore_patterns=['admin'])
+
+        css = staticfiles_storage.url('css/site.css')
+        self.assertRegex(css, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        hero = staticfiles_storage.url('images/hero.png')
+        with open(self.served(css)) as fh:
+            self.assertIn(f'url("../images/{os.path.basename(hero)}")', fh.read())
+        self.assertTrue(os.path.exists(self.served(hero)))
+        self.assertTrue(os.path.exists(self.served(css) + '.gz'))  # repetitive CSS compresses well
+
+        html = Template("{% load responsive_images %}{% responsive_image 'images/hero.png' alt='Hero' %}").render(Context())
+        self.assertIn(f'src="{hero}"', html)
+        if storage.variant_formats():
+            self.assertIn('<picture>', html)
+            for fmt in storage.variant_formats():
+                variant = staticfiles_storage.url(storage.variant_name('images/hero.png', 480, fmt))
+                self.assertIn(f'{variant} 480w', html)
+                self.assertTrue(os.path.exists(self.served(variant)))
+            self.assertNotIn('960w', html)  # wider than the source
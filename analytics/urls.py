@@ -5,5 +5,8 @@ urlpatterns = [
     path('dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('leaderboard/', views.leaderboard_view, name='leaderboard'),
     path('predict/', views.predict_surplus, name='predict_surplus'),
+    path('predict/stream/', views.predict_surplus_stream, name='predict_surplus_stream'),
     path('insights/', views.analytics_dashboard, name='analytics_dashboard'),
+    path('heatmap/<int:z>/<int:x>/<int:y>.json', views.heatmap_tile, name='heatmap_tile'),
+    path('insights/listings/', views.analytics_listings_more, name='analytics_listings_more'),
 ]
@@ -1,17 +1,21 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
-from listings.models import Listing, Claim
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from listings.models import Claim, ArchivedClaim, ArchivedListing
+from listings.pagination import cached_stat, keyset_page, load_more
+from users.models import ImpactStats
+from .models import AIInsight
 from django.contrib.auth import get_user_model
+from foodsaver.microcache import micro_cache
 
 @login_required
 def admin_dashboard(request):
     if request.user.role != 'admin' and not request.user.is_superuser:
         return redirect('dashboard')
 
-    # Impact Metrics
-    completed_claims = Claim.objects.filter(status='completed')
-    total_kg = completed_claims.aggregate(Sum('listing__quantity_kg'))['listing__quantity_kg__sum'] or 0
+    # Impact Metrics (kg received across NGOs = kg of every completed claim, archived ones included)
+    total_kg = ImpactStats.objects.aggregate(total=Sum('kg_received'))['total'] or 0
     
     meals_served = int(total_kg * 3)
     co2_saved = round(total_kg * 3.5, 2)
@@ -32,19 +36,20 @@ def admin_dashboard(request):
     })
 
 
-
+@micro_cache(ttl=30, stale=300)
 def leaderboard_view(request):
     User = get_user_model()
     
-    # Aggregate data for all donors
-    # In a real app, this should be efficiently cached or pre-calculated
+    # Aggregate data for all donors (anonymous visitors share one cached copy)
+    archived_kg = ArchivedListing.objects.filter(donor=OuterRef('pk')).values('donor').annotate(
+        kg=Sum('quantity_kg')
+    ).values('kg')
     donors = User.objects.filter(role='donor').annotate(
-        total_donated_kg=Sum('listings__quantity_kg', default=0)
+        total_donated_kg=Sum('listings__quantity_kg', default=0) + Coalesce(Subquery(archived_kg), 0.0)
     ).order_by('-total_donated_kg')[:10]
     
     # Global Stats
-    completed_claims = Claim.objects.filter(status='completed')
-    total_kg = completed_claims.aggregate(Sum('listing__quantity_kg'))['listing__quantity_kg__sum'] or 0
+    total_kg = ImpactStats.objects.aggregate(total=Sum('kg_received'))['total'] or 0
     meals_served = int(total_kg * 3)
     active_donors = User.objects.filter(role='donor').count()
 
@@ -55,12 +60,74 @@ def leaderboard_view(request):
         'active_donors': active_donors
     })
 
-from django.http import JsonResponse
-from foodsaver.ai_core import get_surplus_prediction
+import json
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import add_never_cache_headers
+from foodsaver.ai_core import get_surplus_prediction, stream_surplus_prediction
+from . import heatmap, insights
 
+# The same prediction for everyone, so signed-in users share it too
+@micro_cache(ttl=60, stale=600, anonymous_only=False)
 def predict_surplus(request):
     data = get_surplus_prediction()
-    return JsonResponse({'message': data['prediction']})
+    response = JsonResponse({'message': data['prediction']})
+    if data['status'] != 'real':
+        add_never_cache_headers(response)  # an AI failure must not be shared or kept
+    return response
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required
+def predict_surplus_stream(request):
+    """
+    Server-sent events stream of a fresh insight for the current organisation.
+
+    Emits ``token`` events as the model produces text, then ``done`` (or
+    ``error``). If the client goes away the server closes the response,
+    which closes the model stream as well.
+    """
+    if request.user.role not in ('donor', 'claimant'):
+        return JsonResponse({'error': 'Only donors and NGOs have insights.'}, status=403)
+
+    context_data = insights.recent_context(request.user)
+    user_id = request.user.pk
+
+    def events():
+        stream = stream_surplus_prediction(context_data)
+        parts = []
+        try:
+            for text in stream:
+                parts.append(text)
+                yield _sse('token', text)
+        except Exception as e:
+            yield _sse('error', f"AI Experience Error: {str(e)}")
+            return
+        finally:
+            stream.close()
+        prediction = ''.join(parts)
+        insights.store(user_id, prediction, listings_considered=len(context_data))
+        yield _sse('done', '')
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+
+def _claimed_listings(user):
+    return Claim.objects.filter(claimant=user).select_related('listing')
+
+
+@login_required
+def analytics_listings_more(request):
+    if request.user.role != 'claimant':
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+    return load_more(
+        request, _claimed_listings(request.user), 'analytics/_recent_listing_row.html', 'claim', field='claimed_at'
+    )
 
 
 @login_required
@@ -68,35 +135,45 @@ def analytics_dashboard(request):
     if request.user.role != 'claimant':
         return redirect('dashboard')
         
-    # Get claims made by this NGO (claimant)
-    claims = Claim.objects.filter(claimant=request.user).order_by('-claimed_at')
-    
-    # Get listings associated with this NGO's claims for analysis
-    from listings.models import PickupAssignment
-    claimed_listing_ids = claims.values_list('listing_id', flat=True)
-    listings = Listing.objects.filter(id__in=claimed_listing_ids).order_by('-created_at')
-    
-    # Prepare data for AI analysis (last 20 items to identify trends)
-    recent_items = listings[:20]
-    ai_context_data = []
-    for item in recent_items:
-        ai_context_data.append({
-            'date': item.created_at.strftime("%Y-%m-%d"),
-            'quantity': item.quantity_kg,
-            'food_type': item.get_food_type_display()
-        })
-    
-    total_claims = claims.count()
-    completed_claims = claims.filter(status='completed')
-    total_quantity = completed_claims.aggregate(Sum('listing__quantity_kg'))['listing__quantity_kg__sum'] or 0
-    
-    # Get Real AI Prediction
-    prediction = get_surplus_prediction(ai_context_data)
+    # Listings behind this NGO's claims, newest claim first; older pages via analytics_listings_more
+    user = request.user
+    recent_claims = keyset_page(_claimed_listings(user), field='claimed_at')
+
+    total_claims = cached_stat(
+        user.pk, 'claims',
+        lambda: Claim.objects.filter(claimant=user).count() + ArchivedClaim.objects.filter(claimant=user).count(),
+    )
+    # kg received is kept up to date by users.impact on every delivery
+    total_quantity = ImpactStats.objects.filter(user=user).values_list('kg_received', flat=True).first() or 0
+
+    # Insights are generated in bulk by `manage.py generate_insights`; never call the model here
+    insight = AIInsight.objects.filter(user=request.user).first()
+    if insight:
+        prediction = insight.as_prediction()
+    else:
+        prediction = {
+            'prediction': "Your first AI insight is being prepared and will appear after the next nightly run.",
+            'status': 'mock',
+        }
     
     context = {
         'total_claims': total_claims,
         'total_quantity': total_quantity,
         'prediction': prediction,
-        'recent_listings': recent_items,  # Pass listings to template for display
+        'recent_claims': recent_claims,  # Pass claimed listings to template for display
     }
     return render(request, 'analytics/analytics_dashboard.html', context)
+
+
+# Aggregates only, the same for everyone: shared by the micro cache and by browsers
+@micro_cache(ttl=60, stale=600, anonymous_only=False)
+def heatmap_tile(request, z, x, y):
+    """One slippy-map tile of the surplus heatmap (see analytics/heatmap.py)."""
+    try:
+        hours = heatmap.hours_of_week(request.GET.get('days', ''), request.GET.get('hours', ''))
+        data = heatmap.tile(z, x, y, food_type=request.GET.get('food_type') or None, hours=hours)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    response = JsonResponse(data)
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
@@ -0,0 +1,58 @@
+"""
+Helpers for async views.
+
+Django serves ``async def`` views under WSGI as well as ASGI (``asgi.py``),
+so an async view is the only version of its endpoint: ``runserver`` and a
+WSGI server run it in a short-lived event loop, an ASGI server natively.
+
+Async ORM calls (and ``sync_to_async`` with the default
+``thread_sensitive=True``) all run on the request's one sync thread, one
+after another, so ``asyncio.gather`` over them overlaps nothing. Views
+that make several independent reads use ``gather_reads`` instead, which
+runs each on a worker thread with its own database connection.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.shortcuts import render
+
+
+def _on_own_connection(func, args):
+    # A worker thread's connection lives as long as a request's would
+    # (CONN_MAX_AGE): checked before the call, closed or kept after it
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _in_request_thread_if_shared(calls):
+    """
+    Run ``calls`` here, one after another, when other connections cannot see
+    what this one sees: inside a transaction (``ATOMIC_REQUESTS`` or a test
+    case) or on an in-memory SQLite database. Returns None otherwise.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block or (connection.vendor == 'sqlite' and connection.is_in_memory_db()):
+        return [func(*args) for func, *args in calls]
+    return None
+
+
+async def gather_reads(*calls):
+    """
+    Results of the independent read-only calls ``(func, *args)``, run at once.
+    Each runs on a worker thread with its own connection; see
+    ``_in_request_thread_if_shared`` for when they run in sequence instead.
+    """
+    results = await sync_to_async(_in_request_thread_if_shared)(calls)
+    if results is None:
+        results = await asyncio.gather(*(
+            sync_to_async(_on_own_connection, thread_sensitive=False)(func, args) for func, *args in calls
+        ))
+    return results
+
+
+# Template rendering stays sync: base.html reads the lazy ``request.user``
+arender = sync_to_async(render)
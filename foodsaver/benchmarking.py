@@ -0,0 +1,55 @@
+"""
+Helpers for the ``manage.py benchmark_*`` commands.
+
+Benchmarks seed their own rows, so they run in a throwaway copy of the
+default database (Django's test database, in a temporary file for SQLite
+so it behaves like the real one) that is dropped afterwards. The configured
+database is never written to.
+"""
+import math
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def scratch_database():
+    """Create, migrate and afterwards drop a database for the benchmark to fill."""
+    old_name = connection.settings_dict['NAME']
+    directory = None
+    if connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='foodsaver-bench-')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def timings(func, repeat):
+    """Seconds taken by each of ``repeat`` calls to ``func``, sorted."""
+    taken = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        taken.append(time.perf_counter() - start)
+    return sorted(taken)
+
+
+def percentile(ordered, p):
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summary_ms(ordered):
+    """``"p50 … ms  p95 … ms  max … ms"`` for sorted timings in seconds."""
+    return '  '.join(
+        f"{label} {value * 1000:8.2f} ms"
+        for label, value in (('p50', percentile(ordered, 50)), ('p95', percentile(ordered, 95)), ('max', ordered[-1]))
+    )
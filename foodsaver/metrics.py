@@ -0,0 +1,376 @@
+"""
+Prometheus metrics, served at ``/metrics``.
+
+Counters and fixed-bucket histograms are kept in plain Python objects in
+each process: an observation is a dict lookup, a bisect and a couple of
+additions under a lock, about a microsecond. Nothing is exported while
+requests are served.
+
+With ``METRICS_DIR`` set, each process also writes its totals to
+``<METRICS_DIR>/<pid>.json`` at most every ``METRICS_FLUSH_INTERVAL``
+seconds (at the end of a request or a job batch, and at exit), and
+``/metrics`` adds up every file there, so whichever worker answers the
+scrape reports the whole server, job workers included. Files of exited
+processes are kept so totals never go down; empty the directory when
+deploying. Without ``METRICS_DIR`` the endpoint reports its own process.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Anything else is counted as 'other', so clients cannot add label values
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+REGISTRY = {}
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def labels(self, *values):
+        """The series for these label values, in ``labelnames`` order."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def reset(self):
+        with self._lock:
+            self._children.clear()
+
+    def samples(self):
+        """``{label_values: state}`` for the file format and ``merge``."""
+        return {values: child.state() for values, child in list(self._children.items())}
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def state(self):
+        return self.value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def expose(self, samples):
+        for values, value in samples.items():
+            yield f'{self.name}{_labels(self.labelnames, values)} {_number(value)}'
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets, lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def state(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class _Timer:
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets, self._lock)
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+    def expose(self, samples):
+        bounds = [_number(b) for b in self.buckets] + ['+Inf']
+        for values, (counts, total) in samples.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labelnames + ("le",), values + (bound,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, values)} {cumulative}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+# The metrics. Label values must come from a small fixed set (view names,
+# statuses), never from user input.
+
+REQUEST_DURATION = Histogram(
+    'foodsaver_http_request_duration_seconds', 'Time to serve a request, by view.', ('view', 'method', 'status'),
+)
+DB_QUERY_DURATION = Histogram(
+    'foodsaver_db_query_duration_seconds', 'Time spent in database queries.', ('alias',),
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+AI_PREDICTION_DURATION = Histogram(
+    'foodsaver_ai_prediction_duration_seconds', 'Time of get_surplus_prediction calls, by result status.', ('status',),
+    buckets=(.25, .5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+EMAIL_SEND_DURATION = Histogram(
+    'foodsaver_email_send_duration_seconds', 'Time to hand an email to the mail server.', ('outcome',),
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+OTP_VERIFICATIONS = Counter(
+    'foodsaver_otp_verifications_total', 'Pickup OTP submissions, by outcome.', ('outcome',),
+)
+JOB_LAG = Histogram(
+    'foodsaver_job_lag_seconds', 'Time from when a background job was due to when a worker started it.', ('job',),
+    buckets=(.1, .5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOB_RUNS = Counter('foodsaver_job_runs_total', 'Background job runs, by outcome.', ('job', 'outcome'))
+
+
+# Sharing totals between processes
+
+class _Exporter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_flush = 0.0
+        self.baseline = None  # what an earlier process with our pid left in our file
+
+    def path(self):
+        return Path(settings.METRICS_DIR) / f'{os.getpid()}.json'
+
+    def flush(self):
+        """Write this process's totals to its file. No-op without ``METRICS_DIR``."""
+        if not settings.METRICS_DIR:
+            return
+        with self.lock:
+            path = self.path()
+            if self.baseline is None:
+                self.baseline = _read(path)
+            data = _merge([self.baseline, _snapshot()])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'.{path.name}.tmp')
+            tmp.write_text(json.dumps(_encode(data)))
+            os.replace(tmp, path)
+
+    def maybe_flush(self):
+        now = time.monotonic()
+        if now >= self.next_flush:
+            self.next_flush = now + settings.METRICS_FLUSH_INTERVAL
+            self.flush()
+
+    def collect(self):
+        """Totals of every process (or of this one without ``METRICS_DIR``)."""
+        if not settings.METRICS_DIR:
+            return _snapshot()
+        self.flush()
+        return _merge(_read(path) for path in Path(settings.METRICS_DIR).glob('*.json'))
+
+
+def _snapshot():
+    return {name: metric.samples() for name, metric in REGISTRY.items()}
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, samples in snapshot.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            into = merged.setdefault(name, {})
+            for values, state in samples.items():
+                into[values] = metric.merge(into[values], state) if values in into else state
+    return merged
+
+
+def _encode(data):
+    return {name: [[list(values), state] for values, state in samples.items()] for name, samples in data.items()}
+
+
+def _read(path):
+    try:
+        raw = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+    return {name: {tuple(values): state for values, state in samples} for name, samples in raw.items()}
+
+
+exporter = _Exporter()
+maybe_flush = exporter.maybe_flush
+atexit.register(lambda: exporter.flush())
+
+
+def _reset_after_fork():
+    # A forked child starts from zero; its parent still reports what it inherited
+    for metric in REGISTRY.values():
+        metric.reset()
+    exporter.lock = threading.Lock()
+    exporter.baseline = None
+    exporter.next_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def render():
+    """The Prometheus text exposition of all metrics."""
+    data = exporter.collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        lines.extend(metric.expose(data.get(name, {})))
+    lines.extend(_job_backlog())
+    return '\n'.join(lines) + '\n'
+
+
+def _job_backlog():
+    """Gauges read from the job table at scrape time."""
+    from django.db.models import Count, Min
+    from django.utils import timezone
+    from jobs.models import Job
+
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).aggregate(count=Count('pk'), oldest=Min('run_at'))
+    age = (now - due['oldest']).total_seconds() if due['oldest'] else 0
+    return [
+        '# HELP foodsaver_jobs_due Queued background jobs that are due.',
+        '# TYPE foodsaver_jobs_due gauge',
+        f'foodsaver_jobs_due {due["count"]}',
+        '# HELP foodsaver_job_oldest_due_seconds How long the oldest due job has been waiting.',
+        '# TYPE foodsaver_job_oldest_due_seconds gauge',
+        f'foodsaver_job_oldest_due_seconds {_number(age)}',
+    ]
+
+
+def metrics_view(request):
+    token = settings.METRICS_BEARER_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+# Instrumentation
+
+def _time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        DB_QUERY_DURATION.labels(context['connection'].alias).observe(time.perf_counter() - start)
+
+
+def _instrument_connection(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_instrument_connection)
+for _connection in connections.all(initialized_only=True):
+    _instrument_connection(None, _connection)
+
+
+class MetricsMiddleware:
+    """Times every request by view name. Goes first in ``MIDDLEWARE``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def _acall(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    @staticmethod
+    def _observe(request, response, start):
+        match = request.resolver_match
+        view = match.view_name if match else '<unmatched>'
+        method = request.method if request.method in METHODS else 'other'
+        REQUEST_DURATION.labels(view, method, str(response.status_code)).observe(time.perf_counter() - start)
+        maybe_flush()
@@ -0,0 +1,190 @@
+"""
+Request coalescing and a short-lived response cache for public views.
+
+``@micro_cache(ttl, stale)`` keeps each view response in process memory,
+keyed by path and query string:
+
+* for ``ttl`` seconds it is served as is;
+* for ``stale`` seconds after that it is still served, while one
+  background thread renders a fresh copy (stale-while-revalidate) for a
+  bare anonymous GET of the cached path, never the live request that
+  found the copy stale;
+* concurrent requests for a key with nothing to serve wait for the one
+  request already rendering it instead of rendering it again
+  (single-flight), so a spike costs one computation per process.
+
+Only anonymous GET/HEAD requests are cached unless ``anonymous_only=False``
+(pages extending ``base.html`` greet the signed-in user), and only
+``200`` responses that set no cookies, did not use a CSRF token and are
+not marked ``Cache-Control: no-store`` (e.g. by ``add_never_cache_headers``,
+for a page that reports a transient failure). Every
+request gets its own copy of the response, so middleware can still add
+headers and cookies to it.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections, connections
+from django.http import HttpRequest, HttpResponse, QueryDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """One in-progress render that identical requests wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None  # None: the response could not be shared
+        self.error = None
+
+
+class _Entry:
+    def __init__(self, response, ttl, stale):
+        self.content = response.content
+        self.status = response.status_code
+        self.headers = dict(response.items())
+        now = time.monotonic()
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale
+
+    def response(self):
+        return HttpResponse(self.content, status=self.status, headers=self.headers)
+
+
+def _shareable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and 'no-store' not in response.get('Cache-Control', '')
+    )
+
+
+# Request headers a background refresh keeps, so the view sees the same host
+_REFRESH_META = ('HTTP_HOST', 'SERVER_NAME', 'SERVER_PORT')
+
+
+def _refresh_request(key, meta):
+    """A new anonymous GET for the cache ``key`` (path and query string)."""
+    path, _, query = key.partition('?')
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.META = dict(meta, REQUEST_METHOD='GET', QUERY_STRING=query)
+    request.GET = QueryDict(query)
+    request.user = AnonymousUser()
+    return request
+
+
+class MicroCache:
+    def __init__(self, ttl, stale, max_entries):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _render(self, key, flight, render):
+        """Run ``render()`` for ``flight`` and publish the result. Returns the response."""
+        try:
+            response, shareable = render()
+            if shareable:
+                flight.entry = _Entry(response, self.ttl, self.stale)
+                self._store(key, flight.entry)
+            return response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _refresh(self, key, flight, render):
+        close_old_connections()
+        try:
+            self._render(key, flight, render)
+        except Exception:
+            logger.exception("Background refresh of %s failed", key)
+        finally:
+            connections.close_all()  # this thread's connections
+
+    def get(self, key, render, refresh=None):
+        """
+        The response for ``key``. ``render()`` returns ``(response, shareable)``
+        and is only called when no other request is already rendering ``key``.
+        A stale entry is re-rendered in the background by ``refresh()``
+        (``render()`` if not given), which must not use the current request.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now >= entry.fresh_until and key not in self._flights:
+                    flight = self._flights[key] = _Flight()
+                    threading.Thread(
+                        target=self._refresh, args=(key, flight, refresh or render), name='micro-cache-refresh',
+                        daemon=True,
+                    ).start()
+                return entry.response()
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if leader:
+            return self._render(key, flight, render)
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        if flight.entry is None:
+            return render()[0]
+        return flight.entry.response()
+
+
+def micro_cache(ttl=10, stale=60, anonymous_only=True):
+    """Serve the view through a ``MicroCache`` (see the module docstring)."""
+    def decorator(view):
+        store = MicroCache(ttl, stale, settings.MICRO_CACHE_MAX_ENTRIES)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or (anonymous_only and request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            if 'messages' in request.COOKIES:  # a flash message only this visitor should see
+                return view(request, *args, **kwargs)
+
+            key = request.get_full_path()
+            meta = {name: request.META[name] for name in _REFRESH_META if name in request.META}
+
+            def render(request=request):
+                response = view(request, *args, **kwargs)
+                return response, _shareable(request, response)
+
+            def refresh():
+                return render(_refresh_request(key, meta))
+
+            return store.get(key, render, refresh)
+
+        wrapper.micro_cache = store
+        return wrapper
+    return decorator
@@ -46,9 +46,12 @@ INSTALLED_APPS = [
     "users",
     "listings",
     "analytics",
+    "jobs",
 ]
 
 MIDDLEWARE = [
+    "foodsaver.metrics.MetricsMiddleware",
+    "foodsaver.traces.TraceMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -71,6 +74,9 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            "libraries": {
+                "responsive_images": "foodsaver.templatetags.responsive_images",
+            },
         },
     },
 ]
@@ -88,6 +94,17 @@ DATABASES = {
     }
 }
 
+# Shared by every server and worker process, so per-user stats cached by
+# listings/pagination.py are invalidated everywhere at once. Create the table
+# with `manage.py createcachetable` (tests and benchmarks do it themselves).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "foodsaver_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -125,13 +142,84 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# collectstatic writes content-hashed copies (cacheable forever), gzip/brotli
+# siblings and responsive AVIF/WebP image variants; see foodsaver/storage.py.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "foodsaver.storage.OptimizedStaticFilesStorage",
+    },
+}
+RESPONSIVE_IMAGE_WIDTHS = (480, 960, 1600)
 
 # Media files
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Perceptual-hash index of claim photos (append-only file, see listings/photo_hashes.py)
+PHOTO_HASH_INDEX_PATH = BASE_DIR / "var" / "photo_hashes.bin"
+PHOTO_DUPLICATE_DISTANCE = 6  # max differing bits (of 64) to count as a re-used photo
+PHOTO_HASH_PRELOAD = False  # load the index in a background thread at startup
+
+# Finished listings/claims/pickups older than this are moved to archive tables
+# by `manage.py archive_history` (see listings/archive.py)
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 500  # listings per transaction
+# Change-feed entries (listings/api/changes/) older than this are trimmed by
+# archive_history; clients further behind reload in full (see listings/changes.py)
+CHANGE_FEED_RETENTION_DAYS = 7
+
 AUTH_USER_MODEL = "users.User"
 
+# Volunteer location pings are kept in memory (latest per volunteer) and
+# written in one bulk upsert this often (see users/locations.py)
+LOCATION_FLUSH_SECONDS = 5
+
+# Geocoding (see users/geocoding.py): answers are cached in the database and
+# common localities come from a bundled gazetteer. GEOCODING_URL = None keeps
+# lookups offline (cache and gazetteer only).
+GEOCODING_URL = "https://nominatim.openstreetmap.org/search"
+GEOCODING_USER_AGENT = "FoodSaver/1.0 (food rescue platform)"
+GEOCODING_TIMEOUT = 3  # seconds
+GEOCODING_MIN_INTERVAL = 1.0  # seconds between service requests per process (Nominatim usage policy)
+GEOCODING_CACHE_MAX_ROWS = 50000
+
+# Admin changelists count at most this many rows; larger unfiltered tables
+# show the database's row estimate instead (see foodsaver/admin_performance.py)
+ADMIN_COUNT_LIMIT = 10000
+
+# Background jobs (see jobs/queue.py), run by `manage.py runworkers`
+JOBS_POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking again
+JOBS_BATCH_SIZE = 20  # jobs a worker claims at once
+JOBS_LEASE_SECONDS = 600  # a running job not finished by then is handed to another worker
+
+# Responses kept per @micro_cache view (public pages; see foodsaver/microcache.py)
+MICRO_CACHE_MAX_ENTRIES = 1000
+
+# Prometheus metrics at /metrics (see foodsaver/metrics.py). With METRICS_DIR
+# set, every process writes its totals there and the endpoint adds them up.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = 5.0  # seconds between writes of a process's totals
+METRICS_BEARER_TOKEN = os.getenv('METRICS_BEARER_TOKEN', '')  # required by /metrics when set
+
+# Anonymised request traces for `manage.py replay_trace` (see foodsaver/traces.py).
+# Recording is off unless TRACE_FILE is set.
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_SAMPLE_RATE = 1.0  # fraction of requests recorded
+
+# Surplus heatmap rollups (see analytics/heatmap.py). Changing the cell size
+# needs `manage.py rebuild_heatmap`.
+HEATMAP_CELL_DEGREES = 0.01  # grid cell edge, about 1 km of latitude
+HEATMAP_TILE_CELLS = 64  # at most this many cells across a tile; coarser zooms merge cells
+
+# Import and configure the Gemini client in the background at startup instead
+# of on the first AI request (see foodsaver/ai_core.py)
+AI_WARM_UP = False
+
 # Redirects
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
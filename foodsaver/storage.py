@@ -0,0 +1,109 @@
+"""
+collectstatic-time asset pipeline.
+
+``OptimizedStaticFilesStorage`` extends Django's manifest storage (content
+hashed filenames, safe to serve with far-future cache headers) with:
+
+* responsive WebP/AVIF variants of raster images at the widths in
+  ``settings.RESPONSIVE_IMAGE_WIDTHS``, named ``<stem>.w<width>.<format>``
+  and hashed like any other file (see ``responsive_images`` template tags);
+* gzip and, when the ``brotli`` package is installed, brotli siblings
+  (``.gz`` / ``.br``) of every compressible hashed file, so the web server
+  can serve precompressed bytes.
+
+None of this runs in development: with DEBUG on, ``{% static %}`` keeps
+returning the unhashed source paths.
+"""
+import gzip
+import io
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:  # optional
+    Image = None
+
+RESIZABLE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml', '.ico'}
+# Compressed output smaller than this fraction of the original is not worth keeping
+MIN_COMPRESSION_RATIO = 0.95
+
+
+def variant_formats():
+    if Image is None:
+        return []
+    return [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+
+
+def variant_name(name, width, fmt):
+    stem, _ = os.path.splitext(name)
+    return f"{stem}.w{width}.{fmt}"
+
+
+def responsive_widths():
+    return getattr(settings, 'RESPONSIVE_IMAGE_WIDTHS', (480, 960, 1600))
+
+
+class OptimizedStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for name, source in self._generate_variants(list(paths)):
+                paths[name] = source
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if not dry_run:
+            yield from self._compress(self.hashed_files.values())
+
+    def _generate_variants(self, names):
+        formats = variant_formats()
+        if not formats:
+            return
+        for name in names:
+            if os.path.splitext(name)[1].lower() not in RESIZABLE_EXTENSIONS:
+                continue
+            with self.open(name) as fh:
+                image = Image.open(fh)
+                image.load()
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            for width in responsive_widths():
+                if width > image.width:
+                    continue
+                height = round(image.height * width / image.width)
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                for fmt in formats:
+                    buffer = io.BytesIO()
+                    resized.save(buffer, fmt.upper(), quality=70 if fmt == 'avif' else 80)
+                    target = variant_name(name, width, fmt)
+                    if self.exists(target):
+                        self.delete(target)
+                    self._save(target, ContentFile(buffer.getvalue()))
+                    yield target, (self, target)
+
+    def _compress(self, names):
+        for name in set(names):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(name) as fh:
+                content = fh.read()
+            encoders = [('gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                encoders.append(('br', lambda data: brotli.compress(data, quality=11)))
+            for suffix, encode in encoders:
+                compressed = encode(content)
+                if len(compressed) >= len(content) * MIN_COMPRESSION_RATIO:
+                    continue
+                target = f"{name}.{suffix}"
+                if self.exists(target):
+                    self.delete(target)
+                self._save(target, ContentFile(compressed))
+                yield name, target, True
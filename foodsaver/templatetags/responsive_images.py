@@ -0,0 +1,66 @@
+"""
+``{% responsive_image %}``: a ``<picture>`` with the AVIF/WebP variants built
+by ``foodsaver.storage.OptimizedStaticFilesStorage`` at collectstatic time.
+
+    {% load responsive_images %}
+    {% responsive_image 'images/hero.png' alt='...' class='w-full' sizes='50vw' %}
+
+Variants that do not exist (e.g. in development, where collectstatic has not
+run) are skipped and the tag degrades to a plain ``<img>``.
+"""
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from foodsaver.storage import responsive_widths, variant_formats, variant_name
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def _variant_url(name):
+    if settings.DEBUG:
+        return static(name) if finders.find(name) else None
+    try:
+        return staticfiles_storage.url(name)
+    except ValueError:  # not in the manifest
+        return None
+
+
+@lru_cache(maxsize=None)
+def srcset_for(name, fmt):
+    """``srcset`` value for one format of an image, or '' if no variants exist."""
+    entries = []
+    for width in responsive_widths():
+        url = _variant_url(variant_name(name, width, fmt))
+        if url:
+            entries.append(f"{url} {width}w")
+    return ', '.join(entries)
+
+
+@register.simple_tag
+def responsive_image(name, alt='', sizes='100vw', **attrs):
+    attrs.setdefault('loading', 'lazy')
+    sources = [
+        (f"image/{fmt}", srcset)
+        for fmt in variant_formats()
+        if (srcset := srcset_for(name, fmt))
+    ]
+    img = format_html(
+        '<img src="{}" alt="{}"{} />',
+        static(name), alt,
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
+    if not sources:
+        return img
+    return format_html(
+        '<picture>{}{}</picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}" />',
+                         ((mime, srcset, sizes) for mime, srcset in sources)),
+        img,
+    )
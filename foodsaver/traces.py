@@ -0,0 +1,250 @@
+"""
+Recording production traffic and replaying it as a load test.
+
+With ``TRACE_FILE`` set, ``TraceMiddleware`` appends one JSON line per
+request to it (one ``O_APPEND`` write, so server processes can share the
+file): time, method, view name, URL kwargs, query and form parameters,
+the user's role and a pseudonym, status and duration. Parameters and URL
+kwargs are anonymised as they are written: only those in ``KEPT_PARAMS``
+keep their value, coordinates are rounded to about a kilometre and every
+other value becomes a run of ``x`` of the same length. Users are kept
+apart by an HMAC of their id, which cannot be reversed without
+``SECRET_KEY``; so are the users a URL names (``PERSON_KWARGS``).
+
+``manage.py replay_trace`` (``Replayer``) sends a trace through the Django
+test client against the configured database, on its original schedule
+sped up by ``speed``, from a pool of threads. Each pseudonym is mapped to
+a user of the same role in that database, round robin; a user named in a
+URL is replaced by the one their pseudonym maps to, or else by the user
+sending the request. The ``report``
+covers throughput, errors and latency percentiles per view.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.cookies import SimpleCookie
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import close_old_connections
+from django.urls import reverse
+from django.utils.crypto import salted_hmac
+
+# Parameters and URL kwargs whose values are recorded as they are; nothing in them identifies anyone
+KEPT_PARAMS = frozenset({
+    'page', 'limit', 'cursor', 'since', 'status', 'role', 'id', 'volunteer_id',
+    'food_type', 'quantity_kg', 'servings', 'expiry_time', 'accuracy',
+    'listing_id', 'claim_id', 'assignment_id', 'z', 'x', 'y',
+})
+# URL kwargs naming a user, recorded as their pseudonym
+PERSON_KWARGS = frozenset({'user_id'})
+ROUNDED_PARAMS = frozenset({'lat', 'lng', 'latitude', 'longitude'})
+MAX_VALUE_LENGTH = 200
+
+
+def _anonymise(key, value):
+    if key in KEPT_PARAMS:
+        return value[:MAX_VALUE_LENGTH]
+    if key in ROUNDED_PARAMS:
+        try:
+            return str(round(float(value), 2))
+        except ValueError:
+            return ''
+    return 'x' * min(len(value), MAX_VALUE_LENGTH)
+
+
+def _params(querydict, skip=('csrfmiddlewaretoken',)):
+    params = {}
+    for key, values in querydict.lists():
+        if key in skip:
+            continue
+        values = [_anonymise(key, value) for value in values]
+        params[key] = values[0] if len(values) == 1 else values
+    return params
+
+
+@lru_cache(maxsize=10000)
+def pseudonym(user_id):
+    return salted_hmac('foodsaver.traces', str(user_id)).hexdigest()[:12]
+
+
+def _kwargs(kwargs):
+    return {
+        key: pseudonym(value) if key in PERSON_KWARGS else _anonymise(key, str(value))
+        for key, value in kwargs.items()
+    }
+
+
+class TraceMiddleware:
+    """Appends each request to ``TRACE_FILE``; removed from the stack when that is unset."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.TRACE_FILE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.TRACE_SAMPLE_RATE
+        self.fd = os.open(settings.TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        started, start = time.time(), time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, getattr(request, 'user', None), started, start)
+        return response
+
+    async def _acall(self, request):
+        started, start = time.time(), time.perf_counter()
+        response = await self.get_response(request)
+        user = await request.auser() if hasattr(request, 'auser') else None
+        self._record(request, response, user, started, start)
+        return response
+
+    def _record(self, request, response, user, started, start):
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        if match is None or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return
+        authenticated = user is not None and user.is_authenticated
+        entry = {
+            't': round(started, 3),
+            'm': request.method,
+            'v': match.view_name,
+            'k': _kwargs(match.kwargs),
+            'q': _params(request.GET),
+            'f': _params(request.POST) if request.method == 'POST' else {},
+            'r': user.role if authenticated else '',
+            'u': pseudonym(user.pk) if authenticated else '',
+            's': response.status_code,
+            'd': round(duration * 1000, 2),
+        }
+        os.write(self.fd, (json.dumps(entry, separators=(',', ':'), default=str) + '\n').encode())
+
+
+def read_trace(path):
+    """The requests in a trace file, oldest first."""
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries.sort(key=lambda entry: entry['t'])
+    return entries
+
+
+class Replayer:
+    def __init__(self, entries, speed=1.0, workers=8, get_only=False):
+        self.entries = [e for e in entries if not get_only or e['m'] in ('GET', 'HEAD')]
+        self.speed = speed
+        self.workers = workers
+        self.results = []  # (view, status, latency seconds, lateness seconds)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.unmapped_roles = set()
+        self.users = {}  # pseudonym → id of the user standing in for them
+
+    # The test client is only imported by the replay tool, not by servers
+    def _sessions(self):
+        """``{pseudonym: {cookie: value}}``, logging each pseudonym in as a user of the same role."""
+        from django.test import Client
+        from users.models import User
+
+        by_role = defaultdict(list)
+        for entry in self.entries:
+            if entry['u'] and entry['u'] not in by_role[entry['r']]:
+                by_role[entry['r']].append(entry['u'])
+        sessions = {}
+        for role, pseudonyms in by_role.items():
+            users = list(User.objects.filter(role=role, is_active=True).order_by('pk')[:len(pseudonyms)])
+            if not users:
+                self.unmapped_roles.add(role)
+                continue
+            for n, name in enumerate(pseudonyms):
+                client = Client()
+                self.users[name] = users[n % len(users)].pk
+                client.force_login(users[n % len(users)])
+                sessions[name] = {key: morsel.value for key, morsel in client.cookies.items()}
+        return sessions
+
+    def _client(self):
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(raise_request_exception=False)
+        return client
+
+    def _send(self, entry, due, cookies):
+        lateness = time.perf_counter() - due
+        client = self._client()
+        client.cookies = SimpleCookie(cookies)
+        start = time.perf_counter()
+        try:
+            kwargs = {
+                key: self.users.get(value, self.users.get(entry['u'], value)) if key in PERSON_KWARGS else value
+                for key, value in entry['k'].items()
+            }
+            path = reverse(entry['v'], kwargs=kwargs)
+            if entry['m'] == 'POST':
+                response = client.post(path, entry['f'], query_params=entry['q'])
+            else:
+                response = client.generic(entry['m'], path, query_params=entry['q'])
+            status = response.status_code
+        except Exception:
+            status = 0  # could not be sent, e.g. a view this code base no longer has
+        latency = time.perf_counter() - start
+        close_old_connections()
+        with self._lock:
+            self.results.append((entry['v'], status, latency, lateness))
+
+    def run(self):
+        """Send every request on schedule and wait for the last one. Returns the wall time taken."""
+        if not self.entries:
+            return 0.0
+        from django.test import override_settings
+
+        # The test client sends "Host: testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            sessions = self._sessions()
+            first = self.entries[0]['t']
+            begin = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='replay') as pool:
+                for entry in self.entries:
+                    due = begin + (entry['t'] - first) / self.speed
+                    wait = due - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                    pool.submit(self._send, entry, due, sessions.get(entry['u'], {}))
+            return time.perf_counter() - begin
+
+
+def _percentile(ordered, p):
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def report(results, elapsed):
+    """``(per_view, totals)`` rows: view, requests, req/s, 5xx/failed, 4xx, p50, p95, p99 (ms)."""
+    def summarise(name, rows):
+        latencies = sorted(latency * 1000 for _, _, latency, _ in rows)
+        return (
+            name, len(rows), len(rows) / elapsed if elapsed else 0.0,
+            sum(1 for _, status, _, _ in rows if status >= 500 or status == 0),
+            sum(1 for _, status, _, _ in rows if 400 <= status < 500),
+            _percentile(latencies, 50), _percentile(latencies, 95), _percentile(latencies, 99),
+        )
+
+    by_view = defaultdict(list)
+    for row in results:
+        by_view[row[0]].append(row)
+    per_view = sorted((summarise(view, rows) for view, rows in by_view.items()), key=lambda row: -row[1])
+    return per_view, summarise('all', results) if results else None
@@ -15,14 +15,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView, TemplateView
 
+from foodsaver.metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("users/", include("users.urls")),
     path("listings/", include("listings.urls")),
     path("analytics/", include("analytics.urls")),
+    path("metrics", metrics_view, name='metrics'),
     path("", TemplateView.as_view(template_name="index.html"), name='index'),
 ]
+
+# Serve uploaded media in development
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
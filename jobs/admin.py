@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from foodsaver.admin_performance import LargeTableAdmin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'run_at', 'locked_by')
+    list_filter = ('status',)
+    search_fields = ('name', 'unique_key')
+    readonly_fields = ('created_at',)
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodsaver.benchmarking import scratch_database
+from jobs.models import Job
+from jobs.queue import enqueue, task
+from jobs.worker import Pool
+
+
+@task
+def pause(ms):
+    if ms:
+        time.sleep(ms / 1000)
+
+
+def _numbers(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure job queue throughput (jobs/s) against a throwaway database: enqueue(), then "
+        "runworkers --burst over --jobs jobs for each worker count, mode and task duration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=2000)
+        parser.add_argument('--workers', type=_numbers, default=[1, 4, 8], help="Comma-separated, e.g. 1,4,8.")
+        parser.add_argument('--modes', default='thread,process')
+        parser.add_argument('--task-ms', type=_numbers, default=[0, 5], help="Comma-separated task durations.")
+
+    def handle(self, *args, **options):
+        count = options['jobs']
+        with scratch_database():
+            start = time.perf_counter()
+            for n in range(count):
+                enqueue(pause, [0])
+            self.stdout.write(f"{'enqueue':28} {count / (time.perf_counter() - start):8.0f} jobs/s")
+            Job.objects.all().delete()
+
+            for ms in options['task_ms']:
+                for mode in options['modes'].split(','):
+                    rates = []
+                    for workers in options['workers']:
+                        Job.objects.bulk_create([Job(name=f'{__name__}.pause', args=[ms]) for _ in range(count)])
+                        start = time.perf_counter()
+                        Pool(workers=workers, mode=mode, poll_interval=0.01).run(burst=True)
+                        taken = time.perf_counter() - start
+                        left = Job.objects.filter(name=f'{__name__}.pause').count()
+                        if left:
+                            raise CommandError(f"{left} jobs left over with {workers} {mode} workers")
+                        Job.objects.all().delete()
+                        rates.append(f"{count / taken:6.0f}")
+                    label = f"{ms} ms task, {'/'.join(map(str, options['workers']))} {mode} workers"
+                    self.stdout.write(f"{label:28} {' / '.join(rates)} jobs/s")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import PERIODIC, REGISTRY, autodiscover
+from jobs.worker import Pool
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs and periodic tasks until interrupted (SIGINT/SIGTERM)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Workers to run.")
+        parser.add_argument('--mode', choices=('thread', 'process'), default='thread',
+                            help="Run the workers as threads (I/O-bound tasks) or processes (CPU-bound tasks).")
+        parser.add_argument('--batch-size', type=int, default=None, help="Jobs a worker claims at once (default: JOBS_BATCH_SIZE).")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds an idle worker waits (default: JOBS_POLL_INTERVAL).")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        autodiscover()
+        self.stdout.write(
+            f"{options['workers']} {options['mode']} workers, {len(REGISTRY)} tasks, {len(PERIODIC)} periodic."
+        )
+        started = time.monotonic()
+        Pool(
+            workers=options['workers'],
+            mode=options['mode'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        ).run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS(f"Stopped after {time.monotonic() - started:.1f}s."))
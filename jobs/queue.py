@@ -0,0 +1,140 @@
+"""
+Background jobs stored in the database, with no broker to run.
+
+Declare a task with ``@task`` and queue calls to it with ``enqueue``::
+
+    @task
+    def send_receipt(claim_id): ...
+
+    enqueue(send_receipt, [claim.pk], priority=5, unique_key=f'receipt:{claim.pk}')
+
+Arguments must be JSON-serialisable; pass ids, not model instances.
+``manage.py runworkers`` runs the jobs: higher ``priority`` first, then the
+earliest ``run_at``. A job that raises is retried after ``backoff()``
+seconds until it has made ``max_attempts`` attempts, then kept as
+``failed``. A job whose worker died is run again once its lease
+(``JOBS_LEASE_SECONDS``) runs out, so a task may run more than once and
+should be safe to repeat.
+
+``unique_key`` makes ``enqueue`` a no-op while a job with the same key is
+queued or running. ``@periodic(seconds)`` tasks are queued by the workers
+themselves, at most one pending run each, aligned to multiples of
+``seconds`` since the epoch.
+
+Tasks are found in each installed app's ``tasks`` module.
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+REGISTRY = {}
+PERIODIC = {}
+
+
+@dataclass(frozen=True)
+class Periodic:
+    name: str
+    seconds: int
+    priority: int
+
+
+def _name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def task(func):
+    """Register ``func`` as a task so it can be enqueued by reference."""
+    REGISTRY[_name(func)] = func
+    return func
+
+
+def periodic(seconds, priority=0):
+    """Register a task that the workers run every ``seconds`` seconds."""
+    def decorator(func):
+        task(func)
+        PERIODIC[_name(func)] = Periodic(_name(func), seconds, priority)
+        return func
+    return decorator
+
+
+def autodiscover():
+    """Import every installed app's ``tasks`` module so its tasks register."""
+    for config in apps.get_app_configs():
+        try:
+            import_module(f'{config.name}.tasks')
+        except ModuleNotFoundError as e:
+            if e.name != f'{config.name}.tasks':
+                raise
+
+
+def resolve(name):
+    func = REGISTRY.get(name)
+    if func is None:
+        func = REGISTRY[name] = import_string(name)
+    return func
+
+
+def enqueue(func, args=(), kwargs=None, *, priority=0, delay=None, run_at=None,
+            unique_key=None, max_attempts=5):
+    """
+    Queue a call of ``func`` (a task or its dotted path). Returns the new
+    ``Job``, or the pending one that already holds ``unique_key``.
+    """
+    name = func if isinstance(func, str) else _name(func)
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    job = Job(
+        name=name, args=list(args), kwargs=kwargs or {}, priority=priority,
+        run_at=run_at, unique_key=unique_key, max_attempts=max_attempts,
+    )
+    if unique_key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+        return job
+    except IntegrityError:
+        existing = Job.objects.filter(unique_key=unique_key, status__in=['queued', 'running']).first()
+        if existing is None:  # finished in between; try once more
+            job.pk = None
+            job.save()
+            return job
+        return existing
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying after the ``attempts``-th failure: 10 s doubling up to an hour, ±20 %."""
+    base = min(3600, 10 * 2 ** (attempts - 1))
+    return base * random.uniform(0.8, 1.2)
+
+
+def next_slot(seconds, now=None):
+    """The next multiple of ``seconds`` since the epoch after ``now``."""
+    now = now or timezone.now()
+    epoch = now.timestamp()
+    return datetime.fromtimestamp((epoch // seconds + 1) * seconds, tz=dt_timezone.utc)
+
+
+def schedule_periodic(now=None):
+    """Queue the next run of each periodic task that has none pending. Returns how many were queued."""
+    queued = 0
+    pending = set(
+        Job.objects.filter(unique_key__startswith='periodic:', status__in=['queued', 'running'])
+        .values_list('unique_key', flat=True)
+    )
+    for entry in PERIODIC.values():
+        key = f'periodic:{entry.name}'
+        if key in pending:
+            continue
+        enqueue(entry.name, priority=entry.priority, run_at=next_slot(entry.seconds, now), unique_key=key)
+        queued += 1
+    return queued
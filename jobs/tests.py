@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import Job
+from .queue import enqueue, task
+from .worker import Worker, requeue_stale
+
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task
+def explode():
+    raise RuntimeError("boom")
+
+
+class NeverStop:
+    def is_set(self):
+        return False
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def run_due(self):
+        worker = Worker(batch_size=10)
+        worker.process(worker.claim(), NeverStop())
+        return worker
+
+    def test_runs_by_priority_and_deletes_finished_jobs(self):
+        enqueue(record, ['low'])
+        enqueue(record, ['high'], priority=10)
+        enqueue(record, ['later'], delay=60)
+        self.run_due()
+        self.assertEqual(calls, ['high', 'low'])
+        self.assertEqual(list(Job.objects.values_list('args', flat=True)), [['later']])
+
+    def test_unique_key_dedups_pending_jobs(self):
+        first = enqueue(record, [1], unique_key='k')
+        self.assertEqual(enqueue(record, [2], unique_key='k').pk, first.pk)
+        self.run_due()
+        self.assertNotEqual(enqueue(record, [3], unique_key='k').pk, first.pk)
+
+    def test_failures_back_off_then_fail(self):
+        job = enqueue(explode, max_attempts=2)
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('boom', job.last_error)
+
+    def test_renewed_leases_outlast_a_long_batch(self):
+        job = enqueue(record, [1])
+        worker = Worker()
+        worker.claim()
+        long_ago = timezone.now() - timedelta(seconds=settings.JOBS_LEASE_SECONDS + 10)
+        Job.objects.update(locked_at=long_ago)
+        self.assertEqual(worker.renew(), 1)
+        self.assertEqual(requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('running', worker.token))
+
+    def test_jobs_taken_over_by_another_worker_are_left_alone(self):
+        job = enqueue(record, [1])
+        worker = Worker()
+        [claimed] = worker.claim()
+        Job.objects.filter(pk=job.pk).update(locked_by='other-worker')
+        worker.fail(claimed, 'boom')
+        worker.process([claimed], NeverStop())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.last_error), ('running', 'other-worker', ''))
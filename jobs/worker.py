@@ -0,0 +1,223 @@
+"""
+The loop behind ``manage.py runworkers``.
+
+Each ``Worker`` claims up to ``batch_size`` due jobs with one conditional
+``UPDATE`` (``status='queued'`` → ``'running'``, tagged with the worker's
+token), so two workers never claim the same job and no row locks or broker
+are needed. It runs them in order, deletes the ones that succeeded in one
+statement and reschedules the rest. While it works, a heartbeat thread
+renews the lease (``locked_at``) on every job it holds, so a batch that
+takes longer than ``JOBS_LEASE_SECONDS`` is not handed to another worker;
+and the worker only deletes or reschedules jobs still tagged with its
+token, so one that was handed over after all is settled by its new owner.
+
+``Pool`` runs several workers as threads or processes, and a scheduler in
+the parent that queues periodic tasks and releases jobs whose lease has
+run out.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from foodsaver import metrics
+
+from .models import Job
+from .queue import autodiscover, backoff, resolve, schedule_periodic
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(self, batch_size=None, poll_interval=None):
+        self.batch_size = batch_size or settings.JOBS_BATCH_SIZE
+        self.poll_interval = settings.JOBS_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.processed = 0
+        self.failed = 0
+
+    def claim(self):
+        """Mark up to ``batch_size`` due jobs as ours and return them, highest priority first."""
+        while True:
+            now = timezone.now()
+            ids = list(
+                Job.objects.filter(status='queued', run_at__lte=now)
+                .order_by('-priority', 'run_at', 'id')
+                .values_list('pk', flat=True)[:self.batch_size]
+            )
+            if not ids:
+                return []
+            # Only the rows still queued change hands; if another worker took them all, look again
+            claimed = Job.objects.filter(pk__in=ids, status='queued').update(
+                status='running', locked_by=self.token, locked_at=now, attempts=F('attempts') + 1,
+            )
+            if claimed:
+                break
+        return list(Job.objects.filter(locked_by=self.token, status='running').order_by('-priority', 'run_at', 'id'))
+
+    def renew(self):
+        """Restart the lease on every job this worker holds."""
+        return Job.objects.filter(locked_by=self.token, status='running').update(locked_at=timezone.now())
+
+    def heartbeat(self, stop):
+        """Call ``renew()`` three times per ``JOBS_LEASE_SECONDS`` until ``stop`` is set."""
+        try:
+            while not stop.wait(settings.JOBS_LEASE_SECONDS / 3):
+                try:
+                    self.renew()
+                except DatabaseError:
+                    logger.warning("Could not renew the job leases of %s", self.token, exc_info=True)
+        finally:
+            connections.close_all()
+
+    def run(self, job):
+        """Run one claimed job. Returns True if it succeeded."""
+        metrics.JOB_LAG.labels(job.name).observe(max((timezone.now() - job.run_at).total_seconds(), 0))
+        try:
+            resolve(job.name)(*job.args, **job.kwargs)
+        except Exception:
+            logger.exception("Job %s (%s) failed on attempt %d", job.pk, job.name, job.attempts)
+            self.fail(job, traceback.format_exc())
+            metrics.JOB_RUNS.labels(job.name, 'failed').inc()
+            return False
+        metrics.JOB_RUNS.labels(job.name, 'succeeded').inc()
+        return True
+
+    def fail(self, job, error):
+        fields = {'locked_by': '', 'locked_at': None, 'last_error': error[-10000:]}
+        if job.attempts >= job.max_attempts:
+            fields['status'] = 'failed'
+        else:
+            fields.update(status='queued', run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)))
+        Job.objects.filter(pk=job.pk, locked_by=self.token).update(**fields)
+        self.failed += 1
+
+    def release(self, jobs):
+        """Hand claimed jobs that were not started back to the queue."""
+        Job.objects.filter(pk__in=[job.pk for job in jobs], locked_by=self.token).update(
+            status='queued', locked_by='', locked_at=None, attempts=F('attempts') - 1,
+        )
+
+    def process(self, jobs, stop):
+        done = []
+        for position, job in enumerate(jobs):
+            if stop.is_set():
+                self.release(jobs[position:])
+                break
+            if self.run(job):
+                done.append(job.pk)
+        if done:
+            Job.objects.filter(pk__in=done, locked_by=self.token).delete()
+            self.processed += len(done)
+
+    def loop(self, stop, burst=False):
+        """Run jobs until ``stop`` is set, or, with ``burst``, until none are due."""
+        beating = threading.Event()
+        threading.Thread(target=self.heartbeat, args=(beating,), name='jobs-heartbeat', daemon=True).start()
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                jobs = self.claim()
+                if not jobs:
+                    if burst:
+                        return
+                    stop.wait(self.poll_interval)
+                    continue
+                self.process(jobs, stop)
+                metrics.maybe_flush()
+        finally:
+            beating.set()
+            metrics.exporter.flush()  # forked workers exit without running atexit hooks
+            connections.close_all()
+
+
+def requeue_stale(now=None):
+    """Release running jobs whose lease (``JOBS_LEASE_SECONDS``) ran out, e.g. after a worker died."""
+    now = now or timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=settings.JOBS_LEASE_SECONDS))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', locked_at=None, last_error='Lease expired',
+    )
+    return failed + stale.update(status='queued', locked_by='', locked_at=None, run_at=now)
+
+
+def _process_main(stop, burst, batch_size, poll_interval):
+    if not apps.ready:  # "spawn" start method
+        django.setup()
+        autodiscover()
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    Worker(batch_size, poll_interval).loop(stop, burst)
+
+
+class Pool:
+    """``workers`` workers as threads (``mode='thread'``) or processes (``mode='process'``)."""
+
+    def __init__(self, workers=1, mode='thread', batch_size=None, poll_interval=None):
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.poll_interval = settings.JOBS_POLL_INTERVAL if poll_interval is None else poll_interval
+
+    def _start(self, burst):
+        if self.mode == 'process':
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            self.stop = context.Event()
+            # Children must not share the parent's database sockets
+            connections.close_all()
+            workers = [
+                context.Process(
+                    target=_process_main, name=f'jobs-worker-{n}',
+                    args=(self.stop, burst, self.batch_size, self.poll_interval),
+                )
+                for n in range(self.workers)
+            ]
+        else:
+            self.stop = threading.Event()
+            workers = [
+                threading.Thread(
+                    target=Worker(self.batch_size, self.poll_interval).loop,
+                    args=(self.stop, burst), name=f'jobs-worker-{n}',
+                )
+                for n in range(self.workers)
+            ]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    def run(self, burst=False):
+        """Run until SIGINT/SIGTERM, or with ``burst`` until no job is due."""
+        schedule_periodic()
+        requeue_stale()
+        workers = self._start(burst)
+        previous = {sig: signal.signal(sig, lambda *args: self.stop.set()) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            while any(worker.is_alive() for worker in workers):
+                self.stop.wait(self.poll_interval)
+                if not self.stop.is_set():
+                    schedule_periodic()
+                    requeue_stale()
+                    close_old_connections()
+                for worker in workers:
+                    if not worker.is_alive():
+                        worker.join()
+        finally:
+            self.stop.set()
+            for worker in workers:
+                worker.join()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            connections.close_all()
@@ -1,27 +1,37 @@
 from django.contrib import admin
+
+from foodsaver.admin_performance import AutocompleteFilter, LargeTableAdmin
+
 from .models import Listing, Claim, PickupAssignment, PickupOTP
 
 
 @admin.register(Listing)
-class ListingAdmin(admin.ModelAdmin):
+class ListingAdmin(LargeTableAdmin):
     list_display = ('id', 'donor', 'food_type', 'quantity_kg', 'status', 'created_at')
-    list_filter = ('status', 'food_type')
+    list_filter = ('status', 'food_type', ('donor', AutocompleteFilter))
+    list_select_related = ('donor',)
+    raw_id_fields = ('donor',)
 
 
 @admin.register(Claim)
-class ClaimAdmin(admin.ModelAdmin):
-    list_display = ('id', 'listing', 'claimant', 'status', 'claimed_at')
-    list_filter = ('status',)
+class ClaimAdmin(LargeTableAdmin):
+    list_display = ('id', 'listing', 'claimant', 'status', 'photo_flagged', 'claimed_at')
+    list_filter = ('status', 'photo_flagged', ('claimant', AutocompleteFilter))
+    list_select_related = ('listing__donor', 'claimant')
+    raw_id_fields = ('listing', 'claimant')
 
 
 @admin.register(PickupAssignment)
-class PickupAssignmentAdmin(admin.ModelAdmin):
+class PickupAssignmentAdmin(LargeTableAdmin):
     list_display = ('id', 'claim', 'volunteer', 'status', 'assigned_at')
-    list_filter = ('status',)
+    list_filter = ('status', ('volunteer', AutocompleteFilter))
+    list_select_related = ('claim__listing__donor', 'claim__claimant', 'volunteer')
+    raw_id_fields = ('claim', 'volunteer')
 
 
 @admin.register(PickupOTP)
-class PickupOTPAdmin(admin.ModelAdmin):
+class PickupOTPAdmin(LargeTableAdmin):
     list_display = ('id', 'assignment', 'code', 'is_verified', 'verified_at', 'created_at')
     list_filter = ('is_verified',)
+    list_select_related = ('assignment__claim__listing__donor', 'assignment__volunteer')
     readonly_fields = ('code', 'assignment', 'created_at')
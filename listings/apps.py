@@ -6,3 +6,9 @@ class ListingsConfig(AppConfig):
 
     def ready(self):
         import listings.signals  # noqa: F401
+
+        from django.conf import settings
+        if getattr(settings, 'PHOTO_HASH_PRELOAD', False):
+            import threading
+            from listings.photo_hashes import get_index
+            threading.Thread(target=lambda: get_index().load(), name='photo-hash-preload', daemon=True).start()
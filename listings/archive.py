@@ -0,0 +1,262 @@
+"""
+Retention for finished listings, claims and pickups.
+
+``archive`` moves every listing older than the cutoff that is finished
+(not active, no open claim or pickup, no claim newer than the cutoff)
+into the ``Archived*`` tables together with its claims and pickups, and
+purges the pickups' OTPs (keeping only when they were verified). It works
+in small batches by primary key, one short transaction each, so it can run
+alongside the site and be stopped and resumed at any point.
+
+Archived rows keep what ``users.impact.rebuild_all``,
+``users.trust.recompute_all``, ``photo_hashes.rebuild_index`` and
+``analytics.heatmap.rebuild`` need, and those include the archive, so
+rebuilt stats match the incremental ones.
+
+``purge_spent_otps`` runs on its own (hourly, ``listings.tasks``) for
+pickups that are not archived yet: it blanks the codes of verified OTPs
+once the pickup is delivered and deletes unverified ones whose listing
+expired more than ``OTP_EXPIRY_GRACE`` ago.
+
+``sweep_orphaned_media`` deletes uploads (and their variants) under
+``MEDIA_ROOT`` that no live or archived row references any more.
+"""
+import os
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from analytics import heatmap
+from users.models import Volunteer
+
+from . import changes, images, pagination
+from .models import (
+    ArchivedClaim, ArchivedListing, ArchivedPickupAssignment, ChangeLogEntry, Claim, Listing, PickupAssignment,
+    PickupOTP,
+)
+
+OPEN_CLAIM_STATUSES = ('pending', 'approved')
+OPEN_PICKUP_STATUSES = ('assigned', 'picked_up')
+
+# Unverified OTPs of listings that expired longer ago than this can no longer be used
+OTP_EXPIRY_GRACE = timedelta(days=1)
+
+# Upload directories (``upload_to``) swept for orphaned files
+MEDIA_DIRS = ('listings', 'claims')
+
+
+@dataclass
+class ArchiveStats:
+    listings: int = 0
+    claims: int = 0
+    pickups: int = 0
+    otps: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows(self):
+        return self.listings + self.claims + self.pickups + self.otps
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def cutoff_for(days=None):
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_listings(cutoff):
+    open_claims = Claim.objects.filter(listing=OuterRef('pk'), status__in=OPEN_CLAIM_STATUSES)
+    recent_claims = Claim.objects.filter(listing=OuterRef('pk'), claimed_at__gte=cutoff)
+    open_pickups = PickupAssignment.objects.filter(claim__listing=OuterRef('pk'), status__in=OPEN_PICKUP_STATUSES)
+    return (
+        Listing.objects.filter(created_at__lt=cutoff)
+        .exclude(status='active')
+        .exclude(Exists(open_claims))
+        .exclude(Exists(recent_claims))
+        .exclude(Exists(open_pickups))
+    )
+
+
+def _archive_batch(listing_ids, cutoff, stats):
+    with pagination.bulk_invalidation() as touched_users, transaction.atomic():
+        # Re-check inside the transaction: a listing may have changed since it was picked
+        listings = list(archivable_listings(cutoff).filter(pk__in=listing_ids))
+        if not listings:
+            return
+        ids = [listing.pk for listing in listings]
+        # Count them in the heatmap while they are still listings (rebuild reads the archive)
+        heatmap.roll_up(listing_ids=ids)
+        claims = list(Claim.objects.filter(listing_id__in=ids))
+        claim_ids = [claim.pk for claim in claims]
+        pickups = list(PickupAssignment.objects.filter(claim_id__in=claim_ids))
+        pickup_ids = [pickup.pk for pickup in pickups]
+        verified_at = dict(
+            PickupOTP.objects.filter(assignment_id__in=pickup_ids, is_verified=True)
+            .values_list('assignment_id', 'verified_at')
+        )
+
+        ArchivedListing.objects.bulk_create([
+            ArchivedListing(
+                id=l.pk, donor_id=l.donor_id, food_type=l.food_type, quantity_kg=l.quantity_kg,
+                servings=l.servings, description=l.description, expiry_time=l.expiry_time,
+                pickup_instructions=l.pickup_instructions, image=l.image.name or '',
+                status=l.status, created_at=l.created_at,
+            )
+            for l in listings
+        ])
+        ArchivedClaim.objects.bulk_create([
+            ArchivedClaim(
+                id=c.pk, listing_id=c.listing_id, claimant_id=c.claimant_id, status=c.status,
+                claimed_at=c.claimed_at, quantity_kg=c.quantity_kg, servings=c.servings,
+                rejected_by_donor=c.rejected_by_donor, claimant_photo=c.claimant_photo.name or '',
+                donor_photo=c.donor_photo.name or '', claimant_photo_hash=c.claimant_photo_hash,
+                donor_photo_hash=c.donor_photo_hash, photo_flagged=c.photo_flagged,
+            )
+            for c in claims
+        ])
+        ArchivedPickupAssignment.objects.bulk_create([
+            ArchivedPickupAssignment(
+                id=p.pk, claim_id=p.claim_id, volunteer_id=p.volunteer_id, assigned_at=p.assigned_at,
+                status=p.status, notes=p.notes, otp_verified_at=verified_at.get(p.pk),
+            )
+            for p in pickups
+        ])
+
+        volunteer_users = dict(
+            Volunteer.objects.filter(pk__in={p.volunteer_id for p in pickups}).values_list('pk', 'user_id')
+        )
+        touched_users.update(l.donor_id for l in listings)
+        touched_users.update(c.claimant_id for c in claims)
+        touched_users.update(volunteer_users.values())
+
+        # Tombstones for the change feed (signal handlers skip bulk jobs)
+        donors = {l.pk: l.donor_id for l in listings}
+        claim_parties = {c.pk: (donors[c.listing_id], c.claimant_id) for c in claims}
+        ChangeLogEntry.objects.bulk_create(
+            [changes.entry('pickup', p.pk, 'delete', *claim_parties[p.claim_id], volunteer_users.get(p.volunteer_id))
+             for p in pickups]
+            + [changes.entry('claim', c.pk, 'delete', *claim_parties[c.pk]) for c in claims]
+            + [changes.entry('listing', l.pk, 'delete', l.donor_id) for l in listings]
+        )
+
+        # Children first, so each delete is a plain batch instead of a cascade
+        stats.otps += PickupOTP.objects.filter(assignment_id__in=pickup_ids).delete()[0]
+        PickupAssignment.objects.filter(pk__in=pickup_ids).delete()
+        Claim.objects.filter(pk__in=claim_ids).delete()
+        Listing.objects.filter(pk__in=ids).delete()
+
+    stats.listings += len(ids)
+    stats.claims += len(claim_ids)
+    stats.pickups += len(pickup_ids)
+
+
+def archive(days=None, batch_size=None, max_seconds=None, pause=0.0, progress=None):
+    """
+    Archive finished history older than ``days`` (``ARCHIVE_AFTER_DAYS``).
+
+    ``max_seconds`` stops after the current batch once exceeded; the next run
+    picks up where this one stopped. ``progress(stats)`` is called after
+    every batch.
+    """
+    cutoff = cutoff_for(days)
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    stats = ArchiveStats()
+    started = time.monotonic()
+    candidates = archivable_listings(cutoff).order_by('pk').values_list('pk', flat=True)
+    last_id = 0
+    while True:
+        ids = list(candidates.filter(pk__gt=last_id)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        _archive_batch(ids, cutoff, stats)
+        stats.batches += 1
+        stats.elapsed = time.monotonic() - started
+        if progress:
+            progress(stats)
+        if max_seconds is not None and stats.elapsed > max_seconds:
+            break
+        if pause:
+            time.sleep(pause)  # let other writers in between batches
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def purge_spent_otps(now=None):
+    """
+    Drop OTP codes nobody can use any more. Verified ones keep the row (its
+    ``verified_at`` feeds the impact and trust rebuilds) with the code
+    blanked; unverified ones of long-expired listings are deleted. Returns
+    ``(blanked, deleted)``.
+    """
+    cutoff = (now or timezone.now()) - OTP_EXPIRY_GRACE
+    blanked = (
+        PickupOTP.objects.filter(is_verified=True, assignment__status='delivered')
+        .exclude(code='')
+        .update(code='')
+    )
+    deleted = PickupOTP.objects.filter(
+        is_verified=False, assignment__claim__listing__expiry_time__lt=cutoff,
+    ).delete()[0]
+    return blanked, deleted
+
+
+def referenced_media():
+    """Storage names of every upload (and its variants) still referenced by a live or archived row."""
+    names = set()
+    sources = (
+        Listing.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True),
+        ArchivedListing.objects.exclude(image='').values_list('image', flat=True),
+    )
+    photo_sources = (
+        Claim.objects.values_list('claimant_photo', 'donor_photo'),
+        ArchivedClaim.objects.values_list('claimant_photo', 'donor_photo'),
+    )
+    for queryset in sources:
+        names.update(queryset.iterator(chunk_size=5000))
+    for queryset in photo_sources:
+        for pair in queryset.iterator(chunk_size=5000):
+            names.update(name for name in pair if name)
+    for name in list(names):
+        names.update(images.variant_name(name, variant) for variant in images.VARIANTS)
+    return names
+
+
+def sweep_orphaned_media(grace=timedelta(hours=24), dry_run=False):
+    """
+    Delete unreferenced files under the upload directories of ``MEDIA_ROOT``.
+
+    Files younger than ``grace`` are kept: an upload is written before the
+    row that references it is committed. Returns ``(files, bytes)``.
+    """
+    root = str(settings.MEDIA_ROOT)
+    referenced = referenced_media()
+    newest = time.time() - grace.total_seconds()
+    files = size = 0
+    for directory in MEDIA_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(root, directory)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                if name in referenced:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > newest:
+                        continue
+                    if not dry_run:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                files += 1
+                size += stat.st_size
+    return files, size
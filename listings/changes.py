@@ -0,0 +1,195 @@
+"""
+Change feed for delta sync of listings, claims and pickups.
+
+Every insert, update and delete of a ``Listing``, ``Claim`` or
+``PickupAssignment`` appends a ``ChangeLogEntry`` in the same transaction
+(``listings.signals``; bulk jobs and ``QuerySet.update`` callers record
+theirs explicitly). ``feed(user, since)`` returns what changed after
+sequence number ``since`` that ``user`` may see:
+
+    {
+      "seq": 1234,            # pass back as ?since= on the next poll
+      "more": false,          # true: a full page was returned, poll again right away
+      "listing": {
+        "upserted": {"id": [...], "status": [...], ...},   # one array per column
+        "inserted": [ids],    # the upserted rows created in this window
+        "deleted": [ids]      # tombstones
+      },
+      "claim": {...}, "pickup": {...}
+    }
+
+Several changes to one row collapse into its current state, so a poll
+costs bytes in proportion to the rows that changed, not to the data set.
+Timestamps are Unix seconds.
+
+Sequence numbers are handed out when the entry is inserted, but a
+transaction that got an earlier number may commit later. A poll therefore
+stops before any gap in the numbers that is younger than
+``GAP_GRACE_SECONDS``; older gaps are rolled-back transactions and are
+skipped. Entries older than ``CHANGE_FEED_RETENTION_DAYS`` are trimmed by
+``manage.py archive_history``; a client behind that must reload in full
+(``FeedExpired``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import ChangeLogEntry, Claim, Listing, PickupAssignment
+
+PAGE_SIZE = 1000
+GAP_GRACE_SECONDS = 10
+
+LISTING_COLUMNS = (
+    'id', 'status', 'food_type', 'quantity_kg', 'servings', 'remaining_kg', 'expiry_time', 'donor_name', 'lat', 'lng',
+)
+CLAIM_COLUMNS = ('id', 'listing_id', 'status', 'quantity_kg', 'claimed_at')
+PICKUP_COLUMNS = ('id', 'claim_id', 'status', 'assigned_at', 'volunteer_name')
+
+MODEL_NAMES = {Listing: 'listing', Claim: 'claim', PickupAssignment: 'pickup'}
+
+
+class FeedExpired(Exception):
+    """``since`` is older than the oldest retained entry."""
+
+
+def _audience(instance):
+    """(donor_user_id, claimant_user_id, volunteer_user_id) of a listing, claim or pickup."""
+    from users.models import Volunteer
+
+    if isinstance(instance, Listing):
+        return instance.donor_id, None, None
+    if isinstance(instance, Claim):
+        donor_id = Listing.objects.filter(pk=instance.listing_id).values_list('donor_id', flat=True).first()
+        return donor_id, instance.claimant_id, None
+    claim = (
+        Claim.objects.filter(pk=instance.claim_id).values_list('listing__donor_id', 'claimant_id').first()
+        or (None, None)
+    )
+    volunteer_user_id = Volunteer.objects.filter(pk=instance.volunteer_id).values_list('user_id', flat=True).first()
+    return claim[0], claim[1], volunteer_user_id
+
+
+def entry(model, object_id, op, donor_user_id=None, claimant_user_id=None, volunteer_user_id=None):
+    """An unsaved ``ChangeLogEntry``, for bulk jobs that write many at once."""
+    return ChangeLogEntry(
+        model=model, object_id=object_id, op=op, donor_user_id=donor_user_id,
+        claimant_user_id=claimant_user_id, volunteer_user_id=volunteer_user_id,
+    )
+
+
+def record(instance, op):
+    """Log an insert, update or delete of a ``Listing``, ``Claim`` or ``PickupAssignment``."""
+    entry(MODEL_NAMES[type(instance)], instance.pk, op, *_audience(instance)).save()
+
+
+def record_listing_updates(listings):
+    """Log updates of ``(id, donor_id)`` listing pairs changed with ``QuerySet.update``."""
+    ChangeLogEntry.objects.bulk_create([entry('listing', pk, 'update', donor_id) for pk, donor_id in listings])
+
+
+def record_claim_updates(claims):
+    """Log updates of ``(id, donor_id, claimant_id)`` claims changed with ``QuerySet.update``."""
+    ChangeLogEntry.objects.bulk_create([entry('claim', pk, 'update', donor_id, claimant_id) for pk, donor_id, claimant_id in claims])
+
+
+def current_seq():
+    return ChangeLogEntry.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def trim(days=None):
+    """
+    Delete entries older than ``days`` (``CHANGE_FEED_RETENTION_DAYS``).
+    The newest entry is always kept, so ``feed`` can tell how far back the
+    log reaches. Returns how many were deleted.
+    """
+    days = settings.CHANGE_FEED_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return ChangeLogEntry.objects.filter(created_at__lt=cutoff, seq__lt=current_seq()).delete()[0]
+
+
+def _visible(change, user):
+    return change.model == 'listing' or user.is_superuser or user.pk in (
+        change.donor_user_id, change.claimant_user_id, change.volunteer_user_id,
+    )
+
+
+def _timestamp(value):
+    return int(value.timestamp())
+
+
+def _listing_rows(ids):
+    for listing in Listing.objects.filter(pk__in=ids).select_related('donor'):
+        donor = listing.donor
+        yield listing.pk, (
+            listing.pk, listing.status, listing.food_type, listing.quantity_kg, listing.servings, listing.remaining_kg,
+            _timestamp(listing.expiry_time), donor.username, donor.latitude or 0, donor.longitude or 0,
+        )
+
+
+def _claim_rows(ids):
+    for claim in Claim.objects.filter(pk__in=ids).only('pk', 'listing_id', 'status', 'quantity_kg', 'claimed_at'):
+        yield claim.pk, (claim.pk, claim.listing_id, claim.status, claim.quantity_kg, _timestamp(claim.claimed_at))
+
+
+def _pickup_rows(ids):
+    for pickup in PickupAssignment.objects.filter(pk__in=ids).select_related('volunteer'):
+        yield pickup.pk, (
+            pickup.pk, pickup.claim_id, pickup.status, _timestamp(pickup.assigned_at), pickup.volunteer.name,
+        )
+
+
+SERIALIZERS = {
+    'listing': (LISTING_COLUMNS, _listing_rows),
+    'claim': (CLAIM_COLUMNS, _claim_rows),
+    'pickup': (PICKUP_COLUMNS, _pickup_rows),
+}
+
+
+def _safe_entries(since, limit):
+    """Entries after ``since`` up to the first gap that may still be filled, and whether more follow."""
+    entries = list(ChangeLogEntry.objects.filter(seq__gt=since).order_by('seq')[:limit + 1])
+    more = len(entries) > limit
+    entries = entries[:limit]
+    settled = timezone.now() - timedelta(seconds=GAP_GRACE_SECONDS)
+    expected = since + 1
+    for position, change in enumerate(entries):
+        if change.seq != expected and change.created_at > settled:
+            # Poll again after the usual interval, not in a loop until the gap settles
+            return entries[:position], False
+        expected = change.seq + 1
+    return entries, more
+
+
+def feed(user, since, limit=PAGE_SIZE):
+    """The changes after ``since`` that ``user`` may see, in the columnar form described above."""
+    oldest = ChangeLogEntry.objects.aggregate(seq=Min('seq'))['seq']
+    if oldest is not None and since < oldest - 1:
+        raise FeedExpired(since)
+    entries, more = _safe_entries(since, limit)
+    result = {'seq': entries[-1].seq if entries else since, 'more': more}
+
+    changes = {}  # model -> {object id: (inserted, deleted)}
+    for change in entries:
+        if not _visible(change, user):
+            continue
+        seen = changes.setdefault(change.model, {})
+        inserted, _ = seen.get(change.object_id, (False, False))
+        seen[change.object_id] = (inserted or change.op == 'insert', change.op == 'delete')
+
+    for model, seen in changes.items():
+        columns, rows = SERIALIZERS[model]
+        live = [pk for pk, (_, deleted) in seen.items() if not deleted]
+        current = dict(rows(live))
+        upserted = {column: [] for column in columns}
+        for row in current.values():
+            for column, value in zip(columns, row):
+                upserted[column].append(value)
+        result[model] = {
+            'upserted': upserted,
+            'inserted': [pk for pk in current if seen[pk][0]],
+            # Deleted in this window, or gone before we could read it
+            'deleted': [pk for pk, (_, deleted) in seen.items() if deleted or pk not in current],
+        }
+    return result
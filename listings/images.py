@@ -0,0 +1,213 @@
+"""
+Uploaded image pipeline for listing and claim photos.
+
+Before an upload is stored its metadata (location, device serials, …) is
+dropped, so the served original never carries the donor's GPS position;
+JPEGs are stripped without re-encoding, keeping only their orientation
+tag. It is then written once under the
+SHA-256 of those bytes (``listings/ab/abcdef….jpg``), so re-uploading an
+identical photo reuses the existing file instead of storing a copy. Only
+resizing is left off the request path: ``schedule`` queues a job
+(``listings.tasks.render_image_variants``) that renders fixed-size WebP
+variants (see ``VARIANTS``) next to it.
+
+Templates pick a variant with the ``image_variant`` filter from
+``listing_images``, which falls back to the original until the variant exists.
+"""
+import hashlib
+import io
+import os
+import posixpath
+import threading
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from jobs.queue import enqueue
+
+# name → bounding box in pixels
+VARIANTS = {
+    'thumb': 320,
+    'display': 1280,
+}
+
+# Image info kept when metadata is re-encoded away (colour and transparency, nothing identifying)
+KEPT_INFO = ('icc_profile', 'transparency', 'dpi')
+ORIENTATION = 0x0112
+# JPEG segments copied as they are: JFIF (APP0) and Adobe colour transform (APP14),
+# and from APP2 only the ICC profile. Every other APPn and comment is metadata.
+KEPT_JPEG_SEGMENTS = (0xE0, 0xEE)
+
+
+def _strip_jpeg(data, orientation):
+    """
+    ``data`` without metadata segments or images appended after it (MPF
+    previews), losslessly: the compressed image data is copied, not
+    decoded. Only the EXIF orientation is written back. None if the JPEG
+    is malformed.
+    """
+    from PIL import Image
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    out, pos, size = [data[:2]], 2, len(data)
+    if data[2:4] == b'\xff\xe0':
+        # JFIF readers expect their APP0 right after SOI, so it goes before the EXIF APP1
+        pos = 4 + int.from_bytes(data[4:6], 'big')
+        if pos > size:
+            return None
+        out.append(data[2:pos])
+    if orientation not in (None, 1):
+        exif = Image.Exif()
+        exif[ORIENTATION] = orientation
+        payload = exif.tobytes()
+        out.append(b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload)
+    while pos + 2 <= size:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0xD9:  # end of the (first) image
+            out.append(data[pos:pos + 2])
+            return b''.join(out)
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if end > size or end < pos + 4:
+            return None
+        if marker == 0xE2:
+            keep = data[pos + 4:pos + 16] == b'ICC_PROFILE\x00'
+        else:
+            keep = not (0xE0 <= marker <= 0xEF or marker == 0xFE) or marker in KEPT_JPEG_SEGMENTS
+        if keep:
+            out.append(data[pos:end])
+        pos = end
+        if marker == 0xDA:
+            # Compressed data runs to the next marker that is not a stuffed 0xFF00 or a restart
+            scan = pos
+            while True:
+                scan = data.find(b'\xff', scan)
+                if scan < 0 or scan + 1 >= size:
+                    return None
+                following = data[scan + 1]
+                if following in (0x00, 0xFF) or 0xD0 <= following <= 0xD7:
+                    scan += 1
+                    continue
+                break
+            out.append(data[pos:scan])
+            pos = scan
+    return None
+
+
+def strip_metadata(content):
+    """
+    The image in ``content`` without EXIF/XMP/IPTC, as bytes; None when
+    there is nothing to strip (or it is not an image Pillow reads).
+
+    JPEGs are stripped losslessly, keeping the orientation tag; other
+    formats are turned upright and re-encoded.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    content.seek(0)
+    try:
+        with Image.open(content) as original:
+            image_format = original.format
+            if image_format in ('JPEG', 'MPO'):
+                content.seek(0)
+                stripped = _strip_jpeg(content.read(), original.getexif().get(ORIENTATION))
+                if stripped is not None:
+                    return stripped
+                image_format = 'JPEG'
+            elif not (original.getexif() or 'exif' in original.info or 'xmp' in original.info):
+                return None
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except UnidentifiedImageError:
+        return None
+    finally:
+        content.seek(0)
+    image.info = {key: value for key, value in image.info.items() if key in KEPT_INFO}
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores each file under the hash of its content; identical uploads share one file."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        stripped = strip_metadata(content)
+        if stripped is not None:
+            content = ContentFile(stripped, name=content.name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        directory = posixpath.dirname(name)
+        ext = posixpath.splitext(name)[1].lower()
+        name = posixpath.join(directory, hexdigest[:2], f"{hexdigest}{ext}")
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+_storage = ContentAddressedStorage()
+
+
+def content_addressed_storage():
+    return _storage
+
+
+def variant_name(name, variant):
+    stem, _ = posixpath.splitext(name)
+    return f"{stem}.{variant}.webp"
+
+
+def variant_url(fieldfile, variant):
+    """URL of a processed variant, or of the original while it is still being processed."""
+    if not fieldfile:
+        return ''
+    name = variant_name(fieldfile.name, variant)
+    if fieldfile.storage.exists(name):
+        return fieldfile.storage.url(name)
+    return fieldfile.url
+
+
+def _write_atomically(path, save):
+    tmp_path = f"{path}.tmp-{threading.get_ident()}"
+    save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def process_image(name, storage=None):
+    """Render the variants of a stored upload. Idempotent."""
+    from PIL import Image, ImageOps
+
+    storage = storage or _storage
+    with Image.open(storage.path(name)) as original:
+        image = ImageOps.exif_transpose(original)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        target = storage.path(variant_name(name, variant))
+        _write_atomically(target, lambda tmp: resized.save(tmp, 'WEBP', quality=80, method=4))
+
+
+def schedule(fieldfile):
+    """Queue a job to render a stored image's variants (run once the current transaction commits)."""
+    if not fieldfile or not isinstance(fieldfile.storage, ContentAddressedStorage):
+        return
+    name = fieldfile.name
+    if fieldfile.storage.exists(variant_name(name, 'thumb')):
+        return  # already processed (e.g. a de-duplicated re-upload)
+    enqueue('listings.tasks.render_image_variants', [name], priority=5, unique_key=f'image-variants:{name}')
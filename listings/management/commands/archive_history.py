@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from listings import archive, changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Move finished listings, claims and pickups older than ARCHIVE_AFTER_DAYS into the archive tables, "
+        "purge their OTPs, trim the change feed and delete orphaned uploads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Archive history older than this (default: ARCHIVE_AFTER_DAYS).")
+        parser.add_argument('--batch-size', type=int, default=None, help="Listings per transaction (default: ARCHIVE_BATCH_SIZE).")
+        parser.add_argument('--max-seconds', type=float, default=None, help="Stop after this long; the next run resumes.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument('--skip-media', action='store_true', help="Don't sweep orphaned uploads.")
+        parser.add_argument('--media-grace-hours', type=float, default=24, help="Never delete uploads younger than this.")
+        parser.add_argument('--dry-run-media', action='store_true', help="Report orphaned uploads without deleting them.")
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity > 1:
+                self.stdout.write(
+                    f"  batch {stats.batches}: {stats.rows} rows so far, {stats.rows_per_second:.0f} rows/s"
+                )
+
+        stats = archive.archive(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            max_seconds=options['max_seconds'],
+            pause=options['pause'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {stats.listings} listings, {stats.claims} claims, {stats.pickups} pickups "
+            f"and purged {stats.otps} OTPs in {stats.batches} batches, {stats.elapsed:.1f}s "
+            f"({stats.rows_per_second:.0f} rows/s)."
+        ))
+
+        blanked, deleted = archive.purge_spent_otps()
+        self.stdout.write(self.style.SUCCESS(f"Blanked {blanked} verified OTP codes and deleted {deleted} expired OTPs."))
+
+        trimmed = changes.trim()
+        self.stdout.write(self.style.SUCCESS(f"Trimmed {trimmed} change-feed entries."))
+
+        if not options['skip_media']:
+            files, size = archive.sweep_orphaned_media(
+                grace=timedelta(hours=options['media_grace_hours']),
+                dry_run=options['dry_run_media'],
+            )
+            verb = "Found" if options['dry_run_media'] else "Deleted"
+            self.stdout.write(self.style.SUCCESS(f"{verb} {files} orphaned uploads ({size / 1024 / 1024:.1f} MB)."))
@@ -0,0 +1,154 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from foodsaver.benchmarking import percentile, scratch_database
+from listings.models import Claim, Listing, PickupAssignment
+from users.models import User, Volunteer
+
+# (label, user, view)
+TARGETS = (
+    ('listing_api', None, 'listing_api'),
+    ('volunteer_dashboard', 'volunteer', 'volunteer_dashboard'),
+    ('claimant_dashboard', 'ngo', 'claimant_dashboard'),
+)
+
+
+def _stats(latencies, elapsed):
+    ordered = sorted(latencies)
+    return len(ordered) / elapsed, percentile(ordered, 50) * 1000, percentile(ordered, 99) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the async listing and volunteer endpoints under WSGI (WSGIHandler on a thread "
+        "pool) and ASGI (the ASGI application on one event loop), in this process, against a "
+        "throwaway database with --listings open listings. Reports requests/s and p50/p99."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=300, help="Requests per run.")
+        parser.add_argument(
+            '--concurrency', default='1,16', help="Comma-separated in-flight request counts, e.g. 1,16.",
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        levels = [int(level) for level in options['concurrency'].split(',') if level]
+        with scratch_database(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            users = self.seed(options['listings'])
+            cookies = {None: ''}
+            for role, user in users.items():
+                client = Client()
+                client.force_login(user)
+                cookies[role] = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            wsgi, asgi = WSGIHandler(), get_asgi_application()
+
+            for label, role, view in TARGETS:
+                path = reverse(view)
+                for level in levels:
+                    w = self.run_wsgi(wsgi, path, cookies[role], level, count)
+                    a = asyncio.run(self.run_asgi(asgi, path, cookies[role], level, count))
+                    self.stdout.write(
+                        f"{label:20} c={level:<3} "
+                        f"WSGI {w[0]:6.0f} req/s  p50 {w[1]:7.1f}  p99 {w[2]:7.1f} ms | "
+                        f"ASGI {a[0]:6.0f} req/s  p50 {a[1]:7.1f}  p99 {a[2]:7.1f} ms"
+                    )
+
+    def run_wsgi(self, handler, path, cookie, level, count):
+        def one(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver',
+                'HTTP_COOKIE': cookie, 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+            }
+            statuses = []
+            start = time.perf_counter()
+            b''.join(handler(environ, lambda status, headers, *rest: statuses.append(status)))
+            taken = time.perf_counter() - start
+            connections.close_all()  # this pool thread's
+            if not statuses[0].startswith('200'):
+                raise CommandError(f"WSGI {path} answered {statuses[0]}")
+            return taken
+
+        with ThreadPoolExecutor(level) as pool:
+            start = time.perf_counter()
+            latencies = list(pool.map(one, range(count)))
+            return _stats(latencies, time.perf_counter() - start)
+
+    async def run_asgi(self, application, path, cookie, level, count):
+        slots, latencies = asyncio.Semaphore(level), []
+
+        async def one():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 1), 'server': ('testserver', 80),
+            }
+            sent, messages = [], asyncio.Queue()
+            messages.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+
+            async def receive():
+                return await messages.get()  # after the body: wait, the client never disconnects
+
+            async def send(message):
+                sent.append(message)
+
+            async with slots:
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                latencies.append(time.perf_counter() - start)
+            if sent[0]['status'] != 200:
+                raise CommandError(f"ASGI {path} answered {sent[0]['status']}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(count)))
+        return _stats(latencies, time.perf_counter() - start)
+
+    def seed(self, listings):
+        """
+        ``listings`` open listings from one donor; an NGO with ten volunteers that has a quarter
+        of them pending, a quarter approved and a quarter being picked up by one volunteer.
+        """
+        donor = User.objects.create(username='donor', role='donor', institution_name='Bench Kitchen',
+                                    latitude=12.97, longitude=77.59)
+        ngo = User.objects.create(username='ngo', role='claimant', institution_name='Bench Trust')
+        volunteer_user = User.objects.create(username='volunteer', role='volunteer')
+        volunteer = Volunteer.objects.create(ngo=ngo, user=volunteer_user, name='Bench Volunteer')
+        for n in range(9):
+            Volunteer.objects.create(ngo=ngo, name=f'Volunteer {n}')
+        expiry = timezone.now() + timedelta(days=1)
+        rows = Listing.objects.bulk_create(
+            [
+                Listing(donor=donor, food_type='cooked', quantity_kg=10, remaining_kg=10,
+                        description=f'Rice and dal, tray {n}', status='active', expiry_time=expiry)
+                for n in range(listings)
+            ],
+            batch_size=1000,
+        )
+        quarter = listings // 4
+        claims = Claim.objects.bulk_create(
+            [
+                Claim(listing=listing, claimant=ngo, quantity_kg=2, status='pending' if n < quarter else 'approved')
+                for n, listing in enumerate(rows[:3 * quarter])
+            ],
+            batch_size=1000,
+        )
+        PickupAssignment.objects.bulk_create(
+            [PickupAssignment(claim=claim, volunteer=volunteer) for claim in claims[2 * quarter:]],
+            batch_size=1000,
+        )
+        return {'ngo': ngo, 'volunteer': volunteer_user}
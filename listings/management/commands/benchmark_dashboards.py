@@ -0,0 +1,121 @@
+import gc
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from foodsaver.benchmarking import scratch_database, summary_ms, timings
+from listings import read_models
+from listings.models import Claim, Listing, PickupAssignment, PickupOTP
+from users.models import User, Volunteer
+
+DESCRIPTION = 'Freshly cooked rice and dal, packed in sealed containers. ' * 8
+
+
+def donor_dashboard(donor):
+    return read_models.donor_pickups(donor), read_models.incoming_claims(donor)
+
+
+def claimant_dashboard(ngo):
+    return (
+        read_models.ngo_volunteers(ngo), list(read_models.feed_listings()), read_models.pending_claims(ngo),
+        read_models.unassigned_claims(ngo), read_models.assigned_tasks(ngo),
+    )
+
+
+def volunteer_dashboard(volunteer):
+    return read_models.active_assignments(volunteer)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the dashboard read models (listings.read_models: queries plus row building, no "
+        "template) and measure the memory they allocate with tracemalloc, against a throwaway "
+        "database with --rows rows in every dashboard list."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5, help="Builds timed per dashboard.")
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            donor, ngo, volunteer = self.seed(options['rows'])
+            for label, build, owner in (
+                ('donor dashboard', donor_dashboard, donor),
+                ('claimant dashboard', claimant_dashboard, ngo),
+                ('volunteer dashboard', volunteer_dashboard, volunteer),
+            ):
+                build(owner)  # warm the page cache
+                with CaptureQueriesContext(connection) as queries:
+                    result = build(owner)
+                rows = sum(len(part) for part in result) if isinstance(result, tuple) else len(result)
+                del result
+                gc.collect()
+                ordered = timings(lambda: build(owner), options['repeat'])
+                gc.collect()
+                tracemalloc.start()
+                try:
+                    result = build(owner)
+                    retained, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                del result
+                self.stdout.write(
+                    f"{label:22} {rows:6} rows  {len(queries):2} queries  {summary_ms(ordered)}  "
+                    f"retained {retained / 2**20:6.1f} MiB  peak {peak / 2**20:6.1f} MiB"
+                )
+
+    def seed(self, rows):
+        """
+        One donor's ``2 * rows`` active listings, all claimed in part by one NGO: ``rows`` of those
+        claims are being picked up by one volunteer and ``rows`` still need one. Another NGO has
+        a pending claim on ``rows`` of them, and the first NGO has ``rows`` volunteers.
+        """
+        donor = User.objects.create(username='donor', role='donor', institution_name='Bench Kitchen')
+        ngo = User.objects.create(username='ngo', role='claimant', institution_name='Bench Trust')
+        other_ngo = User.objects.create(username='other-ngo', role='claimant')
+        volunteer_user = User.objects.create(username='volunteer', role='volunteer')
+        Volunteer.objects.bulk_create(
+            [
+                Volunteer(ngo=ngo, name=f'Volunteer {n}', volunteer_id=f'BV{n:06d}', phone='9999999999',
+                          email=f'v{n}@example.org', address='12 Long Street, Sector 4, Block B')
+                for n in range(rows - 1)
+            ],
+            batch_size=2000,
+        )
+        volunteer = Volunteer.objects.create(ngo=ngo, user=volunteer_user, name='Bench Volunteer', volunteer_id='BVX')
+        expiry = timezone.now() + timedelta(days=1)
+        listings = Listing.objects.bulk_create(
+            [
+                Listing(donor=donor, food_type='cooked', quantity_kg=10, remaining_kg=5, servings=20,
+                        remaining_servings=10, description=DESCRIPTION, pickup_instructions='Back door, ask for Ravi.',
+                        expiry_time=expiry)
+                for _ in range(2 * rows)
+            ],
+            batch_size=2000,
+        )
+        claims = Claim.objects.bulk_create(
+            [Claim(listing=listing, claimant=ngo, status='approved', quantity_kg=5, servings=10) for listing in listings],
+            batch_size=2000,
+        )
+        Claim.objects.bulk_create(
+            [
+                Claim(listing=listing, claimant=other_ngo, status='pending', quantity_kg=5, servings=10)
+                for listing in listings[:rows]
+            ],
+            batch_size=2000,
+        )
+        assignments = PickupAssignment.objects.bulk_create(
+            [PickupAssignment(claim=claim, volunteer=volunteer, notes='Call on arrival') for claim in claims[:rows]],
+            batch_size=2000,
+        )
+        PickupOTP.objects.bulk_create(
+            [PickupOTP(assignment=assignment, code='123456') for assignment in assignments], batch_size=2000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return donor, ngo, volunteer
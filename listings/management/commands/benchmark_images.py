@@ -0,0 +1,75 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+
+from foodsaver.benchmarking import summary_ms
+from listings import images
+
+
+def phone_photo(width, height, seed):
+    """A JPEG roughly like a phone photo: detailed, rotated by EXIF, with a GPS tag."""
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, gradient.rotate(90).resize((width, height))))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x8825] = {1: 'N', 2: (12.0, 58.0, float(seed)), 3: 'E', 4: (77.0, 35.0, 1.0)}
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the upload image pipeline (listings.images) on synthetic phone photos in a "
+        "temporary directory: the metadata strip each upload waits for, and variant "
+        "rendering in images/s on one thread and on the worker pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        count, workers = options['images'], options['workers']
+        photos = [phone_photo(options['width'], options['height'], n) for n in range(count)]
+        location = tempfile.mkdtemp(prefix='foodsaver-bench-')
+        try:
+            storage = images.ContentAddressedStorage(location=location)
+            taken, names = [], []
+            for n, data in enumerate(photos):
+                start = time.perf_counter()
+                names.append(storage.save('listings/photo.jpg', SimpleUploadedFile(f'{n}.jpg', data)))
+                taken.append(time.perf_counter() - start)
+            self.stdout.write(
+                f"{'upload (strip + store)':28} {summary_ms(sorted(taken))}  "
+                f"({count / sum(taken):.1f} images/s on one thread)"
+            )
+
+            half = count // 2
+            start = time.perf_counter()
+            for name in names[:half]:
+                images.process_image(name, storage)
+            serial = half / (time.perf_counter() - start)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda name: images.process_image(name, storage), names[half:]))
+            pooled = (count - half) / (time.perf_counter() - start)
+            self.stdout.write(f"{'variants, 1 thread':28} {serial:8.2f} images/s")
+            cores = min(workers, os.cpu_count())
+            self.stdout.write(
+                f"{f'variants, {workers} threads':28} {pooled:8.2f} images/s ({pooled / cores:.2f} per core)"
+            )
+        finally:
+            shutil.rmtree(location, ignore_errors=True)
+        self.stdout.write(f"{count} images of {options['width']}x{options['height']}, {os.cpu_count()} CPUs.")
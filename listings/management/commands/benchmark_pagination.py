@@ -0,0 +1,122 @@
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from foodsaver.benchmarking import scratch_database, summary_ms, timings
+from listings import pagination
+from listings.models import Claim, Listing, PickupAssignment
+from users.models import User, Volunteer
+
+ROW = re.compile(r'bench-row-(\d+)')
+
+# (label, user, view) of the pages that show a first page and a total
+PAGES = (
+    ('donor dashboard', 'donor', 'donor_dashboard'),
+    ('NGO history', 'ngo', 'history'),
+    ('volunteer dashboard', 'volunteer', 'volunteer_dashboard'),
+)
+# (label, user, "load more" view)
+WALKS = (
+    ('donor live listings', 'donor', 'donor_listings_more'),
+    ('donor claim history', 'donor', 'donor_history_more'),
+    ('NGO history', 'ngo', 'history_more'),
+    ('volunteer deliveries', 'volunteer', 'volunteer_deliveries_more'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the paginated dashboard and history pages, their \"load more\" endpoints and the "
+        "cached list totals (listings.pagination) against a throwaway database with --rows rows "
+        "in every list. Each list is walked to the end to check every row comes back exactly once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=10, help="Requests timed per page.")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        broken = []
+        # The test client sends "Host: testserver"
+        with scratch_database(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            users = self.seed(rows)
+            clients = {}
+            for role, user in users.items():
+                clients[role] = Client()
+                clients[role].force_login(user)
+
+            for label, role, view in PAGES:
+                url = reverse(view)
+                pagination.invalidate(users[role].pk)
+                first = timings(lambda: clients[role].get(url), 1)
+                warm = timings(lambda: clients[role].get(url), options['repeat'])
+                self.stdout.write(f"{label:34} first {first[0] * 1000:8.2f} ms  then {summary_ms(warm)}")
+
+            donor = users['donor']
+            count = lambda: Claim.objects.filter(listing__donor=donor).count()  # noqa: E731
+            pagination.invalidate(donor.pk)
+            miss = timings(lambda: pagination.cached_stat(donor.pk, 'bench', count), 1)
+            hit = timings(lambda: pagination.cached_stat(donor.pk, 'bench', count), options['repeat'] * 10)
+            self.stdout.write(f"{'cached total (count)':34} miss  {miss[0] * 1000:8.2f} ms  hit  {summary_ms(hit)}")
+
+            for label, role, view in WALKS:
+                seen, taken, duplicated = self.walk(clients[role], reverse(view))
+                ok = seen == set(range(rows)) and not duplicated
+                if not ok:
+                    broken.append(label)
+                self.stdout.write(
+                    f"{f'load more: {label}':34} {len(taken)} pages  {summary_ms(sorted(taken))}  "
+                    f"{len(seen)}/{rows} rows{'' if ok else ', MISSING OR REPEATED'}"
+                )
+        if broken:
+            raise CommandError(f"Rows missing or repeated in: {', '.join(broken)}")
+
+    def walk(self, client, url):
+        """Follow ``next_cursor`` to the end; returns the row numbers seen, per-page seconds and repeats."""
+        seen, taken, duplicated, cursor = set(), [], 0, None
+        while True:
+            start = time.perf_counter()
+            data = client.get(url, {'cursor': cursor} if cursor else {}).json()
+            taken.append(time.perf_counter() - start)
+            page = {int(n) for n in ROW.findall(data['html'])}
+            duplicated += len(page & seen)
+            seen |= page
+            cursor = data['next_cursor']
+            if not cursor:
+                return seen, taken, duplicated
+
+    def seed(self, rows):
+        """A donor with ``rows`` live listings and ``rows`` finished ones, each claimed by one NGO and delivered by one volunteer."""
+        donor = User.objects.create(username='donor', role='donor', institution_name='Bench Kitchen')
+        ngo = User.objects.create(username='ngo', role='claimant', institution_name='Bench Trust')
+        volunteer_user = User.objects.create(username='volunteer', role='volunteer')
+        volunteer = Volunteer.objects.create(ngo=ngo, user=volunteer_user, name='Bench Volunteer')
+        expiry = timezone.now() + timedelta(days=1)
+
+        def listings(status):
+            return Listing.objects.bulk_create(
+                [
+                    Listing(donor=donor, food_type='cooked', quantity_kg=5, remaining_kg=5 if status == 'active' else 0,
+                            description=f'Rice bench-row-{n}', status=status, expiry_time=expiry)
+                    for n in range(rows)
+                ],
+                batch_size=1000,
+            )
+
+        listings('active')
+        claims = Claim.objects.bulk_create(
+            [Claim(listing=listing, claimant=ngo, status='completed', quantity_kg=5) for listing in listings('completed')],
+            batch_size=1000,
+        )
+        PickupAssignment.objects.bulk_create(
+            [PickupAssignment(claim=claim, volunteer=volunteer, status='delivered') for claim in claims],
+            batch_size=1000,
+        )
+        return {'donor': donor, 'ngo': ngo, 'volunteer': volunteer_user}
@@ -0,0 +1,90 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from foodsaver.benchmarking import percentile, scratch_database, summary_ms, timings
+from listings import search
+from listings.models import Listing
+from users.models import User
+
+WORDS = (
+    'rice dal curry bread rotis paneer biryani vegetables fruit apples bananas milk curd sandwiches '
+    'pasta soup salad noodles idli dosa sambar poha upma khichdi chapati pulao halwa ladoo cake '
+    'buns muffins cookies juice tomatoes onions potatoes spinach carrots lentils beans oats eggs'
+).split()
+FILLER = 'fresh packed cooked today leftover surplus trays boxes kitchen evening lunch dinner'.split()
+
+# (label, text, near a donor)
+QUERIES = (
+    ('common word', 'rice', False),
+    ('two words', 'paneer curry', False),
+    ('prefix (type-ahead)', 'bir', False),
+    ('rare word', 'khichdi oats', False),
+    ('common word, ranked by distance', 'rice', True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time listing search (listings.search.search_listings) against a throwaway database "
+        "seeded with --listings listings, the newest --open of them still on offer and the rest "
+        "completed or expired history. The configured database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1_000_000)
+        parser.add_argument('--open', type=int, default=10_000, help="How many of them are active.")
+        parser.add_argument('--donors', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=50, help="Searches timed per query.")
+        parser.add_argument('--target-ms', type=float, default=10.0, help="p95 each query should stay under.")
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError("Search benchmarks need the SQLite FTS5 index.")
+        with scratch_database():
+            self.seed(options['listings'], options['open'], options['donors'])
+            donor = User.objects.filter(role='donor').first()
+            over = 0
+            for label, text, near in QUERIES:
+                position = (donor.latitude, donor.longitude) if near else (None, None)
+                search.search_listings(text, *position)  # warm the page cache
+                ordered = timings(lambda: search.search_listings(text, *position), options['repeat'])
+                slow = percentile(ordered, 95) * 1000 > options['target_ms']
+                over += slow
+                self.stdout.write(f"{label:34} {summary_ms(ordered)}{'  over target' if slow else ''}")
+        style = self.style.ERROR if over else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{len(QUERIES) - over}/{len(QUERIES)} queries under {options['target_ms']:g} ms at p95 "
+            f"with {options['listings']} listings, {options['open']} of them open."
+        ))
+
+    def seed(self, listings, open_listings, donors):
+        rng = random.Random(26)
+        User.objects.bulk_create(
+            [
+                User(username=f'donor{n}', role='donor', institution_name=f'{rng.choice(WORDS).title()} Kitchen {n}',
+                     latitude=12.8 + rng.random() * 0.4, longitude=77.4 + rng.random() * 0.4)
+                for n in range(donors)
+            ],
+            batch_size=2000,
+        )
+        donor_ids = list(User.objects.filter(role='donor').values_list('pk', flat=True))
+        now = timezone.now()
+        history = listings - open_listings
+        for start in range(0, listings, 10_000):
+            Listing.objects.bulk_create([
+                Listing(
+                    donor_id=rng.choice(donor_ids), food_type=rng.choice(('cooked', 'raw', 'packaged')),
+                    quantity_kg=rng.randint(1, 40), remaining_kg=10,
+                    description=' '.join(rng.choices(WORDS, k=3) + rng.choices(FILLER, k=5)),
+                    pickup_instructions=rng.choice(('', 'Back gate', 'Ask at the counter')),
+                    status='active' if n >= history else rng.choice(('completed', 'expired')),
+                    expiry_time=now + timedelta(hours=rng.uniform(1, 72) if n >= history else -rng.uniform(1, 9000)),
+                )
+                for n in range(start, min(start + 10_000, listings))
+            ])
+            self.stdout.write(f"  seeded {min(start + 10_000, listings)}/{listings} listings\r", ending='')
+        self.stdout.write('')
+        search.rebuild_index()
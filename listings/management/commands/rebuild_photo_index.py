@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from listings import photo_hashes
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the claim photo perceptual-hash index file from the hashes stored on claims, "
+        "hashing (and checking for re-use) any claim photo that has no hash yet."
+    )
+
+    def handle(self, *args, **options):
+        indexed, hashed = photo_hashes.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} photo hashes ({hashed} newly hashed)."))
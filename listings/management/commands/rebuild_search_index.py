@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from listings import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the listings full-text search index from scratch."
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            self.stdout.write(self.style.WARNING("Full-text index requires SQLite FTS5; nothing to do."))
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} listings."))
@@ -0,0 +1,39 @@
+# Full-text search index for listings (SQLite FTS5).
+#
+# The SQL is spelled out rather than taken from listings.search, so this
+# migration keeps doing what it did when it was written.
+
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS listings_listing_fts USING fts5("
+        "description, pickup_instructions, institution_name, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO listings_listing_fts (rowid, description, pickup_instructions, institution_name) "
+        "SELECT l.id, l.description, l.pickup_instructions, COALESCE(u.institution_name, '') "
+        "FROM listings_listing l JOIN users_user u ON u.id = l.donor_id"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS listings_listing_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0005_remove_pickupassignment_pickup_otp_pickupotp"),
+        ("users", "0004_volunteer_user_alter_user_role"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
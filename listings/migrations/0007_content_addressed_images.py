@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:20
+
+import listings.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_listing_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='claim',
+            name='claimant_photo',
+            field=models.ImageField(blank=True, help_text='Photo taken by claimant at pickup', null=True, storage=listings.images.content_addressed_storage, upload_to='claims/'),
+        ),
+        migrations.AlterField(
+            model_name='claim',
+            name='donor_photo',
+            field=models.ImageField(blank=True, help_text='Photo taken by donor at handover', null=True, storage=listings.images.content_addressed_storage, upload_to='claims/'),
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=listings.images.content_addressed_storage, upload_to='listings/'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='claim',
+            name='claimant_photo_hash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='donor_photo_hash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='photo_flagged',
+            field=models.BooleanField(default=False, help_text='A photo closely matches one from another claim'),
+        ),
+    ]
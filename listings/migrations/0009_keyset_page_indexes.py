@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_claim_photo_hashes'),
+        ('users', '0006_user_trust_evidence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['claimant', '-claimed_at', '-id'], name='claim_claimant_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['donor', 'status', '-created_at', '-id'], name='listing_donor_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pickupassignment',
+            index=models.Index(fields=['volunteer', 'status', '-assigned_at', '-id'], name='pickup_volunteer_page_idx'),
+        ),
+    ]
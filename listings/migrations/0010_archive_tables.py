@@ -0,0 +1,61 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_keyset_page_indexes'),
+        ('users', '0006_user_trust_evidence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedListing',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('food_type', models.CharField(choices=[('cooked', 'Cooked Meal'), ('raw', 'Raw Ingredients'), ('packaged', 'Packaged Food')], max_length=20)),
+                ('quantity_kg', models.FloatField()),
+                ('servings', models.IntegerField(default=1)),
+                ('description', models.TextField()),
+                ('expiry_time', models.DateTimeField()),
+                ('pickup_instructions', models.TextField(blank=True)),
+                ('image', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('claimed', 'Claimed'), ('completed', 'Completed'), ('expired', 'Expired')], max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('donor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_listings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedClaim',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending Approval'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('completed', 'Completed (Picked Up)')], max_length=20)),
+                ('claimed_at', models.DateTimeField()),
+                ('claimant_photo', models.CharField(blank=True, max_length=255)),
+                ('donor_photo', models.CharField(blank=True, max_length=255)),
+                ('claimant_photo_hash', models.BigIntegerField(blank=True, null=True)),
+                ('donor_photo_hash', models.BigIntegerField(blank=True, null=True)),
+                ('photo_flagged', models.BooleanField(default=False)),
+                ('claimant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_claims', to=settings.AUTH_USER_MODEL)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claims', to='listings.archivedlisting')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPickupAssignment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('assigned_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('assigned', 'Assigned'), ('picked_up', 'Picked Up'), ('delivered', 'Delivered')], max_length=15)),
+                ('notes', models.TextField(blank=True)),
+                ('otp_verified_at', models.DateTimeField(blank=True, null=True)),
+                ('claim', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pickup_assignments', to='listings.archivedclaim')),
+                ('volunteer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_pickup_assignments', to='users.volunteer')),
+            ],
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def backfill(apps, schema_editor):
+    """Unreserved quantity for active listings, and one open claim per NGO and listing."""
+    Listing = apps.get_model('listings', 'Listing')
+    Claim = apps.get_model('listings', 'Claim')
+    Listing.objects.filter(status='active').update(remaining_kg=F('quantity_kg'), remaining_servings=F('servings'))
+    Listing.objects.exclude(status='active').update(remaining_kg=0, remaining_servings=0)
+    open_claims = Claim.objects.filter(status__in=['pending', 'approved'])
+    duplicates = open_claims.values('listing_id', 'claimant_id').annotate(n=Count('id'), first=Min('id')).filter(n__gt=1)
+    for row in duplicates:
+        claims = open_claims.filter(listing_id=row['listing_id'], claimant_id=row['claimant_id'])
+        keep = claims.filter(status='approved').values_list('id', flat=True).first() or row['first']
+        claims.exclude(pk=keep).update(status='rejected')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_change_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedclaim',
+            name='quantity_kg',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedclaim',
+            name='servings',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='quantity_kg',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='servings',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='remaining_kg',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='remaining_servings',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='claim',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'approved'])), fields=('listing', 'claimant'), name='claim_open_per_claimant'),
+        ),
+    ]
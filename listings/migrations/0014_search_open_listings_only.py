@@ -0,0 +1,24 @@
+# The full-text index now holds open listings only; drop the closed ones.
+
+from django.db import migrations
+
+
+def drop_closed_listings(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "DELETE FROM listings_listing_fts WHERE rowid IN "
+        "(SELECT id FROM listings_listing WHERE status IN (%s, %s))",
+        ['completed', 'expired'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0013_listing_rolled_up"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_closed_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:16
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """
+    Earlier rejections were not told apart. Until now only a donor could
+    reject a partial claim; claims for the whole listing were also rejected
+    automatically (and as duplicates by 0012), so those count as automatic.
+    """
+    for model in ('Claim', 'ArchivedClaim'):
+        apps.get_model('listings', model).objects.filter(
+            status='rejected', quantity_kg__isnull=False,
+        ).update(rejected_by_donor=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_search_open_listings_only'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedclaim',
+            name='rejected_by_donor',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='rejected_by_donor',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from .images import content_addressed_storage
 
 class Listing(models.Model):
     FOOD_TYPES = (
@@ -19,12 +20,34 @@ class Listing(models.Model):
     food_type = models.CharField(max_length=20, choices=FOOD_TYPES)
     quantity_kg = models.FloatField()
     servings = models.IntegerField(default=1, help_text="Approximate number of people this can serve")
+    # Not yet reserved by a claim (see listings.reservations)
+    remaining_kg = models.FloatField(null=True, blank=True)
+    remaining_servings = models.IntegerField(null=True, blank=True)
     description = models.TextField()
     expiry_time = models.DateTimeField()
     pickup_instructions = models.TextField(blank=True)
-    image = models.ImageField(upload_to='listings/', blank=True, null=True)
+    image = models.ImageField(upload_to='listings/', storage=content_addressed_storage, blank=True, null=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Counted in the surplus heatmap once completed or expired (see analytics.heatmap)
+    rolled_up = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pages of a donor's listings (listings.pagination)
+            models.Index(fields=['donor', 'status', '-created_at', '-id'], name='listing_donor_page_idx'),
+            # Finished listings the heatmap has not counted yet
+            models.Index(
+                fields=['id'], name='listing_rollup_pending_idx',
+                condition=models.Q(status__in=['completed', 'expired'], rolled_up=False),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.remaining_kg is None:
+            self.remaining_kg = self.quantity_kg
+            self.remaining_servings = self.servings
+        super().save(*args, **kwargs)
 
     def is_expired(self):
         return timezone.now() > self.expiry_time
@@ -44,10 +67,38 @@ class Claim(models.Model):
     claimant = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='claims')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     claimed_at = models.DateTimeField(auto_now_add=True)
+    # Reserved share of the listing; None on claims for the whole listing made before partial claims
+    quantity_kg = models.FloatField(null=True, blank=True)
+    servings = models.IntegerField(null=True, blank=True)
+    # Turned down by the donor, rather than rejected automatically (listing gone or expired);
+    # only these count against the NGO's trust score
+    rejected_by_donor = models.BooleanField(default=False, editable=False)
     
     # Verification
-    claimant_photo = models.ImageField(upload_to='claims/', blank=True, null=True, help_text="Photo taken by claimant at pickup")
-    donor_photo = models.ImageField(upload_to='claims/', blank=True, null=True, help_text="Photo taken by donor at handover")
+    claimant_photo = models.ImageField(upload_to='claims/', storage=content_addressed_storage, blank=True, null=True, help_text="Photo taken by claimant at pickup")
+    donor_photo = models.ImageField(upload_to='claims/', storage=content_addressed_storage, blank=True, null=True, help_text="Photo taken by donor at handover")
+
+    # Perceptual hashes of the photos (see listings.photo_hashes)
+    claimant_photo_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    donor_photo_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    photo_flagged = models.BooleanField(default=False, help_text="A photo closely matches one from another claim")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['claimant', '-claimed_at', '-id'], name='claim_claimant_page_idx'),
+        ]
+        constraints = [
+            # One open claim per NGO and listing
+            models.UniqueConstraint(
+                fields=['listing', 'claimant'],
+                condition=models.Q(status__in=['pending', 'approved']),
+                name='claim_open_per_claimant',
+            ),
+        ]
+
+    @property
+    def claimed_kg(self):
+        return self.listing.quantity_kg if self.quantity_kg is None else self.quantity_kg
 
     def __str__(self):
         return f"Claim for {self.listing} by {self.claimant.username}"
@@ -66,6 +117,11 @@ class PickupAssignment(models.Model):
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='assigned')
     notes = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['volunteer', 'status', '-assigned_at', '-id'], name='pickup_volunteer_page_idx'),
+        ]
+
     def __str__(self):
         return f"Pickup #{self.id} - {self.claim.listing} → {self.volunteer.name}"
 
@@ -92,3 +148,96 @@ class PickupOTP(models.Model):
     def __str__(self):
         status = '✓ Verified' if self.is_verified else '⏳ Pending'
         return f"OTP for Pickup #{self.assignment_id} [{status}]"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    One insert, update or delete of a listing, claim or pickup, numbered by
+    ``seq`` in the order they were written (see ``listings.changes``).
+
+    The ``*_user_id`` columns record who may see the change; listings are
+    visible to everyone.
+    """
+    MODEL_CHOICES = (
+        ('listing', 'Listing'),
+        ('claim', 'Claim'),
+        ('pickup', 'Pickup assignment'),
+    )
+    OP_CHOICES = (
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    )
+
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    donor_user_id = models.IntegerField(null=True, blank=True)
+    claimant_user_id = models.IntegerField(null=True, blank=True)
+    volunteer_user_id = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'Change log entries'
+
+    def __str__(self):
+        return f"#{self.seq} {self.op} {self.model} {self.object_id}"
+
+
+# Archive tables (see listings.archive). Finished listings, their claims and
+# pickups are moved here by ``manage.py archive_history`` once they are old
+# enough; rows keep their original ids and the fields needed to rebuild
+# impact stats, trust scores and the photo hash index.
+
+class ArchivedListing(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    donor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_listings')
+    food_type = models.CharField(max_length=20, choices=Listing.FOOD_TYPES)
+    quantity_kg = models.FloatField()
+    servings = models.IntegerField(default=1)
+    description = models.TextField()
+    expiry_time = models.DateTimeField()
+    pickup_instructions = models.TextField(blank=True)
+    image = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=Listing.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived listing #{self.id} ({self.food_type} - {self.quantity_kg}kg)"
+
+
+class ArchivedClaim(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    listing = models.ForeignKey(ArchivedListing, on_delete=models.CASCADE, related_name='claims')
+    claimant = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_claims')
+    status = models.CharField(max_length=20, choices=Claim.STATUS_CHOICES)
+    claimed_at = models.DateTimeField()
+    quantity_kg = models.FloatField(null=True, blank=True)
+    servings = models.IntegerField(null=True, blank=True)
+    rejected_by_donor = models.BooleanField(default=False)
+    claimant_photo = models.CharField(max_length=255, blank=True)
+    donor_photo = models.CharField(max_length=255, blank=True)
+    claimant_photo_hash = models.BigIntegerField(null=True, blank=True)
+    donor_photo_hash = models.BigIntegerField(null=True, blank=True)
+    photo_flagged = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Archived claim #{self.id}"
+
+
+class ArchivedPickupAssignment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    claim = models.ForeignKey(ArchivedClaim, on_delete=models.CASCADE, related_name='pickup_assignments')
+    volunteer = models.ForeignKey(
+        'users.Volunteer', on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_pickup_assignments'
+    )
+    assigned_at = models.DateTimeField()
+    status = models.CharField(max_length=15, choices=PickupAssignment.STATUS_CHOICES)
+    notes = models.TextField(blank=True)
+    # When the pickup OTP was verified; the OTP itself is purged on archiving
+    otp_verified_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Archived pickup #{self.id}"
@@ -0,0 +1,146 @@
+"""
+Keyset ("load more") pagination for dashboard and history lists.
+
+Pages are cut with ``WHERE (field, id) < (cursor)`` on a descending
+``(field, id)`` ordering instead of ``OFFSET``, so fetching any page costs
+the same however long the history is, and rows inserted meanwhile never
+shift or repeat items. The cursor is an opaque token holding the last
+row's ``(field, id)``.
+
+Totals shown next to these lists come from ``cached_stat``: per-user
+values cached until one of the user's listings, claims or pickups changes
+(see ``invalidate``) or ``STAT_CACHE_SECONDS`` pass. They live in the
+default cache, which settings point at a database table shared by every
+process, so an invalidation in one process reaches all of them.
+"""
+import base64
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+
+PAGE_SIZE = 20
+STAT_CACHE_SECONDS = 300
+
+_pending = ContextVar('pending_stat_invalidations', default=None)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if len(cursor) > 200:  # real ones are ~60 characters; this also keeps json off deep nesting
+        raise InvalidCursor(cursor[:200])
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def keyset_page(queryset, cursor=None, field='created_at', per_page=PAGE_SIZE):
+    """The page of ``queryset`` (newest ``field`` first) that follows ``cursor``."""
+    queryset = queryset.order_by(f'-{field}', '-pk')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(items, next_cursor)
+
+
+def load_more(request, queryset, template, item_name, field='created_at', per_page=PAGE_SIZE):
+    """JSON for a "load more" request: the next page's rendered rows and the cursor after it."""
+    try:
+        page = keyset_page(queryset, request.GET.get('cursor'), field=field, per_page=per_page)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    html = ''.join(render_to_string(template, {item_name: item}, request=request) for item in page)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+
+def _generation_key(user_id):
+    return f'listings:stats-generation:{user_id}'
+
+
+def cached_stat(user_id, name, compute, timeout=STAT_CACHE_SECONDS):
+    """``compute()`` for this user, cached until ``invalidate(user_id)`` or ``timeout``."""
+    generation = cache.get(_generation_key(user_id), 0)
+    key = f'listings:stats:{user_id}:{generation}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def invalidate(*user_ids):
+    """Drop every cached stat of these users."""
+    pending = _pending.get()
+    if pending is not None:
+        pending.update(user_ids)
+        return
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        key = _generation_key(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def in_bulk():
+    return _pending.get() is not None
+
+
+@contextmanager
+def bulk_invalidation():
+    """
+    Collect ``invalidate`` calls made inside the block and apply them once on
+    exit. Signal handlers skip their per-row lookups while this is active
+    (``in_bulk()``), so the bulk job must add the users it touched to the
+    yielded set itself.
+    """
+    pending = set()
+    token = _pending.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending.reset(token)
+        invalidate(*pending)
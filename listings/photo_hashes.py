@@ -0,0 +1,312 @@
+"""
+Perceptual-hash duplicate detection for claim verification photos.
+
+Every claimant/donor photo gets a 64-bit difference hash (dHash), which
+barely changes under re-compression, resizing or small crops. Hashes are
+kept in a multi-index hash table, so finding every earlier photo within
+``PHOTO_DUPLICATE_DISTANCE`` bits probes a few buckets instead of comparing
+against millions of photos. A photo that matches a photo from a
+*different* claim flags the claim (``Claim.photo_flagged``).
+
+The table is persisted as an append-only file of fixed-size records
+(``settings.PHOTO_HASH_INDEX_PATH``). Each process reads it incrementally:
+on every lookup only the bytes appended since its last read are loaded, so
+workers see each other's additions without a full reload. The hashes are
+also stored on the claim itself; ``manage.py rebuild_photo_index``
+regenerates the file from the database, hashing any photo that has none.
+"""
+import logging
+import os
+import struct
+import threading
+from itertools import combinations
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PHOTO_FIELDS = ('claimant_photo', 'donor_photo')
+
+# hash (u64), claim id (u64), photo field index (u8)
+_RECORD = struct.Struct('<QQB')
+_READ_CHUNK = _RECORD.size * 4096
+
+
+def dhash(image):
+    """64-bit difference hash of a PIL image (orientation-corrected)."""
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = image.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash onto a BigIntegerField."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class MultiIndexHashTable:
+    """
+    Multi-index hashing over 64-bit hashes (Norouzi et al.).
+
+    Each hash is split into ``CHUNKS`` 16-bit substrings, each with its own
+    bucket table. Two hashes within ``d`` bits must agree to within
+    ``d // CHUNKS`` bits on at least one substring (pigeonhole), so a search
+    probes a handful of buckets per table and only verifies the hashes found
+    there, instead of walking the whole collection.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    _MASK = (1 << CHUNK_BITS) - 1
+
+    __slots__ = ('values', 'refs', 'tables')
+
+    def __init__(self):
+        self.values = []
+        self.refs = []
+        self.tables = [{} for _ in range(self.CHUNKS)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def _chunks(self, value):
+        return [(value >> (i * self.CHUNK_BITS)) & self._MASK for i in range(self.CHUNKS)]
+
+    def add(self, value, ref):
+        position = len(self.values)
+        self.values.append(value)
+        self.refs.append(ref)
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(position)
+
+    def _probes(self, chunk, radius):
+        yield chunk
+        for bits in range(1, radius + 1):
+            for positions in combinations(range(self.CHUNK_BITS), bits):
+                flipped = chunk
+                for bit in positions:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def search(self, value, max_distance):
+        """All ``(ref, distance)`` within ``max_distance`` bits of ``value``."""
+        radius = max_distance // self.CHUNKS
+        candidates = set()
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for probe in self._probes(chunk, radius):
+                bucket = table.get(probe)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for position in candidates:
+            distance = (self.values[position] ^ value).bit_count()
+            if distance <= max_distance:
+                found.append((self.refs[position], distance))
+        return found
+
+
+class PhotoHashIndex:
+    """A multi-index hash table backed by an append-only record file shared between processes."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.table = MultiIndexHashTable()
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Load records appended to the file since the last read."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode:
+            # First load, or the file was rewritten by rebuild_photo_index
+            self.table = MultiIndexHashTable()
+            self._offset = 0
+            self._inode = stat.st_ino
+        size = stat.st_size
+        usable = size - size % _RECORD.size  # ignore a torn trailing write
+        if usable <= self._offset:
+            return
+        with open(self.path, 'rb') as fh:
+            fh.seek(self._offset)
+            remaining = usable - self._offset
+            while remaining:
+                chunk = fh.read(min(_READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                for value, claim_id, field in _RECORD.iter_unpack(chunk):
+                    self.table.add(value, (claim_id, PHOTO_FIELDS[field]))
+                self._offset += len(chunk)
+
+    def load(self):
+        with self._lock:
+            self._refresh()
+        return self
+
+    def search(self, value, max_distance):
+        with self._lock:
+            self._refresh()
+            return self.table.search(value, max_distance)
+
+    def add(self, value, claim_id, field):
+        record = _RECORD.pack(value, claim_id, PHOTO_FIELDS.index(field))
+        with self._lock:
+            self._refresh()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # O_APPEND writes of one small record are atomic across processes
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, record)
+            finally:
+                os.close(fd)
+            # Our own record will be read back on the next refresh.
+
+    def rewrite(self, records):
+        """Replace the file with ``records`` of ``(hash, claim_id, field)``. Returns the count."""
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        count = 0
+        with open(tmp_path, 'wb') as fh:
+            for value, claim_id, field in records:
+                fh.write(_RECORD.pack(value, claim_id, PHOTO_FIELDS.index(field)))
+                count += 1
+        with self._lock:
+            os.replace(tmp_path, self.path)
+            self._refresh()
+        return count
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PhotoHashIndex(settings.PHOTO_HASH_INDEX_PATH)
+    return _index
+
+
+def find_duplicates(value, exclude_claim_id=None):
+    max_distance = settings.PHOTO_DUPLICATE_DISTANCE
+    return [
+        (ref, distance) for ref, distance in get_index().search(value, max_distance)
+        if ref[0] != exclude_claim_id
+    ]
+
+
+def _hash_file(fh):
+    from PIL import Image
+
+    with Image.open(fh) as image:
+        return dhash(image)
+
+
+def _duplicates(claim_id, field, value):
+    """Photos of other claims that ``value`` matches, logged."""
+    duplicates = find_duplicates(value, exclude_claim_id=claim_id)
+    if duplicates:
+        logger.warning(
+            "Claim #%s %s looks like a re-used photo (matches %s)",
+            claim_id, field, ', '.join(f"claim #{c} {f} at {d} bits" for (c, f), d in duplicates[:5]),
+        )
+    return duplicates
+
+
+def hash_claim_photos(claim_id):
+    """Hash a claim's new photos, check them against the index and record them."""
+    from .models import Claim
+
+    claim = Claim.objects.filter(pk=claim_id).first()
+    if claim is None:
+        return
+    updates = {}
+    index = get_index()
+    for field in PHOTO_FIELDS:
+        photo = getattr(claim, field)
+        if not photo or getattr(claim, f'{field}_hash') is not None:
+            continue
+        with photo.open('rb'):
+            value = _hash_file(photo)
+        if _duplicates(claim.pk, field, value):
+            updates['photo_flagged'] = True
+        index.add(value, claim.pk, field)
+        updates[f'{field}_hash'] = to_signed(value)
+    if updates:
+        Claim.objects.filter(pk=claim.pk).update(**updates)
+
+
+def _hash_unhashed_photos():
+    """
+    Hash and store the photos of live and archived claims that have none
+    (uploaded before hashing existed, or their job never ran). Returns
+    ``(claim_id, field, hash)`` for each.
+    """
+    from .models import ArchivedClaim, Claim
+
+    hashed = []
+    for model in (Claim, ArchivedClaim):
+        for field in PHOTO_FIELDS:
+            storage = Claim._meta.get_field(field).storage
+            rows = (
+                model.objects.filter(**{f'{field}_hash__isnull': True}).exclude(**{field: ''})
+                .exclude(**{f'{field}__isnull': True}).values_list('id', field).order_by('id')
+            )
+            for claim_id, name in rows.iterator(chunk_size=5000):
+                try:
+                    with storage.open(name, 'rb') as fh:
+                        value = _hash_file(fh)
+                except OSError:  # missing or not an image
+                    logger.warning("Could not hash %s of claim #%s (%s)", field, claim_id, name, exc_info=True)
+                    continue
+                model.objects.filter(pk=claim_id).update(**{f'{field}_hash': to_signed(value)})
+                hashed.append((claim_id, field, value))
+    return hashed
+
+
+def rebuild_index():
+    """
+    Rewrite the index file from the hashes stored on live and archived
+    claims, first hashing photos that have none. Those are then checked
+    against the rebuilt index, and of each matching pair the later claim is
+    flagged, as if they had been uploaded in order. Returns ``(indexed, hashed)``.
+    """
+    from .models import ArchivedClaim, Claim
+
+    hashed = _hash_unhashed_photos()
+
+    def records():
+        # Archived claims keep their hashes, so old photos still count as seen
+        for claims in (Claim.objects, ArchivedClaim.objects):
+            rows = claims.values_list('id', 'claimant_photo_hash', 'donor_photo_hash').order_by('id')
+            for claim_id, claimant_hash, donor_hash in rows.iterator(chunk_size=5000):
+                for field, value in zip(PHOTO_FIELDS, (claimant_hash, donor_hash)):
+                    if value is not None:
+                        yield to_unsigned(value), claim_id, field
+
+    indexed = get_index().rewrite(records())
+    flagged = {
+        max(claim_id, other) for claim_id, field, value in hashed
+        for (other, _), _ in _duplicates(claim_id, field, value)
+    }
+    if flagged:
+        for claims in (Claim.objects, ArchivedClaim.objects):  # archived claims keep their ids
+            claims.filter(pk__in=flagged).update(photo_flagged=True)
+    return indexed, len(hashed)
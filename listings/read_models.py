@@ -0,0 +1,225 @@
+"""
+Read models for the dashboards.
+
+Each function below runs one ``values_list`` query for just the columns a
+dashboard shows (joined rows included, no model instances) and returns a
+list of small named tuples, ready for the template: display names,
+placeholders and choice labels are filled in here, once per row. The
+claimant's listing feed needs the image field for its thumbnails, so it
+stays model instances, deferred to the columns the cards use.
+"""
+from typing import NamedTuple
+
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from users import locations
+from .models import Claim, Listing, PickupAssignment
+
+FOOD_TYPE_LABELS = dict(Listing.FOOD_TYPES)
+PICKUP_STATUS_LABELS = dict(PickupAssignment.STATUS_CHOICES)
+PLACEHOLDER = '—'
+
+
+class DonorPickup(NamedTuple):
+    id: int
+    ftype: str
+    desc: str
+    qty: float
+    vname: str
+    ngo: str
+    assigntime: object
+    pstatus: str
+    otp_code: str
+    otp_verified: bool
+    otp_verified_at: object
+    loc: object
+
+
+class IncomingClaim(NamedTuple):
+    id: int
+    claimant: str
+    food: str
+    claimed_at: object
+
+
+class VolunteerRow(NamedTuple):
+    id: int
+    vid: str
+    name: str
+    initial: str
+    phone: str
+    email: str
+    addr: str
+    status: str
+    joined: object
+
+
+class PendingClaim(NamedTuple):
+    id: int
+    listing_id: int
+    desc: str
+
+
+class UnassignedClaim(NamedTuple):
+    id: int
+    desc: str
+    donor_name: str
+    qty: float
+
+
+class AssignedTask(NamedTuple):
+    id: int
+    desc: str
+    vname: str
+    assigntime: object
+    status_display: str
+    loc: object
+
+
+class ActiveAssignment(NamedTuple):
+    id: int
+    desc: str
+    ftype: str
+    ftype_display: str
+    qty: float
+    donor_name: str
+    assigntime: object
+    status: str
+    pickup_instructions: str
+    notes: str
+
+
+def _claimed_kg(prefix=''):
+    """A claim's share: its reservation, or the whole listing for claims made before partial claims."""
+    return Coalesce(f'{prefix}quantity_kg', f'{prefix}listing__quantity_kg')
+
+
+def _positions(rows, volunteer_at):
+    """``{assignment_id: Position}`` for rows of ``(id, ...)`` with the volunteer's id at ``volunteer_at``."""
+    positions = locations.latest_positions(row[volunteer_at] for row in rows)
+    return {row[0]: positions[row[volunteer_at]] for row in rows if row[volunteer_at] in positions}
+
+
+def donor_pickups(donor):
+    """The donor's pickups in progress, newest first, with OTPs and volunteer positions."""
+    rows = list(
+        PickupAssignment.objects.filter(claim__listing__donor=donor, status__in=['assigned', 'picked_up'])
+        .order_by('-assigned_at')
+        .values_list(
+            'id', 'claim__listing__food_type', 'claim__listing__description', _claimed_kg('claim__'),
+            'volunteer__name', 'claim__claimant__institution_name', 'claim__claimant__username',
+            'assigned_at', 'otp__code', 'otp__is_verified', 'otp__verified_at', 'volunteer_id', 'status',
+        )
+    )
+    positions = _positions(rows, volunteer_at=11)
+    return [
+        DonorPickup(
+            pk, ftype, desc, qty, vname, institution or username, assigned_at, status,
+            code or '', bool(verified), verified_at, positions.get(pk),
+        )
+        for (pk, ftype, desc, qty, vname, institution, username, assigned_at,
+             code, verified, verified_at, _, status) in rows
+    ]
+
+
+def incoming_claims(donor):
+    """Pending claims on the donor's listings, newest first."""
+    rows = (
+        Claim.objects.filter(listing__donor=donor, status='pending')
+        .order_by('-claimed_at')
+        .values_list('id', 'claimant__username', 'listing__food_type', 'claimed_at')
+    )
+    return [
+        IncomingClaim(pk, claimant, FOOD_TYPE_LABELS.get(food, food), claimed_at)
+        for pk, claimant, food, claimed_at in rows
+    ]
+
+
+def ngo_volunteers(ngo):
+    """The NGO's volunteers, newest first."""
+    from users.models import Volunteer
+    rows = (
+        Volunteer.objects.filter(ngo=ngo)
+        .order_by('-date_joined')
+        .values_list('id', 'volunteer_id', 'name', 'phone', 'email', 'address', 'status', 'date_joined')
+    )
+    return [
+        VolunteerRow(
+            pk, vid, name, name[:1].upper() if name else '?',
+            phone or PLACEHOLDER, email or PLACEHOLDER, address or PLACEHOLDER, status, joined,
+        )
+        for pk, vid, name, phone, email, address, status, joined in rows
+    ]
+
+
+def pending_claims(claimant):
+    """The NGO's claims waiting for the donor's approval, newest first."""
+    rows = (
+        Claim.objects.filter(claimant=claimant, status='pending')
+        .order_by('-claimed_at')
+        .values_list('id', 'listing_id', 'listing__description')
+    )
+    return [PendingClaim(*row) for row in rows]
+
+
+def assigned_tasks(claimant):
+    """Pickups of the NGO's approved claims, newest first, with volunteer positions while under way."""
+    rows = list(
+        PickupAssignment.objects.filter(claim__claimant=claimant, claim__status='approved')
+        .order_by('-assigned_at')
+        .values_list('id', 'claim__listing__description', 'volunteer__name', 'assigned_at', 'volunteer_id', 'status')
+    )
+    positions = _positions([row for row in rows if row[5] != 'delivered'], volunteer_at=4)
+    return [
+        AssignedTask(pk, desc, vname, assigned_at, PICKUP_STATUS_LABELS.get(status, status), positions.get(pk))
+        for pk, desc, vname, assigned_at, _, status in rows
+    ]
+
+
+def unassigned_claims(claimant):
+    """Approved claims no volunteer has been assigned to yet, newest first."""
+    rows = (
+        Claim.objects.filter(claimant=claimant, status='approved', pickup_assignments__isnull=True)
+        .order_by('-claimed_at')
+        .values_list('id', 'listing__description', 'listing__donor__institution_name',
+                     'listing__donor__username', _claimed_kg())
+    )
+    return [
+        UnassignedClaim(pk, desc, institution or username, qty)
+        for pk, desc, institution, username, qty in rows
+    ]
+
+
+def feed_listings():
+    """Active, unexpired listings for the claimant's feed and map, soonest expiry first."""
+    return (
+        Listing.objects.filter(status='active', expiry_time__gt=timezone.now())
+        .select_related('donor')
+        .only(
+            'id', 'food_type', 'quantity_kg', 'remaining_kg', 'description', 'expiry_time', 'image',
+            'donor__username', 'donor__institution_name', 'donor__latitude', 'donor__longitude',
+            'donor__trust_score',
+        )
+        .order_by('expiry_time')
+    )
+
+
+def active_assignments(volunteer):
+    """The volunteer's pickups in progress, newest first."""
+    rows = (
+        PickupAssignment.objects.filter(volunteer=volunteer, status__in=['assigned', 'picked_up'])
+        .order_by('-assigned_at')
+        .values_list(
+            'id', 'claim__listing__description', 'claim__listing__food_type', _claimed_kg('claim__'),
+            'claim__listing__donor__institution_name', 'claim__listing__donor__username',
+            'assigned_at', 'status', 'claim__listing__pickup_instructions', 'notes',
+        )
+    )
+    return [
+        ActiveAssignment(
+            pk, desc, ftype, FOOD_TYPE_LABELS.get(ftype, ftype), qty, institution or username,
+            assigned_at, status, instructions, notes,
+        )
+        for pk, desc, ftype, qty, institution, username, assigned_at, status, instructions, notes in rows
+    ]
@@ -0,0 +1,161 @@
+"""
+Partial claims: each claim reserves part of a listing.
+
+``reserve`` takes the NGO's share of ``remaining_kg`` (and a proportional
+share of ``remaining_servings``) with one conditional ``UPDATE`` that only
+matches an active, unexpired listing with enough left, so however many
+NGOs claim at once the reservations never add up to more than the
+listing holds. The claim row is inserted in the same transaction; the
+``claim_open_per_claimant`` constraint turns a second open claim by the
+same NGO into ``AlreadyClaimed`` and rolls its reservation back.
+
+A listing with nothing left becomes 'claimed', and its pending claims
+that hold no reservation (claims for the whole listing made before
+partial claims) are rejected in one ``UPDATE``. Rejecting a claim gives
+its share back and re-opens the listing. Approving a whole-listing claim
+reserves whatever is left for it. Claims are not approved once the
+listing is past its expiry time; ``listings.tasks.expire_overdue_listings``
+rejects those still pending.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import changes, pagination
+from .models import Claim, Listing
+
+# Float slack when comparing kilograms
+EPSILON = 1e-6
+
+
+class ClaimError(Exception):
+    pass
+
+
+class AlreadyClaimed(ClaimError):
+    """The NGO already has an open claim on this listing."""
+
+
+class NotEnoughLeft(ClaimError):
+    """The listing is gone, expired or has less than was asked for left."""
+
+    def __init__(self, remaining):
+        super().__init__(remaining)
+        self.remaining = remaining
+
+
+def _servings_for(listing, kg):
+    if not listing.quantity_kg:
+        return 0
+    return min(round(listing.servings * kg / listing.quantity_kg), listing.remaining_servings or 0)
+
+
+def _listing_changed(listing):
+    changes.record_listing_updates([(listing.pk, listing.donor_id)])
+    pagination.invalidate(listing.donor_id)
+
+
+def reserve(listing, claimant, quantity_kg=None):
+    """
+    Claim ``quantity_kg`` of ``listing`` (everything left if None) for
+    ``claimant``. Returns the pending ``Claim``.
+    """
+    kg = listing.remaining_kg if quantity_kg is None else quantity_kg
+    if not kg or kg <= 0:
+        raise NotEnoughLeft(listing.remaining_kg or 0)
+    servings = _servings_for(listing, kg)
+    takes_rest = Q(remaining_kg__lte=kg + EPSILON)
+    try:
+        with transaction.atomic():
+            reserved = Listing.objects.filter(
+                pk=listing.pk, status='active', expiry_time__gt=timezone.now(), remaining_kg__gte=kg - EPSILON,
+            ).update(
+                remaining_kg=Case(When(takes_rest, then=Value(0.0)), default=F('remaining_kg') - kg),
+                remaining_servings=Case(
+                    When(takes_rest, then=Value(0)), default=Greatest(F('remaining_servings') - servings, Value(0)),
+                ),
+                status=Case(When(takes_rest, then=Value('claimed')), default=F('status')),
+            )
+            if not reserved:
+                left = Listing.objects.filter(pk=listing.pk, status='active').values_list('remaining_kg', flat=True)
+                raise NotEnoughLeft(left.first() or 0)
+            claim = Claim.objects.create(listing=listing, claimant=claimant, quantity_kg=kg, servings=servings)
+            _listing_changed(listing)
+            if Listing.objects.filter(pk=listing.pk, status='claimed').exists():
+                reject_unreserved(listing)
+    except IntegrityError:
+        raise AlreadyClaimed(listing.pk)
+    return claim
+
+
+def reject_unreserved(listing):
+    """Reject the pending claims on ``listing`` that hold no reservation. Returns how many."""
+    pending = Claim.objects.filter(listing_id=listing.pk, status='pending', quantity_kg__isnull=True)
+    rows = list(pending.values_list('pk', 'claimant_id'))
+    if not rows:
+        return 0
+    Claim.objects.filter(pk__in=[pk for pk, _ in rows]).update(status='rejected')
+    changes.record_claim_updates([(pk, listing.donor_id, claimant_id) for pk, claimant_id in rows])
+    pagination.invalidate(listing.donor_id, *{claimant_id for _, claimant_id in rows})
+    return len(rows)
+
+
+def approve(claim):
+    """
+    Approve a pending claim. A whole-listing claim gets what is left, and
+    is rejected if nothing is; any claim on a listing past its expiry time
+    is rejected and gives its share back. Returns the claim's new status.
+    """
+    with transaction.atomic():
+        claim = Claim.objects.select_for_update().select_related('listing').get(pk=claim.pk)
+        if claim.status != 'pending':
+            return claim.status
+        listing = Listing.objects.select_for_update().get(pk=claim.listing_id)
+        if listing.expiry_time <= timezone.now():
+            claim.status = 'rejected'
+            claim.save()
+            if claim.quantity_kg is not None:
+                Listing.objects.filter(pk=listing.pk).update(
+                    remaining_kg=F('remaining_kg') + claim.quantity_kg,
+                    remaining_servings=F('remaining_servings') + (claim.servings or 0),
+                )
+                _listing_changed(listing)
+            return claim.status
+        took_rest = False
+        if claim.quantity_kg is None:
+            if listing.status != 'active' or not listing.remaining_kg or listing.remaining_kg <= EPSILON:
+                claim.status = 'rejected'
+                claim.save()
+                return claim.status
+            claim.quantity_kg, claim.servings = listing.remaining_kg, listing.remaining_servings
+            Listing.objects.filter(pk=listing.pk).update(remaining_kg=0, remaining_servings=0, status='claimed')
+            _listing_changed(listing)
+            took_rest = True
+        claim.status = 'approved'
+        claim.save()
+        if took_rest:
+            reject_unreserved(listing)
+    return claim.status
+
+
+def reject(claim):
+    """The donor turns down an open claim, which gives its share back. Returns False if it was not open."""
+    with transaction.atomic():
+        claim = Claim.objects.select_for_update().select_related('listing').get(pk=claim.pk)
+        if claim.status not in ('pending', 'approved'):
+            return False
+        claim.status = 'rejected'
+        claim.rejected_by_donor = True
+        claim.save()
+        if claim.quantity_kg is not None:
+            Listing.objects.filter(pk=claim.listing_id).update(
+                remaining_kg=F('remaining_kg') + claim.quantity_kg,
+                remaining_servings=F('remaining_servings') + (claim.servings or 0),
+                status=Case(
+                    When(status='claimed', expiry_time__gt=timezone.now(), then=Value('active')),
+                    default=F('status'),
+                ),
+            )
+            _listing_changed(claim.listing)
+    return True
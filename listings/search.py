@@ -0,0 +1,225 @@
+"""
+Full-text search over listings.
+
+On SQLite the index lives in an FTS5 virtual table (``listings_listing_fts``)
+whose rowid is the listing id. It holds open listings only (active or
+claimed): completed and expired ones can never be found again, so they are
+dropped and the index stays the size of what is on offer, however long the
+history. It is kept in sync by the receivers in ``listings.signals`` and
+the expiry job, and can be rebuilt with ``manage.py rebuild_search_index``.
+Other database backends fall back to a plain ``icontains`` scan.
+
+``manage.py benchmark_search`` times searches over a seeded throwaway
+database.
+"""
+import math
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Listing
+
+FTS_TABLE = 'listings_listing_fts'
+
+# Ranking weights. bm25() returns "more negative is better", so relevance is
+# its negation; urgency rewards listings about to expire and distance
+# penalises far-away donors.
+URGENCY_WEIGHT = 2.0
+DISTANCE_WEIGHT = 0.05
+
+# FTS candidates fetched per requested result before re-ranking in Python.
+CANDIDATE_FACTOR = 5
+
+# What the search endpoint shows of each result
+RESULT_FIELDS = (
+    'id', 'food_type', 'description', 'quantity_kg', 'remaining_kg', 'expiry_time',
+    'donor__username', 'donor__institution_name', 'donor__latitude', 'donor__longitude',
+)
+
+# Listings in these states are never searchable again
+CLOSED_STATUSES = ('completed', 'expired')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_available(conn=None):
+    return (conn or connection).vendor == 'sqlite'
+
+
+def create_index(conn=None):
+    """Create the FTS5 table if it does not exist yet."""
+    conn = conn or connection
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "description, pickup_instructions, institution_name, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+
+def drop_index(conn=None):
+    conn = conn or connection
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def rebuild_index(conn=None):
+    """Re-populate the whole index from the listings table. Returns row count."""
+    conn = conn or connection
+    if not fts_available(conn):
+        return 0
+    create_index(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, description, pickup_instructions, institution_name) "
+            "SELECT l.id, l.description, l.pickup_instructions, COALESCE(u.institution_name, '') "
+            "FROM listings_listing l JOIN users_user u ON u.id = l.donor_id "
+            f"WHERE l.status NOT IN ({', '.join(['%s'] * len(CLOSED_STATUSES))})",
+            CLOSED_STATUSES,
+        )
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def index_listing(listing):
+    """Insert or replace the index row for a single listing, or drop it once the listing is closed."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [listing.pk])
+        if listing.status in CLOSED_STATUSES:
+            return
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, description, pickup_instructions, institution_name) "
+            "VALUES (%s, %s, %s, %s)",
+            [
+                listing.pk,
+                listing.description,
+                listing.pickup_instructions,
+                listing.donor.institution_name or '',
+            ],
+        )
+
+
+def unindex_listing(listing_id):
+    unindex_listings([listing_id])
+
+
+def unindex_listings(listing_ids):
+    """Drop listings closed by a bulk update (no post_save) from the index."""
+    if not fts_available() or not listing_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [[pk] for pk in listing_ids])
+
+
+def reindex_donor(donor):
+    """Propagate a donor's institution_name change to all of their listings."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FTS_TABLE} SET institution_name = %s "
+            "WHERE rowid IN (SELECT id FROM listings_listing WHERE donor_id = %s)",
+            [donor.institution_name or '', donor.pk],
+        )
+
+
+def build_match_query(text):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+
+    Every word is quoted (so FTS operators in user input are inert) and the
+    last one gets a prefix wildcard for type-ahead. Returns '' if there is
+    nothing searchable.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return ''
+    terms = [f'"{t}"' for t in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 12742 * math.asin(math.sqrt(a))
+
+
+def _score(relevance, hours_left, donor_lat, donor_lng, lat, lng):
+    score = relevance + URGENCY_WEIGHT / (1 + max(hours_left, 0))
+    distance = None
+    if lat is not None and lng is not None and donor_lat and donor_lng:
+        distance = haversine_km(lat, lng, donor_lat, donor_lng)
+        score -= DISTANCE_WEIGHT * distance
+    return score, distance
+
+
+def _fts_candidates(match, now, limit):
+    """``(id, relevance, hours left, donor lat, donor lng)`` of the best text matches."""
+    now = connection.ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        # Rank in the inner query; the outer one only reads the columns for the rows kept
+        cursor.execute(
+            "SELECT c.id, c.relevance, (julianday(l.expiry_time) - julianday(%s)) * 24, u.latitude, u.longitude "
+            f"FROM (SELECT f.rowid AS id, -bm25({FTS_TABLE}) AS relevance FROM {FTS_TABLE} f "
+            "      JOIN listings_listing l ON l.id = f.rowid "
+            f"      WHERE {FTS_TABLE} MATCH %s AND l.status = 'active' AND l.expiry_time > %s "
+            "      ORDER BY relevance DESC LIMIT %s) c "
+            "JOIN listings_listing l ON l.id = c.id JOIN users_user u ON u.id = l.donor_id",
+            [now, match, now, limit],
+        )
+        return cursor.fetchall()
+
+
+def _fallback_candidates(text, now, limit):
+    q = Q()
+    for token in _TOKEN_RE.findall(text):
+        q &= (Q(description__icontains=token)
+              | Q(pickup_instructions__icontains=token)
+              | Q(donor__institution_name__icontains=token))
+    rows = Listing.objects.filter(q, status='active', expiry_time__gt=now).values_list(
+        'id', 'expiry_time', 'donor__latitude', 'donor__longitude',
+    )[:limit]
+    return [
+        (listing_id, 0.0, (expiry_time - now).total_seconds() / 3600, donor_lat, donor_lng)
+        for listing_id, expiry_time, donor_lat, donor_lng in rows
+    ]
+
+
+def search_listings(text, lat=None, lng=None, limit=20):
+    """
+    Search active listings and rank them by text relevance, expiry urgency
+    and (when a position is given) distance to the donor.
+
+    Candidates are scored from the columns the ranking needs; only the best
+    ``limit`` are loaded. Returns a list of ``(listing, score, distance_km)``
+    tuples, best first.
+    """
+    now = timezone.now()
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    candidate_limit = limit * CANDIDATE_FACTOR
+    if fts_available():
+        candidates = _fts_candidates(match, now, candidate_limit)
+    else:
+        candidates = _fallback_candidates(text, now, candidate_limit)
+
+    scored = sorted(
+        ((listing_id, *_score(relevance, hours_left, donor_lat, donor_lng, lat, lng))
+         for listing_id, relevance, hours_left, donor_lat, donor_lng in candidates),
+        key=lambda row: row[1], reverse=True,
+    )[:limit]
+    by_id = Listing.objects.select_related('donor').only(*RESULT_FIELDS).in_bulk([listing_id for listing_id, _, _ in scored])
+    return [(by_id[listing_id], score, distance) for listing_id, score, distance in scored if listing_id in by_id]
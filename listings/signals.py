@@ -1,7 +1,10 @@
 import secrets
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import PickupAssignment, PickupOTP
+from jobs.queue import enqueue
+from .models import Listing, Claim, PickupAssignment, PickupOTP
+from . import changes, images, pagination, search
 
 
 @receiver(post_save, sender=PickupAssignment)
@@ -10,3 +13,87 @@ def create_pickup_otp(sender, instance, created, **kwargs):
     if created:
         code = f"{secrets.randbelow(1000000):06d}"
         PickupOTP.objects.create(assignment=instance, code=code)
+
+
+@receiver(post_save, sender=Listing)
+def index_listing(sender, instance, raw=False, **kwargs):
+    """Keep the full-text search index in sync with listing content."""
+    if not raw:
+        search.index_listing(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def unindex_listing(sender, instance, **kwargs):
+    search.unindex_listing(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_donor_listings(sender, instance, created, raw=False, **kwargs):
+    """A donor's institution name is searchable, so push renames into the index."""
+    if not created and not raw and instance.role == 'donor':
+        search.reindex_donor(instance)
+
+
+@receiver(post_save, sender=Listing)
+def process_listing_image(sender, instance, raw=False, **kwargs):
+    """Hand new uploads to the image pipeline (thumbnails, EXIF stripping)."""
+    if not raw:
+        images.schedule(instance.image)
+
+
+@receiver(post_save, sender=Claim)
+def process_claim_photos(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance.claimant_photo)
+        images.schedule(instance.donor_photo)
+        if ((instance.claimant_photo and instance.claimant_photo_hash is None)
+                or (instance.donor_photo and instance.donor_photo_hash is None)):
+            enqueue('listings.tasks.hash_claim_photos', [instance.pk], priority=5,
+                    unique_key=f'claim-photo-hashes:{instance.pk}')
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_stats(sender, instance, **kwargs):
+    pagination.invalidate(instance.donor_id)
+
+
+@receiver(post_save, sender=Claim)
+@receiver(post_delete, sender=Claim)
+def invalidate_claim_stats(sender, instance, **kwargs):
+    if pagination.in_bulk():
+        pagination.invalidate(instance.claimant_id)
+        return
+    donor_id = Listing.objects.filter(pk=instance.listing_id).values_list('donor_id', flat=True).first()
+    pagination.invalidate(instance.claimant_id, donor_id)
+
+
+@receiver(post_save, sender=PickupAssignment)
+@receiver(post_delete, sender=PickupAssignment)
+def invalidate_pickup_stats(sender, instance, **kwargs):
+    from users import locations
+    from users.models import Volunteer
+
+    if pagination.in_bulk():
+        return
+    volunteer_user_id = Volunteer.objects.filter(pk=instance.volunteer_id).values_list('user_id', flat=True).first()
+    pagination.invalidate(volunteer_user_id)
+    locations.forget(volunteer_user_id)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_save, sender=Claim)
+@receiver(post_save, sender=PickupAssignment)
+def log_change_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw or pagination.in_bulk():
+        return
+    changes.record(instance, 'insert' if created else 'update')
+
+
+@receiver(post_delete, sender=Listing)
+@receiver(post_delete, sender=Claim)
+@receiver(post_delete, sender=PickupAssignment)
+def log_change_on_delete(sender, instance, **kwargs):
+    if pagination.in_bulk():
+        return  # bulk jobs write their own entries (see listings.archive)
+    changes.record(instance, 'delete')
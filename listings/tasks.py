@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.queue import periodic, task
+from users import trust
+
+from . import archive, changes, images, photo_hashes, search
+from .models import Claim, Listing
+from .pagination import invalidate
+
+
+@task
+def render_image_variants(name):
+    """Resize a stored upload into its WebP variants (queued by ``images.schedule``)."""
+    images.process_image(name)
+
+
+@task
+def hash_claim_photos(claim_id):
+    """Hash a claim's new photos and flag re-used ones (see ``listings.photo_hashes``)."""
+    photo_hashes.hash_claim_photos(claim_id)
+
+
+@periodic(60, priority=5)
+def expire_overdue_listings():
+    """
+    Close overdue active listings, and overdue claimed ones still holding
+    pending claims (a pending share can reserve all that was left). Their
+    pending claims are rejected and give their share back; nobody is
+    charged for those. A listing nobody
+    holds a share of expires and its donor's trust score is charged; one
+    that was partly claimed is closed as 'claimed' ('completed' if every
+    share was already delivered) and its approved claims carry on.
+    """
+    now = timezone.now()
+    overdue = dict(
+        Listing.objects.filter(expiry_time__lte=now)
+        .filter(Q(status='active') | Q(status='claimed', claims__status='pending'))
+        .distinct()
+        .values_list('pk', 'donor_id')
+    )
+    if not overdue:
+        return
+    touched = set(overdue.values())
+
+    rejected = []
+    for pk, listing_id, claimant_id, kg, servings in Claim.objects.filter(
+        listing_id__in=overdue, status='pending',
+    ).values_list('pk', 'listing_id', 'claimant_id', 'quantity_kg', 'servings'):
+        # One conditional UPDATE per claim, so an overlapping run or a donor
+        # approving it at the same moment never hands a share back twice
+        if not Claim.objects.filter(pk=pk, status='pending').update(status='rejected'):
+            continue
+        if kg is not None:
+            Listing.objects.filter(pk=listing_id).update(
+                remaining_kg=F('remaining_kg') + kg, remaining_servings=F('remaining_servings') + (servings or 0),
+            )
+        rejected.append((pk, overdue[listing_id], claimant_id))
+        touched.add(claimant_id)
+    changes.record_claim_updates(rejected)
+
+    shares = defaultdict(set)
+    for listing_id, status in Claim.objects.filter(
+        listing_id__in=overdue, status__in=['approved', 'completed'],
+    ).values_list('listing_id', 'status'):
+        shares[listing_id].add(status)
+    still_open = Listing.objects.filter(status__in=['active', 'claimed'])
+    for status, ids in (
+        ('claimed', [pk for pk, statuses in shares.items() if 'approved' in statuses]),
+        ('completed', [pk for pk, statuses in shares.items() if 'approved' not in statuses]),
+    ):
+        if ids:
+            still_open.filter(pk__in=ids).update(status=status)
+
+    expired_per_donor = {}
+    for donor_id in set(overdue.values()):
+        ids = [pk for pk, donor in overdue.items() if donor == donor_id and pk not in shares]
+        # The UPDATE's row count is what this run actually expired, so two
+        # overlapping runs never charge the same listing twice.
+        count = still_open.filter(pk__in=ids).update(status='expired') if ids else 0
+        if count:
+            expired_per_donor[donor_id] = count
+    trust.record_expiries(expired_per_donor)
+    invalidate(*touched)
+    changes.record_listing_updates(list(overdue.items()))
+    # 'claimed' listings stay searchable until their last share is delivered
+    search.unindex_listings([pk for pk in overdue if 'approved' not in shares.get(pk, ())])
+
+
+@periodic(60 * 60)
+def purge_spent_otps():
+    """Blank verified OTP codes and delete expired unverified OTPs (see ``listings.archive``)."""
+    archive.purge_spent_otps()
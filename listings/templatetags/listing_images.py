@@ -0,0 +1,11 @@
+from django import template
+
+from listings.images import variant_url
+
+register = template.Library()
+
+
+@register.filter
+def image_variant(fieldfile, variant='thumb'):
+    """``{{ listing.image|image_variant:'thumb' }}`` → URL of the processed variant."""
+    return variant_url(fieldfile, variant)
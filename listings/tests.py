@@ -1,3 +1,907 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics import heatmap
+from analytics.models import SurplusCell
+from jobs.models import Job
+from jobs.worker import Worker
+from users import impact, trust
+from users.models import ImpactStats, User, Volunteer
+
+from . import archive, changes, images, pagination, photo_hashes, read_models, reservations, search
+from .tasks import expire_overdue_listings
+from .models import (
+    ArchivedClaim, ArchivedListing, ArchivedPickupAssignment, ChangeLogEntry, Claim, Listing, PickupAssignment,
+    PickupOTP,
+)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create_user(
+            'donor', password='pw', role='donor', institution_name='Annapurna Kitchen', latitude=12.97, longitude=77.59,
+        )
+        self.far_donor = User.objects.create_user('far', password='pw', role='donor', latitude=13.5, longitude=78.2)
+
+    def listing(self, description, hours=24, donor=None, **fields):
+        return Listing.objects.create(
+            donor=donor or self.donor, food_type='cooked', quantity_kg=5, description=description,
+            expiry_time=timezone.now() + timedelta(hours=hours), **fields,
+        )
+
+    def found(self, text, **kwargs):
+        return [listing.pk for listing, _, _ in search.search_listings(text, **kwargs)]
+
+    def indexed(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {search.FTS_TABLE} ORDER BY rowid")
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_ranking_weighs_urgency_and_distance(self):
+        later = self.listing('Vegetable biryani', hours=48)
+        sooner = self.listing('Vegetable biryani', hours=1)
+        self.assertEqual(self.found('biryani'), [sooner.pk, later.pk])
+
+        far = self.listing('Paneer curry', donor=self.far_donor)
+        near = self.listing('Paneer curry')
+        self.assertEqual(self.found('paneer', lat=12.97, lng=77.59), [near.pk, far.pk])
+        self.assertEqual(len(self.found('pan')), 2)  # the last word is a prefix
+
+    def test_fts_syntax_in_queries_is_inert(self):
+        rice = self.listing('Rice')
+        self.listing('Dal')
+        self.assertEqual(self.found('rice'), [rice.pk])
+        self.assertEqual(search.build_match_query('rice" OR NOT dal*'), '"rice" "OR" "NOT" "dal"*')
+        for text in ('rice" OR NOT dal*', 'description:rice', 'NEAR(rice dal)', '-rice ^dal', '"', '*', '(('):
+            search.search_listings(text)  # no fts5 syntax error
+        self.assertEqual(self.found('rice OR dal'), [])  # "or" is a word to find, not an operator
+        self.assertEqual(self.found('*'), [])
+
+    def test_donor_rename_reaches_the_index(self):
+        listing = self.listing('Chapati')
+        self.assertEqual(self.found('annapurna'), [listing.pk])
+        self.donor.institution_name = 'Sunrise Hotel'
+        self.donor.save()
+        self.assertEqual(self.found('sunrise'), [listing.pk])
+        self.assertEqual(self.found('annapurna'), [])
+
+    def test_closed_listings_leave_the_index(self):
+        completed = self.listing('Sandwiches')
+        overdue = self.listing('Sandwiches', hours=1)
+        open_listing = self.listing('Sandwiches')
+        completed.status = 'completed'
+        completed.save()
+        Listing.objects.filter(pk=overdue.pk).update(expiry_time=timezone.now() - timedelta(minutes=1))
+        expire_overdue_listings()
+        self.assertEqual(self.indexed(), [open_listing.pk])
+        self.assertEqual(search.rebuild_index(), 1)
+
+    def test_endpoint(self):
+        listing = self.listing('Dosa batter')
+        response = self.client.get(reverse('listing_search'), {'q': 'dosa', 'lat': '12.97', 'lng': '77.59'})
+        [row] = response.json()['listings']
+        self.assertEqual((row['id'], row['donor_name'], row['distance_km']), (listing.pk, 'Annapurna Kitchen', 0.0))
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = images.ContentAddressedStorage(location=location)
+
+    def jpeg(self, exif=None, xmp=None):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        extra = {'exif': exif.tobytes()} if exif is not None else {}
+        if xmp:
+            extra['xmp'] = xmp
+        Image.new('RGB', (40, 30), (200, 10, 10)).save(buffer, 'JPEG', **extra)
+        return buffer.getvalue()
+
+    def test_metadata_is_gone_before_the_original_is_stored(self):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90°
+        exif[0x8825] = {1: 'N', 2: (12.0, 58.0, 1.0)}  # GPS
+        data = self.jpeg(exif, xmp=b'<x:xmpmeta>donor home</x:xmpmeta>')
+        name = self.storage.save('listings/a.jpg', SimpleUploadedFile('a.jpg', data))
+        with Image.open(self.storage.path(name)) as stored:
+            self.assertEqual(dict(stored.getexif()), {0x0112: 6})  # orientation only
+            self.assertNotIn('xmp', stored.info)
+            self.assertEqual(stored.tobytes(), Image.open(io.BytesIO(data)).tobytes())  # pixels untouched
+        with self.storage.open(name) as stored:
+            stripped = stored.read()
+        self.assertNotIn(b'donor home', stripped)
+        # SOI, then the JFIF APP0, then the orientation in an EXIF APP1
+        app1 = 4 + int.from_bytes(stripped[4:6], 'big')
+        self.assertEqual((stripped[:4], stripped[6:11]), (b'\xff\xd8\xff\xe0', b'JFIF\x00'))
+        self.assertEqual((stripped[app1:app1 + 2], stripped[app1 + 4:app1 + 10]), (b'\xff\xe1', b'Exif\x00\x00'))
+        # The same photo uploaded again is still one file
+        self.assertEqual(self.storage.save('listings/b.jpg', SimpleUploadedFile('b.jpg', data)), name)
+        images.process_image(name, self.storage)
+        with Image.open(self.storage.path(images.variant_name(name, 'thumb'))) as thumb:
+            self.assertEqual(thumb.size, (30, 40))  # upright
+
+    def test_other_formats_are_re_encoded_upright(self):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {1: 'N', 2: (12.0, 58.0, 1.0)}
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30)).save(buffer, 'PNG', exif=exif.tobytes())
+        name = self.storage.save('listings/a.png', SimpleUploadedFile('a.png', buffer.getvalue()))
+        with Image.open(self.storage.path(name)) as stored:
+            self.assertEqual(stored.size, (30, 40))
+            self.assertFalse(stored.getexif())
+
+    def test_plain_images_are_stored_as_uploaded_and_variants_rendered_later(self):
+        data = self.jpeg()
+        name = self.storage.save('listings/a.jpg', SimpleUploadedFile('a.jpg', data))
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertFalse(self.storage.exists(images.variant_name(name, 'thumb')))
+        images.process_image(name, self.storage)
+        for variant in images.VARIANTS:
+            self.assertTrue(self.storage.exists(images.variant_name(name, variant)))
+
+    def test_uploads_are_resized_and_hashed_by_queued_jobs(self):
+        donor = User.objects.create(username='donor', role='donor')
+        ngo = User.objects.create(username='ngo', role='claimant')
+        index_path = os.path.join(self.storage.location, 'photo_hashes.bin')
+        with override_settings(MEDIA_ROOT=self.storage.location, PHOTO_HASH_INDEX_PATH=index_path):
+            self.addCleanup(setattr, photo_hashes, '_index', None)
+            photo_hashes._index = None
+            listing = Listing.objects.create(
+                donor=donor, food_type='cooked', quantity_kg=5, description='Rice',
+                expiry_time=timezone.now() + timedelta(hours=6), image=SimpleUploadedFile('a.jpg', self.jpeg()),
+            )
+            listing.save()  # saved again before the job ran: still one job
+            claim = Claim.objects.create(listing=listing, claimant=ngo, donor_photo=SimpleUploadedFile('b.jpg', self.jpeg()))
+            self.assertEqual(
+                sorted(Job.objects.values_list('name', 'unique_key')),
+                [('listings.tasks.hash_claim_photos', f'claim-photo-hashes:{claim.pk}'),
+                 ('listings.tasks.render_image_variants', f'image-variants:{claim.donor_photo.name}'),
+                 ('listings.tasks.render_image_variants', f'image-variants:{listing.image.name}')],
+            )
+            self.assertEqual(images.variant_url(listing.image, 'thumb'), listing.image.url)
+
+            worker = Worker()
+            worker.process(worker.claim(), threading.Event())
+            self.assertEqual((worker.processed, worker.failed), (3, 0))
+            self.assertTrue(images.variant_url(listing.image, 'thumb').endswith('.thumb.webp'))
+            claim.refresh_from_db()
+            self.assertIsNotNone(claim.donor_photo_hash)
+
+
+class PhotoHashTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'photo_hashes.bin')
+        overridden = override_settings(MEDIA_ROOT=directory, PHOTO_HASH_INDEX_PATH=self.path)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        photo_hashes._index = None
+        self.addCleanup(setattr, photo_hashes, '_index', None)
+        donor = User.objects.create(username='donor', role='donor')
+        self.listing = Listing.objects.create(
+            donor=donor, food_type='cooked', quantity_kg=10, description='Rice',
+            expiry_time=timezone.now() + timedelta(hours=6),
+        )
+
+    @staticmethod
+    def flip(value, bits_per_chunk):
+        """``value`` with the lowest ``n`` bits of each 16-bit chunk flipped, n from ``bits_per_chunk``."""
+        for chunk, bits in enumerate(bits_per_chunk):
+            for bit in range(bits):
+                value ^= 1 << (chunk * 16 + bit)
+        return value
+
+    def test_search_matches_a_brute_force_scan(self):
+        rng = random.Random(7)
+        table, values = photo_hashes.MultiIndexHashTable(), []
+        queries = [rng.getrandbits(64) for _ in range(20)]
+        for n, query in enumerate(queries):
+            # Neighbours at every distance up to 13 bits, spread as evenly as
+            # possible over the chunks: the closest chunk differs by exactly
+            # d // 4 bits, the most the pigeonhole bound lets the search probe
+            for distance in range(14):
+                values.append(self.flip(query, [distance // 4 + (i < distance % 4) for i in range(4)]))
+        values += [rng.getrandbits(64) for _ in range(2000)]
+        for ref, value in enumerate(values):
+            table.add(value, ref)
+
+        for max_distance in range(13):
+            for query in queries:
+                expected = {
+                    (ref, (value ^ query).bit_count()) for ref, value in enumerate(values)
+                    if (value ^ query).bit_count() <= max_distance
+                }
+                self.assertEqual(set(table.search(query, max_distance)), expected)
+                self.assertGreaterEqual(len(expected), max_distance + 1)
+
+    def test_processes_read_each_others_records_incrementally(self):
+        writer, reader = photo_hashes.PhotoHashIndex(self.path), photo_hashes.PhotoHashIndex(self.path)
+        self.assertEqual(reader.search(1, 0), [])
+        writer.add(0xFF, 1, 'claimant_photo')
+        self.assertEqual(reader.search(0xFF, 0), [((1, 'claimant_photo'), 0)])
+        reader.add(0xFF0, 2, 'donor_photo')
+        with open(self.path, 'ab') as fh:
+            fh.write(b'torn')  # half a record from a write in progress
+        self.assertEqual(writer.search(0xFF1, 1), [((2, 'donor_photo'), 1)])
+        self.assertEqual(len(writer.table), 2)
+        self.assertEqual(writer._offset, 2 * photo_hashes._RECORD.size)  # the torn tail waits for the rest
+
+        writer.rewrite([(0xFF0, 3, 'claimant_photo')])
+        self.assertEqual(reader.search(0xFF0, 0), [((3, 'claimant_photo'), 0)])  # a new file is reloaded in full
+
+    def photo(self, size=(64, 48), quality=90, mirrored=False):
+        from PIL import Image, ImageDraw, ImageOps
+
+        image = Image.new('RGB', (64, 48), (240, 230, 200))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((8, 8, 30, 40), fill=(120, 40, 20))
+        draw.ellipse((36, 10, 58, 32), fill=(20, 90, 160))
+        if mirrored:
+            image = ImageOps.mirror(image)
+        buffer = io.BytesIO()
+        image.resize(size).save(buffer, 'JPEG', quality=quality)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue())
+
+    def claim(self, photo):
+        ngo = User.objects.create(username=f'ngo{Claim.objects.count()}', role='claimant')
+        return Claim.objects.create(listing=self.listing, claimant=ngo, claimant_photo=photo)
+
+    def test_a_reused_photo_flags_the_later_claim(self):
+        first = self.claim(self.photo())
+        photo_hashes.hash_claim_photos(first.pk)
+        # The same scene, shot smaller and compressed harder
+        again = self.claim(self.photo(size=(56, 42), quality=40))
+        with self.assertLogs('listings.photo_hashes', 'WARNING'):
+            photo_hashes.hash_claim_photos(again.pk)
+        other = self.claim(self.photo(mirrored=True))
+        photo_hashes.hash_claim_photos(other.pk)
+
+        flagged = dict(Claim.objects.values_list('pk', 'photo_flagged'))
+        self.assertEqual(flagged, {first.pk: False, again.pk: True, other.pk: False})
+        self.assertNotIn(None, Claim.objects.values_list('claimant_photo_hash', flat=True))
+
+    def test_rebuild_hashes_photos_that_have_none(self):
+        hashed = self.claim(self.photo())
+        photo_hashes.hash_claim_photos(hashed.pk)
+        missing = self.claim(self.photo(quality=50))
+        self.claim(None)
+
+        with self.assertLogs('listings.photo_hashes', 'WARNING'):
+            self.assertEqual(photo_hashes.rebuild_index(), (2, 1))
+        missing.refresh_from_db()
+        self.assertIsNotNone(missing.claimant_photo_hash)
+        self.assertEqual(dict(Claim.objects.filter(pk__in=[hashed.pk, missing.pk]).values_list('pk', 'photo_flagged')),
+                         {hashed.pk: False, missing.pk: True})
+        self.assertEqual(len(photo_hashes.get_index().search(photo_hashes.to_unsigned(missing.claimant_photo_hash), 0)), 1)
+
+
+# The suite never runs collectstatic, so there is no manifest to look up the admin's {% static %} names in
+SOURCE_STATIC_FILES = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+
+@override_settings(STORAGES=SOURCE_STATIC_FILES)
+class AdminChangelistQueryTests(TestCase):
+    """Each changelist runs a fixed number of queries however many rows it shows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            n = self.rows
+            donor = User.objects.create(username=f'donor{n}', role='donor')
+            ngo = User.objects.create(username=f'ngo{n}', role='claimant')
+            volunteer = Volunteer.objects.create(ngo=ngo, name=f'Volunteer {n}')
+            listing = Listing.objects.create(
+                donor=donor, food_type='cooked', quantity_kg=5, description='Rice',
+                expiry_time=timezone.now() + timedelta(hours=6), status='claimed',
+            )
+            claim = Claim.objects.create(listing=listing, claimant=ngo, status='approved')
+            PickupAssignment.objects.create(claim=claim, volunteer=volunteer)
+
+    def queries(self, model, **params):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, model, expected, **params):
+        self.add_rows(2)
+        self.assertEqual(self.queries(model, **params), expected)
+        self.add_rows(10)
+        self.assertEqual(self.queries(model, **params), expected)
+
+    def test_listing_changelist(self):
+        self.assert_constant_queries(Listing, 5)
+
+    def test_listing_changelist_filtered_by_donor(self):
+        self.add_rows(1)
+        donor = Listing.objects.get().donor
+        self.assert_constant_queries(Listing, 5, donor__id__exact=donor.pk)
+
+    def test_claim_changelist(self):
+        self.assert_constant_queries(Claim, 5)
+
+    def test_pickup_assignment_changelist(self):
+        self.assert_constant_queries(PickupAssignment, 5)
+
+    def test_pickup_otp_changelist(self):
+        self.assert_constant_queries(PickupOTP, 5)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create(username='donor', role='donor')
+        self.ngo = User.objects.create(username='ngo', role='claimant')
+        self.other = User.objects.create(username='other', role='claimant')
+
+    def listing(self):
+        return Listing.objects.create(
+            donor=self.donor, food_type='cooked', quantity_kg=5, description='Rice',
+            expiry_time=timezone.now() + timedelta(hours=6),
+        )
+
+    def test_changes_fold_into_current_rows_and_tombstones(self):
+        kept = self.listing()
+        kept.status = 'completed'
+        kept.save()
+        gone = self.listing()
+        gone_id = gone.pk
+        gone.delete()
+        before = changes.current_seq()
+        edited = Listing.objects.get(pk=kept.pk)
+        edited.quantity_kg = 7
+        edited.save()
+
+        result = changes.feed(self.ngo, 0)
+        self.assertEqual((result['seq'], result['more']), (before + 1, False))
+        self.assertEqual(result['listing']['upserted']['id'], [kept.pk])
+        self.assertEqual(result['listing']['upserted']['status'], ['completed'])
+        self.assertEqual(result['listing']['upserted']['quantity_kg'], [7])
+        self.assertEqual(result['listing']['inserted'], [kept.pk])
+        self.assertEqual(result['listing']['deleted'], [gone_id])
+
+        later = changes.feed(self.ngo, before)
+        self.assertEqual((later['listing']['inserted'], later['listing']['deleted']), ([], []))
+        self.assertEqual(later['listing']['upserted']['id'], [kept.pk])
+
+    def test_claims_reach_only_their_parties(self):
+        claim = Claim.objects.create(listing=self.listing(), claimant=self.ngo, quantity_kg=2)
+        for user in (self.donor, self.ngo):
+            self.assertEqual(changes.feed(user, 0)['claim']['upserted']['id'], [claim.pk])
+        outsider = changes.feed(self.other, 0)
+        self.assertNotIn('claim', outsider)
+        self.assertIn('listing', outsider)  # listings are public
+        self.assertEqual(outsider['seq'], changes.current_seq())  # still moves past what it may not see
+
+    def test_polls_stop_at_young_gaps_and_skip_old_ones(self):
+        first, missing, last = (self.listing() for _ in range(3))
+        gap = ChangeLogEntry.objects.get(model='listing', object_id=missing.pk).seq
+        ChangeLogEntry.objects.filter(seq=gap).delete()  # as if its transaction had not committed yet
+
+        result = changes.feed(self.ngo, 0)
+        self.assertEqual(result['seq'], gap - 1)
+        self.assertEqual(result['listing']['upserted']['id'], [first.pk])
+        self.assertFalse(result['more'])  # nothing to gain from polling again at once
+
+        # Long past the grace period: a rolled-back transaction, not a late commit
+        ChangeLogEntry.objects.filter(seq__gt=gap).update(
+            created_at=timezone.now() - timedelta(seconds=changes.GAP_GRACE_SECONDS + 1)
+        )
+        result = changes.feed(self.ngo, gap - 1)
+        self.assertEqual(result['seq'], changes.current_seq())
+        self.assertEqual(result['listing']['upserted']['id'], [last.pk])
+
+    def test_full_pages_ask_for_another_poll(self):
+        for _ in range(3):
+            self.listing()
+        result = changes.feed(self.ngo, 0, limit=2)
+        self.assertTrue(result['more'])
+        self.assertFalse(changes.feed(self.ngo, result['seq'], limit=2)['more'])
+
+    def test_clients_behind_the_trimmed_log_must_reload(self):
+        for _ in range(3):
+            self.listing()
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(changes.trim(days=7), 2)  # the newest entry stays
+        self.client.force_login(self.ngo)
+        url = reverse('listing_changes')
+
+        response = self.client.get(url, {'since': 0})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['seq'], changes.current_seq())
+        self.assertEqual(self.client.get(url, {'since': changes.current_seq()}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'since': 'x'}).status_code, 400)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create(username='donor', role='donor')
+        self.ngo = User.objects.create(username='ngo', role='claimant')
+        self.start = timezone.now() - timedelta(days=1)
+
+    def listings(self, count, minutes=lambda n: n):
+        """``count`` active listings, created ``minutes(n)`` minutes after ``self.start``."""
+        created = []
+        for n in range(count):
+            listing = Listing.objects.create(
+                donor=self.donor, food_type='cooked', quantity_kg=10, description=f'Meal {n}',
+                expiry_time=timezone.now() + timedelta(hours=6),
+            )
+            Listing.objects.filter(pk=listing.pk).update(created_at=self.start + timedelta(minutes=minutes(n)))
+            created.append(listing.pk)
+        return created
+
+    def walk(self, queryset, per_page, between_pages=lambda: None):
+        pages, cursor = [], None
+        while True:
+            page = pagination.keyset_page(queryset, cursor, per_page=per_page)
+            pages.append([listing.pk for listing in page])
+            if not page.has_more:
+                return pages
+            cursor = page.next_cursor
+            between_pages()
+
+    def test_pages_stay_put_when_rows_are_inserted_between_requests(self):
+        older = self.listings(25)
+        inserted = []
+
+        def someone_posts():
+            listing = Listing.objects.create(
+                donor=self.donor, food_type='cooked', quantity_kg=1, description='New',
+                expiry_time=timezone.now() + timedelta(hours=6),
+            )
+            inserted.append(listing.pk)
+
+        pages = self.walk(Listing.objects.filter(donor=self.donor), 10, someone_posts)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), older[::-1])  # each once, none skipped, none of the new ones
+        self.assertEqual(len(inserted), 2)
+
+    def test_ties_on_the_ordering_field_are_broken_by_id(self):
+        # Created in threes in the same instant, each three a minute before the last;
+        # pages of two cut through every tie
+        t = self.listings(7, minutes=lambda n: -(n // 3))
+        pages = self.walk(Listing.objects.filter(donor=self.donor), 2)
+        self.assertEqual(pages, [[t[2], t[1]], [t[0], t[5]], [t[4], t[3]], [t[6]]])
+
+    def test_a_malformed_or_tampered_cursor_is_a_400(self):
+        self.listings(3)
+        self.client.force_login(self.donor)
+        url = reverse('donor_listings_more')
+        first = pagination.keyset_page(Listing.objects.filter(donor=self.donor), per_page=1).next_cursor
+        self.assertEqual(self.client.get(url, {'cursor': first}).status_code, 200)
+
+        def token(raw):
+            return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+        for cursor in (
+            'not base64 at all!', first[:-3], token(b'\xff\xfe'), token(b'{"a": 1, "b": 2}'), token(b'5'),
+            token(b'["yesterday", 1]'), token(b'["2026-01-01T00:00:00", "one"]'), token(b'[null, 1]'),
+            token(b'["2026-01-01T00:00:00", 1, 2]'), token(b'[' * 100_000),
+        ):
+            with self.subTest(cursor=cursor[:40]):
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid cursor.'})
+
+    def test_cached_counts_follow_creates_claims_and_rejections(self):
+        listing = Listing.objects.get(pk=self.listings(1)[0])
+
+        def counts():
+            self.client.force_login(self.donor)
+            donor = self.client.get(reverse('donor_dashboard')).context
+            self.client.force_login(self.ngo)
+            active = self.client.get(reverse('my_claims')).context['claim_count']
+            past = self.client.get(reverse('history')).context['claim_count']
+            return donor['live_count'], donor['history_count'], active, past
+
+        self.assertEqual(counts(), (1, 0, 0, 0))
+        self.listings(1)
+        self.assertEqual(counts(), (2, 0, 0, 0))
+        claim = reservations.reserve(listing, self.ngo, 10)
+        self.assertEqual(counts(), (1, 0, 1, 0))  # taking it all closes the listing
+        self.client.force_login(self.donor)
+        self.client.post(reverse('reject_claim', args=[claim.pk]))
+        self.assertEqual(counts(), (2, 1, 0, 1))
+
+
+class ReservationTests(TransactionTestCase):
+    def setUp(self):
+        self.donor = User.objects.create(username='donor', role='donor')
+        self.listing = Listing.objects.create(
+            donor=self.donor, food_type='cooked', quantity_kg=20, servings=80, description='Rice',
+            expiry_time=timezone.now() + timedelta(hours=6),
+        )
+
+    def ngo(self, n):
+        return User.objects.create(username=f'ngo{n}', role='claimant')
+
+    def test_concurrent_claimers_never_over_allocate(self):
+        ngos = [self.ngo(n) for n in range(300)]
+        # Every claimer works from the same snapshot (20 kg left), which a
+        # read-then-write reservation would over-allocate on. The shared
+        # in-memory test database cannot take concurrent writers, so the
+        # claimers run against a file copy of it, each thread on its own
+        # connection, as separate server processes would.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'claims.sqlite3')
+        with closing(sqlite3.connect(path)) as copy:
+            connection.connection.backup(copy)
+        snapshot = Listing.objects.get(pk=self.listing.pk)
+        barrier = threading.Barrier(len(ngos))
+        outcomes = []
+
+        def claim(ngo):
+            barrier.wait()
+            try:
+                reservations.reserve(snapshot, ngo, 0.5)
+                outcomes.append('reserved')
+            except reservations.NotEnoughLeft:
+                outcomes.append('refused')
+            finally:
+                connections.close_all()
+
+        settings_dict = connection.settings_dict
+        original = settings_dict['NAME'], settings_dict['OPTIONS']
+        # New connections (one per thread) open the copy and wait out each other's write locks
+        settings_dict['NAME'], settings_dict['OPTIONS'] = path, {**original[1], 'timeout': 60}
+        try:
+            threads = [threading.Thread(target=claim, args=(ngo,)) for ngo in ngos]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            settings_dict['NAME'], settings_dict['OPTIONS'] = original
+
+        self.assertEqual(outcomes.count('reserved'), 40)
+        self.assertEqual(outcomes.count('refused'), 260)
+        with closing(sqlite3.connect(path)) as copy:
+            claims = copy.execute(
+                "SELECT COUNT(*), SUM(quantity_kg) FROM listings_claim WHERE listing_id = ?", [self.listing.pk],
+            ).fetchone()
+            listing = copy.execute(
+                "SELECT remaining_kg, remaining_servings, status FROM listings_listing WHERE id = ?", [self.listing.pk],
+            ).fetchone()
+        self.assertEqual(claims[0], 40)
+        self.assertAlmostEqual(claims[1], 20)
+        self.assertEqual(listing, (0, 0, 'claimed'))
+
+    def test_one_open_claim_per_ngo(self):
+        ngo = self.ngo(1)
+        reservations.reserve(self.listing, ngo, 5)
+        self.listing.refresh_from_db()
+        with self.assertRaises(reservations.AlreadyClaimed):
+            reservations.reserve(self.listing, ngo, 5)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.remaining_kg, 15)
+
+    def test_rejecting_gives_the_share_back(self):
+        claim = reservations.reserve(self.listing, self.ngo(1))
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.remaining_kg, self.listing.status), (0, 'claimed'))
+        self.assertTrue(reservations.reject(claim))
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.remaining_kg, self.listing.remaining_servings, self.listing.status),
+                         (20, 80, 'active'))
+
+    def test_approving_a_whole_listing_claim_rejects_the_rest(self):
+        legacy = [Claim.objects.create(listing=self.listing, claimant=self.ngo(n)) for n in range(3)]
+        reserved = reservations.reserve(self.listing, self.ngo(9), 5)
+        self.assertEqual(reservations.approve(legacy[0]), 'approved')
+        statuses = dict(Claim.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[c.pk] for c in legacy + [reserved]], ['approved', 'rejected', 'rejected', 'pending'],
+        )
+        legacy[0].refresh_from_db()
+        self.assertEqual(legacy[0].quantity_kg, 15)
+
+    def test_expiry_settles_partial_claims_and_only_charges_for_unclaimed_listings(self):
+        def listing():
+            return Listing.objects.create(
+                donor=self.donor, food_type='cooked', quantity_kg=20, servings=80, description='Dal',
+                expiry_time=timezone.now() + timedelta(hours=6),
+            )
+
+        partly_claimed, delivered, untouched = self.listing, listing(), listing()
+        approved = reservations.reserve(partly_claimed, self.ngo(1), 5)
+        reservations.approve(approved)
+        waiting = reservations.reserve(partly_claimed, self.ngo(2), 3)
+        done = reservations.reserve(delivered, self.ngo(3), 5)
+        Claim.objects.filter(pk=done.pk).update(status='completed')
+        Listing.objects.update(expiry_time=timezone.now() - timedelta(minutes=1))
+
+        expire_overdue_listings()
+        expire_overdue_listings()  # overlapping or repeated runs change nothing more
+
+        statuses = dict(Listing.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[listing.pk] for listing in (partly_claimed, delivered, untouched)],
+            ['claimed', 'completed', 'expired'],
+        )
+        claims = dict(Claim.objects.values_list('pk', 'status'))
+        self.assertEqual((claims[approved.pk], claims[waiting.pk]), ('approved', 'rejected'))
+        partly_claimed.refresh_from_db()
+        self.assertEqual((partly_claimed.remaining_kg, partly_claimed.remaining_servings), (15, 60))
+        self.donor.refresh_from_db()
+        self.assertEqual(self.donor.trust_negative, trust.EXPIRED_LISTING[1])
+        self.assertEqual(User.objects.get(username='ngo2').trust_negative, 0)
+        trust.recompute_all()
+        self.donor.refresh_from_db()
+        self.assertEqual(self.donor.trust_negative, trust.EXPIRED_LISTING[1])
+        # Rejected at expiry, not by the donor: the NGO keeps its score after a rebuild too
+        ngo = User.objects.get(username='ngo2')
+        self.assertEqual((ngo.trust_negative, ngo.trust_score), (0, trust.MAX_SCORE))
+
+    def test_expiry_settles_a_listing_a_pending_claim_reserved_in_full(self):
+        waiting = reservations.reserve(self.listing, self.ngo(1))
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.status, 'claimed')
+        Listing.objects.update(expiry_time=timezone.now() - timedelta(minutes=1))
+
+        expire_overdue_listings()
+
+        waiting.refresh_from_db()
+        self.listing.refresh_from_db()
+        self.assertEqual(waiting.status, 'rejected')
+        self.assertEqual((self.listing.status, self.listing.remaining_kg, self.listing.remaining_servings),
+                         ('expired', 20, 80))
+
+    def test_claims_are_not_approved_after_expiry(self):
+        waiting = reservations.reserve(self.listing, self.ngo(1), 5)
+        Listing.objects.update(expiry_time=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(reservations.approve(waiting), 'rejected')
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.remaining_kg, 20)
+
+
+class ReadModelTests(TestCase):
+    """Dashboard rows come from one query each and match what the templates show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create(username='donor', role='donor', institution_name='Hotel Annapurna')
+        cls.ngo = User.objects.create(username='ngo', role='claimant')
+        cls.other_ngo = User.objects.create(username='other', role='claimant')
+        cls.volunteer = Volunteer.objects.create(ngo=cls.ngo, name='asha', phone='98450')
+        listings = [
+            Listing.objects.create(
+                donor=cls.donor, food_type='cooked', quantity_kg=10, description=f'Meal {n}',
+                pickup_instructions='Back gate', expiry_time=timezone.now() + timedelta(hours=6),
+            )
+            for n in range(3)
+        ]
+        # A whole-listing claim from before partial claims, being picked up
+        cls.whole = Claim.objects.create(listing=listings[0], claimant=cls.ngo, status='approved')
+        cls.pickup = PickupAssignment.objects.create(claim=cls.whole, volunteer=cls.volunteer, notes='Ring twice')
+        cls.partial = Claim.objects.create(listing=listings[1], claimant=cls.ngo, status='approved', quantity_kg=4)
+        cls.pending = Claim.objects.create(listing=listings[2], claimant=cls.other_ngo, quantity_kg=2)
+
+    def test_donor_rows(self):
+        with self.assertNumQueries(2):  # pickups, volunteer positions
+            [pickup] = read_models.donor_pickups(self.donor)
+        self.assertEqual(pickup.id, self.pickup.pk)
+        self.assertEqual(pickup.qty, 10)
+        self.assertEqual((pickup.vname, pickup.ngo, pickup.pstatus), ('asha', 'ngo', 'assigned'))
+        self.assertEqual(pickup.otp_code, PickupOTP.objects.get(assignment=self.pickup).code)
+        self.assertFalse(pickup.otp_verified)
+        with self.assertNumQueries(1):
+            [claim] = read_models.incoming_claims(self.donor)
+        self.assertEqual((claim.id, claim.claimant, claim.food), (self.pending.pk, 'other', 'Cooked Meal'))
+
+    def test_claimant_rows(self):
+        with self.assertNumQueries(1):
+            [volunteer] = read_models.ngo_volunteers(self.ngo)
+        self.assertEqual((volunteer.initial, volunteer.phone, volunteer.email), ('A', '98450', '—'))
+        with self.assertNumQueries(1):
+            [unassigned] = read_models.unassigned_claims(self.ngo)
+        self.assertEqual((unassigned.id, unassigned.qty, unassigned.donor_name), (self.partial.pk, 4, 'Hotel Annapurna'))
+        [task] = read_models.assigned_tasks(self.ngo)
+        self.assertEqual((task.id, task.status_display, task.loc), (self.pickup.pk, 'Assigned', None))
+        self.assertEqual([c.id for c in read_models.pending_claims(self.other_ngo)], [self.pending.pk])
+
+    def test_claimant_dashboard(self):
+        url = reverse('claimant_dashboard')
+        self.assertRedirects(self.client.get(url), f"{settings.LOGIN_URL}?next={url}", fetch_redirect_response=False)
+        self.client.force_login(self.donor)
+        self.assertRedirects(self.client.get(url), reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.force_login(self.ngo)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        self.assertEqual([v.name for v in context['vol_list']], ['asha'])
+        self.assertEqual((context['active_volunteers'], context['total_volunteers']), (1, 1))
+        self.assertEqual(len(context['listings']), 3)
+        self.assertEqual([c.id for c in context['unassigned_list']], [self.partial.pk])
+        self.assertEqual([t.id for t in context['assigned_tasks_list']], [self.pickup.pk])
+        self.assertContains(response, 'Meal 2')
+        self.assertContains(response, 'Hotel Annapurna')
+        self.assertContains(response, 'asha')
+
+    def test_listing_api_leaves_out_expired_listings(self):
+        overdue = Listing.objects.create(
+            donor=self.donor, food_type='cooked', quantity_kg=5, description='Overdue',
+            expiry_time=timezone.now() - timedelta(minutes=1),
+        )
+        listings = self.client.get(reverse('listing_api')).json()['listings']
+        self.assertEqual(len(listings), 3)
+        self.assertNotIn(overdue.pk, [listing['id'] for listing in listings])
+
+    def test_volunteer_rows(self):
+        with self.assertNumQueries(1):
+            [assignment] = read_models.active_assignments(self.volunteer)
+        self.assertEqual(assignment.ftype_display, 'Cooked Meal')
+        self.assertEqual((assignment.qty, assignment.donor_name), (10, 'Hotel Annapurna'))
+        self.assertEqual((assignment.pickup_instructions, assignment.notes), ('Back gate', 'Ring twice'))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create(username='donor', role='donor', latitude=12.97, longitude=77.59)
+        self.ngo = User.objects.create(username='ngo', role='claimant')
+        self.volunteer = Volunteer.objects.create(ngo=self.ngo, name='asha')
+        self.old = timezone.now() - timedelta(days=400)
+
+    def listing(self, status='expired', kg=10, **fields):
+        listing = Listing.objects.create(
+            donor=self.donor, food_type='cooked', quantity_kg=kg, description='Rice',
+            expiry_time=self.old + timedelta(hours=6), **fields,
+        )
+        Listing.objects.filter(pk=listing.pk).update(status=status, created_at=self.old)
+        return listing
+
+    def delivered(self, listing, kg, minutes):
+        """A share of ``listing`` picked up ``minutes`` after assignment and delivered, counted as it happened."""
+        claim = Claim.objects.create(listing=listing, claimant=self.ngo, status='completed', quantity_kg=kg)
+        Claim.objects.filter(pk=claim.pk).update(claimed_at=self.old)
+        assignment = PickupAssignment.objects.create(claim=claim, volunteer=self.volunteer, status='delivered')
+        otp = assignment.otp
+        otp.is_verified, otp.verified_at = True, assignment.assigned_at + timedelta(minutes=minutes)
+        otp.save()
+        for module in (impact, trust):
+            module.record_pickup_verified(assignment, otp)
+            module.record_delivery(claim)
+
+    def test_batches_resume_where_a_run_stopped(self):
+        finished = [self.listing() for _ in range(5)]
+        active = self.listing(status='active')
+        recent = self.listing()
+        Listing.objects.filter(pk=recent.pk).update(created_at=timezone.now())
+        batches = []
+
+        stats = archive.archive(batch_size=2, max_seconds=0, progress=lambda s: batches.append(s.listings))
+        self.assertEqual((stats.listings, stats.batches, batches), (2, 1, [2]))
+        self.assertEqual(list(ArchivedListing.objects.values_list('pk', flat=True).order_by('pk')),
+                         [l.pk for l in finished[:2]])
+
+        stats = archive.archive(batch_size=2, progress=lambda s: batches.append(s.listings))
+        self.assertEqual((stats.listings, stats.batches, batches), (3, 2, [2, 2, 3]))
+        self.assertEqual(ArchivedListing.objects.count(), 5)
+        self.assertEqual(set(Listing.objects.values_list('pk', flat=True)), {active.pk, recent.pk})
+        self.assertEqual(archive.archive(batch_size=2).listings, 0)
+
+    def test_rebuilt_aggregates_match_the_incremental_ones_after_archiving(self):
+        for n in range(3):
+            listing = self.listing(status='completed')
+            self.delivered(listing, kg=4 + n, minutes=30 if n else 90)
+            rejected = Claim.objects.create(listing=listing, claimant=self.ngo, quantity_kg=1, status='pending')
+            Claim.objects.filter(pk=rejected.pk).update(claimed_at=self.old)
+            reservations.reject(rejected)
+            trust.record_rejection(rejected)
+        self.listing()
+        trust.record_expiries({self.donor.pk: 1})
+        heatmap.roll_up()
+
+        def aggregates():
+            return (
+                list(ImpactStats.objects.order_by('pk').values_list(
+                    'pk', 'kg_donated', 'kg_received', 'completed_pickups', 'active_volunteers',
+                    'pickup_seconds_total', 'timed_pickups')),
+                list(User.objects.order_by('pk').values_list('pk', 'trust_positive', 'trust_negative', 'trust_score')),
+                sorted(SurplusCell.objects.values_list(
+                    'cell_y', 'cell_x', 'hour_of_week', 'food_type', 'completed_kg', 'expired_kg',
+                    'completed_listings', 'expired_listings')),
+            )
+
+        incremental = aggregates()
+        stats = archive.archive(batch_size=2)
+        self.assertEqual((stats.listings, stats.claims, stats.pickups, stats.otps), (4, 6, 3, 3))
+        self.assertFalse(Listing.objects.exists())
+        self.assertEqual(ArchivedPickupAssignment.objects.filter(otp_verified_at__isnull=False).count(), 3)
+        self.assertEqual(ArchivedClaim.objects.filter(rejected_by_donor=True).count(), 3)
+
+        impact.rebuild_all()
+        trust.recompute_all()
+        heatmap.rebuild()
+        self.assertEqual(aggregates(), incremental)
+
+    def test_spent_otps_are_purged_without_archiving(self):
+        listing = self.listing(status='completed')
+        self.delivered(listing, kg=4, minutes=30)
+        picked_up = Claim.objects.create(listing=self.listing(status='claimed'), claimant=self.ngo, status='approved')
+        in_progress = PickupAssignment.objects.create(claim=picked_up, volunteer=self.volunteer, status='picked_up')
+        PickupOTP.objects.filter(assignment=in_progress).update(is_verified=True, verified_at=timezone.now())
+        stale = Claim.objects.create(listing=self.listing(status='claimed'), claimant=self.ngo, status='approved')
+        PickupAssignment.objects.create(claim=stale, volunteer=self.volunteer)
+        fresh = Claim.objects.create(
+            listing=Listing.objects.create(donor=self.donor, food_type='cooked', quantity_kg=5, description='Dal',
+                                           expiry_time=timezone.now() + timedelta(hours=2)),
+            claimant=self.ngo, status='approved',
+        )
+        waiting = PickupAssignment.objects.create(claim=fresh, volunteer=self.volunteer)
+
+        self.assertEqual(archive.purge_spent_otps(), (1, 1))
+        self.assertEqual(archive.purge_spent_otps(), (0, 0))
+        self.assertEqual(
+            dict(PickupOTP.objects.values_list('assignment__claim__listing_id', 'code')),
+            {listing.pk: '', picked_up.listing_id: in_progress.otp.code, fresh.listing_id: waiting.otp.code},
+        )
+        # Its verification still counts when stats are rebuilt
+        self.assertTrue(PickupOTP.objects.get(assignment__claim__listing=listing).is_verified)
+
+    def test_sweep_keeps_referenced_and_recent_uploads(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        storage = images.ContentAddressedStorage(location=root)
+
+        def upload(name, content):
+            stored = storage.save(name, SimpleUploadedFile(name, content))
+            os.utime(storage.path(stored), (0, 0))  # well past any grace period
+            return stored
+
+        live = upload('listings/live.png', b'live listing')
+        archived = upload('claims/archived.png', b'archived claim photo')
+        variant = images.variant_name(live, 'thumb')
+        with storage.open(variant, 'wb') as f:
+            f.write(b'thumb')
+        os.utime(storage.path(variant), (0, 0))
+        orphan = upload('listings/orphan.png', b'nobody points here')
+        young = storage.save('claims/young.png', SimpleUploadedFile('young.png', b'just uploaded'))
+        Listing.objects.filter(pk=self.listing(status='active').pk).update(image=live)
+        ArchivedListing.objects.create(id=999, donor=self.donor, food_type='cooked', quantity_kg=1, description='x',
+                                       expiry_time=self.old, status='expired', created_at=self.old)
+        ArchivedClaim.objects.create(id=999, listing_id=999, claimant=self.ngo, status='completed',
+                                     claimed_at=self.old, claimant_photo=archived)
+
+        with override_settings(MEDIA_ROOT=root):
+            self.assertEqual(archive.sweep_orphaned_media(dry_run=True), (1, len(b'nobody points here')))
+            self.assertTrue(storage.exists(orphan))
+            self.assertEqual(archive.sweep_orphaned_media(), (1, len(b'nobody points here')))
+            self.assertEqual(archive.sweep_orphaned_media(grace=timedelta(0)), (1, len(b'just uploaded')))
+        self.assertFalse(storage.exists(orphan) or storage.exists(young))
+        self.assertTrue(all(storage.exists(name) for name in (live, archived, variant)))
@@ -11,6 +11,13 @@ urlpatterns = [
     path('claim/complete/<int:claim_id>/', views.complete_claim, name='complete_claim'),
     path('assign-volunteer/<int:claim_id>/', views.assign_volunteer, name='assign_volunteer'),
     path('api/', views.listing_api, name='listing_api'),
+    path('api/search/', views.listing_search, name='listing_search'),
+    path('api/changes/', views.listing_changes, name='listing_changes'),
     path('my-claims/', views.my_claims, name='my_claims'),
     path('history/', views.history_view, name='history'),
+    path('api/dashboard/listings/', views.donor_listings_more, name='donor_listings_more'),
+    path('api/dashboard/history/', views.donor_history_more, name='donor_history_more'),
+    path('api/my-claims/', views.my_claims_more, name='my_claims_more'),
+    path('api/history/', views.history_more, name='history_more'),
+    path('api/pickups/locations/', views.pickup_locations, name='pickup_locations'),
 ]
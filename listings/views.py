@@ -1,8 +1,52 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from django.http import JsonResponse
+from foodsaver.aio import arender, gather_reads
+from users import locations, trust
 from .models import Listing, Claim, PickupAssignment
 from .forms import ListingForm
+from . import changes, read_models, reservations
+from .pagination import cached_stat, keyset_page, load_more
+
+def _live_listings(user):
+    return Listing.objects.filter(donor=user, status='active')
+
+
+def _donor_history_claims(user):
+    # History includes completed, rejected, and approved (if any legacy exist)
+    return Claim.objects.filter(
+        listing__donor=user, status__in=['completed', 'rejected', 'approved']
+    ).select_related('listing', 'claimant')
+
+
+def _active_claims(user):
+    return Claim.objects.filter(claimant=user, status__in=['pending', 'approved']).select_related('listing', 'listing__donor')
+
+
+def _past_claims(user):
+    return Claim.objects.filter(claimant=user, status__in=['completed', 'rejected']).select_related('listing', 'listing__donor')
+
+
+def _pickups_in_progress(user):
+    """Pickups of the user's listings (donor) or claims (claimant) that are on their way."""
+    pickups = PickupAssignment.objects.filter(status__in=['assigned', 'picked_up'])
+    if user.role == 'claimant':
+        return pickups.filter(claim__claimant=user)
+    return pickups.filter(claim__listing__donor=user)
+
+
+def _pickup_positions(pickups):
+    """``{assignment_id: Position}`` of the volunteers on these pickups that have reported one."""
+    positions = locations.latest_positions(p.volunteer_id for p in pickups)
+    return {p.id: positions[p.volunteer_id] for p in pickups if p.volunteer_id in positions}
+
+
+def _forbidden():
+    return JsonResponse({'error': 'Not allowed.'}, status=403)
+
 
 @login_required
 def create_listing(request):
@@ -22,84 +66,66 @@ def donor_dashboard(request):
     if request.user.role != 'donor' and not request.user.is_superuser:
          return redirect('dashboard')
          
-    # Auto-expire listings past their expiry time
-    Listing.objects.filter(
-        status='active',
-        expiry_time__lte=timezone.now()
-    ).update(status='expired')
+    # First pages only; older rows are fetched by the "load more" endpoints
+    listings = keyset_page(_live_listings(request.user), field='created_at')
 
-    listings = Listing.objects.filter(donor=request.user).order_by('-created_at')
-    
-    # Split claims into Pending and History
-    pending_claims = Claim.objects.filter(listing__in=listings, status='pending').order_by('-claimed_at')
-    # History includes completed, rejected, and approved (if any legacy exist)
-    history_claims = Claim.objects.filter(listing__in=listings, status__in=['completed', 'rejected', 'approved']).order_by('-claimed_at')
-    
-    # Get pickup assignments for this restaurant's listings (with OTPs)
-    active_pickups_qs = PickupAssignment.objects.filter(
-        claim__listing__in=listings,
-        status__in=['assigned', 'picked_up'],
-    ).select_related(
-        'claim', 'claim__listing', 'claim__claimant', 'volunteer', 'otp'
-    ).order_by('-assigned_at')
-
-    # Pre-process pickups so template only needs short, simple variables
-    pickup_list = []
-    for p in active_pickups_qs:
-        otp_obj = getattr(p, 'otp', None)
-        pickup_list.append({
-            'id': p.id,
-            'ftype': p.claim.listing.food_type,
-            'desc': p.claim.listing.description,
-            'qty': p.claim.listing.quantity_kg,
-            'vname': p.volunteer.name,
-            'ngo': getattr(p.claim.claimant, 'institution_name', '') or p.claim.claimant.username,
-            'assigntime': p.assigned_at,
-            'pstatus': p.status,
-            'otp_code': otp_obj.code if otp_obj else '',
-            'otp_verified': otp_obj.is_verified if otp_obj else False,
-            'otp_verified_at': otp_obj.verified_at if otp_obj else None,
-        })
+    history_claims = keyset_page(_donor_history_claims(request.user), field='claimed_at')
+    user = request.user
+    live_count = cached_stat(user.pk, 'live_listings', lambda: _live_listings(user).count())
+    history_count = cached_stat(user.pk, 'donor_history', lambda: _donor_history_claims(user).count())
+
+    # Incoming claims and pickups in progress (with OTPs), as template-ready rows
+    pending_claims = read_models.incoming_claims(user)
+    pickup_list = read_models.donor_pickups(user)
 
     return render(request, 'listings/donor_dashboard.html', {
-        'listings': listings, 
+        'listings': listings,
+        'live_count': live_count,
         'pending_claims': pending_claims,
         'history_claims': history_claims,
+        'history_count': history_count,
         'pickup_list': pickup_list,
         'pickup_count': len(pickup_list),
     })
 
 @login_required
 def claim_listing(request, listing_id):
-    listing = get_object_or_404(Listing, id=listing_id)
+    listing = get_object_or_404(Listing.objects.select_related('donor'), id=listing_id)
     if request.method == 'POST':
-        # Create claim with default status 'pending'
-        Claim.objects.create(listing=listing, claimant=request.user)
+        # A share of the listing (all that is left if blank), pending the donor's approval
+        try:
+            quantity = float(request.POST['quantity_kg']) if request.POST.get('quantity_kg') else None
+        except ValueError:
+            quantity = None
+        try:
+            reservations.reserve(listing, request.user, quantity)
+        except reservations.AlreadyClaimed:
+            messages.info(request, 'You already have an open claim on this listing.')
+        except reservations.NotEnoughLeft as e:
+            if e.remaining:
+                messages.error(request, f'Only {e.remaining:g} kg of this listing is left.')
+            else:
+                messages.error(request, 'This listing has already been claimed.')
         return redirect('claimant_dashboard')
     return render(request, 'listings/claim_confirm.html', {'listing': listing})
 
 @login_required
 def approve_claim(request, claim_id):
     # Approve the claim — NGO will then assign a volunteer for pickup
-    claim = get_object_or_404(Claim, id=claim_id)
+    claim = get_object_or_404(Claim.objects.select_related('listing'), id=claim_id)
     if request.user == claim.listing.donor:
-        claim.status = 'approved'
-        claim.save()
-        
-        # Mark listing as claimed (not completed until delivered)
-        listing = claim.listing
-        listing.status = 'claimed'
-        listing.save()
-        
+        if reservations.approve(claim) == 'rejected':
+            messages.error(request, 'This listing has expired or nothing is left of it, so the claim was rejected.')
+
     return redirect('donor_dashboard')
 
 @login_required
 def reject_claim(request, claim_id):
-    claim = get_object_or_404(Claim, id=claim_id)
+    claim = get_object_or_404(Claim.objects.select_related('listing'), id=claim_id)
     if request.user == claim.listing.donor:
-        claim.status = 'rejected'
-        claim.save()
-        # Listing remains active for others to claim
+        # Gives the claim's share back, so the listing is open to others again
+        if reservations.reject(claim):
+            trust.record_rejection(claim)
     return redirect('donor_dashboard')
 
 # Legacy verify view can be removed or redirected if no longer used
@@ -108,125 +134,37 @@ def complete_claim(request, claim_id):
     return approve_claim(request, claim_id)
 
 @login_required
-def claimant_dashboard(request):
-    if request.user.role != 'claimant' and not request.user.is_superuser:
+async def claimant_dashboard(request):
+    user = await request.auser()
+    if user.role != 'claimant' and not user.is_superuser:
         return redirect('dashboard')
-    
-    # Get volunteers for this NGO
-    from users.models import Volunteer
-    volunteers = Volunteer.objects.filter(ngo=request.user).order_by('-date_joined')
-    active_volunteers_list = volunteers.filter(status='active')
-    active_volunteers = active_volunteers_list.count()
-    total_volunteers = volunteers.count()
-
-    # Pre-process volunteers for template (short variable names)
-    vol_list = []
-    for v in volunteers:
-        vol_list.append({
-            'vid': v.volunteer_id,
-            'name': v.name,
-            'initial': v.name[:1].upper() if v.name else '?',
-            'phone': v.phone or '\u2014',
-            'email': v.email or '\u2014',
-            'addr': v.address or '\u2014',
-            'status': v.status,
-            'joined': v.date_joined,
-            'id': v.id,
-        })
-    
-    # Auto-expire listings that have passed their expiry time
-    Listing.objects.filter(
-        status='active',
-        expiry_time__lte=timezone.now()
-    ).update(status='expired')
-
-    # Get active (non-expired) listings for list view
-    listings = Listing.objects.filter(
-        status='active',
-        expiry_time__gt=timezone.now()
-    ).order_by('expiry_time')
-    
-    # Get IDs of listings this user has already claimed (pending)
-    my_pending_claims_ids = Claim.objects.filter(
-        claimant=request.user, 
-        status='pending'
-    ).values_list('listing_id', flat=True)
 
-    # --- Claims Management ---
-    
-    # 1. Pending Approval (Waitlist)
-    pending_claims = Claim.objects.filter(
-        claimant=request.user, 
-        status='pending'
-    ).select_related('listing', 'listing__donor').order_by('-claimed_at')
-
-    # Pre-process pending claims for template (short variable names)
-    pending_list = []
-    for c in pending_claims:
-        pending_list.append({
-            'id': c.id,
-            'desc': c.listing.description,
-        })
-    
-    # 2. Approved Claims (Need assignment)
-    # Get all approved claims first
-    approved_claims_qs = Claim.objects.filter(
-        claimant=request.user,
-        status='approved'
-    ).select_related('listing', 'listing__donor').order_by('-claimed_at')
-    
-    # Identify which approved claims already have an assignment
-    assigned_claim_ids = PickupAssignment.objects.filter(
-        claim__in=approved_claims_qs
-    ).values_list('claim_id', flat=True)
-    
-    # Filter: Unassigned (Action Required)
-    unassigned_claims = approved_claims_qs.exclude(id__in=assigned_claim_ids)
-    
-    # Filter: Assigned (In Progress)
-    assigned_pickup_tasks_qs = PickupAssignment.objects.filter(
-        claim__in=approved_claims_qs
-    ).select_related('claim', 'volunteer', 'claim__listing', 'claim__listing__donor').order_by('-assigned_at')
-
-    # Pre-process unassigned claims for template (short variable names)
-    unassigned_list = []
-    for c in unassigned_claims:
-        donor = c.listing.donor
-        unassigned_list.append({
-            'id': c.id,
-            'desc': c.listing.description,
-            'donor_name': getattr(donor, 'institution_name', '') or donor.username,
-            'qty': c.listing.quantity_kg,
-        })
+    # Independent reads, run at once (see foodsaver/aio.py)
+    vol_list, listings, pending_list, unassigned_list, assigned_tasks_list = await gather_reads(
+        (read_models.ngo_volunteers, user),
+        # Active (non-expired) listings for the list and map
+        (list, read_models.feed_listings()),
+        # 1. Pending approval (waitlist)
+        (read_models.pending_claims, user),
+        # 2. Approved claims that still need a volunteer, and those being picked up
+        (read_models.unassigned_claims, user),
+        (read_models.assigned_tasks, user),
+    )
+    active_volunteers_list = [v for v in vol_list if v.status == 'active']
 
-    # Pre-process assigned pickup tasks for template
-    assigned_tasks_list = []
-    for t in assigned_pickup_tasks_qs:
-        assigned_tasks_list.append({
-            'id': t.id,
-            'desc': t.claim.listing.description,
-            'vname': t.volunteer.name,
-            'assigntime': t.assigned_at,
-            'status_display': t.get_status_display(),
-        })
+    return await arender(request, 'listings/claimant_dashboard.html', {
+        'listings': listings,
+        'pending_claim_ids': {c.listing_id for c in pending_list},
 
-    return render(request, 'listings/claimant_dashboard.html', {
-        'listings': listings, 
-        'pending_claim_ids': my_pending_claims_ids,
-        
         # Volunteer Data
-        'volunteers': volunteers,
         'vol_list': vol_list,
-        'active_volunteers': active_volunteers,
+        'active_volunteers': len(active_volunteers_list),
         'active_volunteers_list': active_volunteers_list,
-        'total_volunteers': total_volunteers,
-        
+        'total_volunteers': len(vol_list),
+
         # Claims Data
-        'pending_claims': pending_claims,
         'pending_list': pending_list,
-        'unassigned_claims': unassigned_claims,
         'unassigned_list': unassigned_list,
-        'assigned_pickup_tasks': assigned_pickup_tasks_qs,
         'assigned_tasks_list': assigned_tasks_list,
     })
 
@@ -251,22 +189,64 @@ def assign_volunteer(request, claim_id):
     
     return redirect('claimant_dashboard')
 
-from django.http import JsonResponse
-
-def listing_api(request):
-    listings = Listing.objects.filter(status='active')
+async def listing_api(request):
+    seq = await sync_to_async(changes.current_seq)()  # read first: anything changed after this shows up in the feed
     data = []
-    for listing in listings:
+    listings = Listing.objects.filter(status='active', expiry_time__gt=timezone.now()).select_related('donor')
+    async for listing in listings:
         data.append({
             'id': listing.id,
             'food_type': listing.get_food_type_display(),
             'quantity': listing.quantity_kg,
+            'remaining': listing.remaining_kg,
             'lat': listing.donor.latitude if listing.donor.latitude else 0,
             'lng': listing.donor.longitude if listing.donor.longitude else 0,
             'expiry': listing.expiry_time.isoformat(),
             'donor_name': listing.donor.username,
         })
-    return JsonResponse({'listings': data})
+    return JsonResponse({'listings': data, 'seq': seq})
+
+
+def _float_param(request, name):
+    try:
+        return float(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def listing_search(request):
+    """Full-text search over active listings, ranked by relevance, urgency and distance."""
+    from .search import search_listings
+
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    results = search_listings(
+        query,
+        lat=_float_param(request, 'lat'),
+        lng=_float_param(request, 'lng'),
+        limit=limit,
+    )
+    data = []
+    for listing, score, distance in results:
+        donor = listing.donor
+        data.append({
+            'id': listing.id,
+            'food_type': listing.get_food_type_display(),
+            'description': listing.description,
+            'quantity': listing.quantity_kg,
+            'remaining': listing.remaining_kg,
+            'lat': donor.latitude or 0,
+            'lng': donor.longitude or 0,
+            'expiry': listing.expiry_time.isoformat(),
+            'donor_name': donor.institution_name or donor.username,
+            'distance_km': round(distance, 2) if distance is not None else None,
+            'score': round(score, 4),
+        })
+    return JsonResponse({'query': query, 'listings': data})
 
 @login_required
 def my_claims(request):
@@ -274,8 +254,10 @@ def my_claims(request):
         return redirect('dashboard')
     
     # Active claims (pending or approved)
-    claims = Claim.objects.filter(claimant=request.user, status__in=['pending', 'approved']).order_by('-claimed_at')
-    return render(request, 'listings/my_claims.html', {'claims': claims})
+    user = request.user
+    claims = keyset_page(_active_claims(user), field='claimed_at')
+    claim_count = cached_stat(user.pk, 'active_claims', lambda: _active_claims(user).count())
+    return render(request, 'listings/my_claims.html', {'claims': claims, 'claim_count': claim_count})
 
 @login_required
 def history_view(request):
@@ -283,6 +265,61 @@ def history_view(request):
         return redirect('dashboard')
         
     # Past claims (completed or rejected)
-    claims = Claim.objects.filter(claimant=request.user, status__in=['completed', 'rejected']).order_by('-claimed_at')
-    return render(request, 'listings/history.html', {'claims': claims})
+    user = request.user
+    claims = keyset_page(_past_claims(user), field='claimed_at')
+    claim_count = cached_stat(user.pk, 'past_claims', lambda: _past_claims(user).count())
+    return render(request, 'listings/history.html', {'claims': claims, 'claim_count': claim_count})
+
+
+# "Load more" endpoints: the page after ?cursor= as rendered rows
+
+@login_required
+def donor_listings_more(request):
+    if request.user.role != 'donor' and not request.user.is_superuser:
+        return _forbidden()
+    return load_more(request, _live_listings(request.user), 'listings/_live_listing_card.html', 'listing', field='created_at')
+
+
+@login_required
+def donor_history_more(request):
+    if request.user.role != 'donor' and not request.user.is_superuser:
+        return _forbidden()
+    return load_more(request, _donor_history_claims(request.user), 'listings/_donor_history_row.html', 'claim', field='claimed_at')
+
+
+@login_required
+def my_claims_more(request):
+    if request.user.role != 'claimant':
+        return _forbidden()
+    return load_more(request, _active_claims(request.user), 'listings/_my_claim_row.html', 'claim', field='claimed_at')
 
+
+@login_required
+def history_more(request):
+    if request.user.role != 'claimant':
+        return _forbidden()
+    return load_more(request, _past_claims(request.user), 'listings/_history_row.html', 'claim', field='claimed_at')
+
+
+@login_required
+def pickup_locations(request):
+    """Latest volunteer positions for the user's pickups in progress, polled by the dashboards."""
+    if request.user.role not in ('donor', 'claimant') and not request.user.is_superuser:
+        return _forbidden()
+    pickups = list(_pickups_in_progress(request.user).only('id', 'volunteer_id'))
+    return JsonResponse({
+        'locations': {str(pk): position.as_dict() for pk, position in _pickup_positions(pickups).items()},
+    })
+
+
+@login_required
+def listing_changes(request):
+    """Listings, claims and pickups changed after ``?since=<seq>`` (see listings.changes)."""
+    try:
+        since = max(int(request.GET.get('since', 0)), 0)
+    except ValueError:
+        return JsonResponse({'error': 'since must be an integer.'}, status=400)
+    try:
+        return JsonResponse(changes.feed(request.user, since))
+    except changes.FeedExpired:
+        return JsonResponse({'error': 'Too far behind; reload in full.', 'seq': changes.current_seq()}, status=410)
@@ -1,18 +1,30 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Volunteer
 
-class CustomUserAdmin(UserAdmin):
+from foodsaver.admin_performance import AutocompleteFilter, LargeTableAdmin
+
+from .models import User, Volunteer, ImpactStats
+
+class CustomUserAdmin(LargeTableAdmin, UserAdmin):
     list_display = ('username', 'email', 'role', 'is_verified', 'trust_score')
     list_filter = ('role', 'is_verified')
+    search_fields = UserAdmin.search_fields + ('institution_name',)
     fieldsets = UserAdmin.fieldsets + (
         ('Additional Info', {'fields': ('role', 'is_verified', 'trust_score', 'latitude', 'longitude', 'restaurant_license', 'ngo_registration', 'institution_name')}),
     )
 
-class VolunteerAdmin(admin.ModelAdmin):
+class VolunteerAdmin(LargeTableAdmin):
     list_display = ('volunteer_id', 'name', 'ngo', 'phone', 'email', 'status', 'date_joined')
-    list_filter = ('status', 'ngo')
+    list_filter = ('status', ('ngo', AutocompleteFilter))
+    list_select_related = ('ngo',)
+    raw_id_fields = ('ngo', 'user')
     search_fields = ('name', 'volunteer_id', 'email')
 
+class ImpactStatsAdmin(LargeTableAdmin):
+    list_display = ('user', 'kg_donated', 'kg_received', 'completed_pickups', 'active_volunteers', 'updated_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Volunteer, VolunteerAdmin)
+admin.site.register(ImpactStats, ImpactStatsAdmin)
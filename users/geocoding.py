@@ -0,0 +1,296 @@
+"""
+Server-side geocoding with a persistent cache and an offline gazetteer.
+
+``geocode(query)`` normalises the query (case, punctuation, spacing) and
+answers from, in order:
+
+1. an in-process LRU of recent answers (microseconds, no I/O);
+2. ``GeocodeCacheEntry``, the persistent cache shared by every process;
+3. the bundled gazetteer (``data/gazetteer.csv``) when the query names one
+   of its cities or localities exactly;
+4. the geocoding service at ``GEOCODING_URL`` (Nominatim), at most one
+   request per ``GEOCODING_MIN_INTERVAL`` seconds per process;
+5. the gazetteer again, matching any city or locality mentioned in the
+   query, when the service is disabled, fails or finds nothing.
+
+Answers from 3–5, including "not found", are stored in the persistent
+cache, except while the service is off or unreachable: those are only kept
+in memory, so the service is asked again later. The least recently used
+rows are evicted once the cache holds more than
+``GEOCODING_CACHE_MAX_ROWS``. ``last_used_at`` is only refreshed when it is
+older than ``TOUCH_AFTER``, so cache hits do not turn into writes.
+
+Registration only uses the caches and the gazetteer (``remote=False``);
+addresses they do not know are looked up by the ``geocode_user_address``
+job. ``geocode_missing_addresses`` fills in coordinates for users that
+have an address but none (see ``manage.py geocode_addresses``).
+"""
+import csv
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import GeocodeCacheEntry, User
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+MEMORY_CACHE_SIZE = 4096
+TOUCH_AFTER = timedelta(hours=1)
+NOT_FOUND_TTL = timedelta(days=1)  # retry the service for queries it could not answer
+MAX_QUERY_LENGTH = 255
+# Longest place name in the gazetteer, in words
+MAX_NAME_WORDS = 3
+
+
+@dataclass(frozen=True)
+class Geocode:
+    latitude: float | None
+    longitude: float | None
+    display_name: str
+    source: str
+
+    @property
+    def found(self):
+        return self.latitude is not None
+
+    def as_dict(self):
+        return {
+            'lat': self.latitude,
+            'lon': self.longitude,
+            'display_name': self.display_name,
+            'source': self.source,
+        }
+
+
+NOT_FOUND = Geocode(None, None, '', 'none')
+
+
+def normalise(query):
+    """Lower-cased, accent-folded query with punctuation reduced to single spaces and commas."""
+    query = unicodedata.normalize('NFKD', query or '')
+    query = ''.join(ch for ch in query if not unicodedata.combining(ch)).casefold()
+    query = re.sub(r'[^\w,]+', ' ', query)
+    parts = [' '.join(part.split()) for part in query.split(',')]
+    return ', '.join(part for part in parts if part)[:MAX_QUERY_LENGTH]
+
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class Gazetteer:
+    """Cities and localities from the bundled CSV, looked up by normalised name or alias."""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                name = row['name']
+                display = f"{name}, {row['city']}" if row['city'] else name
+                place = (row['kind'], Geocode(float(row['latitude']), float(row['longitude']), display, 'gazetteer'))
+                for key in [name, *filter(None, row['aliases'].split('|'))]:
+                    self.places[normalise(key)] = place
+
+    def __len__(self):
+        return len(self.places)
+
+    def exact(self, query):
+        place = self.places.get(query)
+        return place[1] if place else None
+
+    def search(self, query):
+        """The most specific place named anywhere in ``query``: a locality before a city, earlier before later."""
+        words = query.replace(',', ' ').split()
+        best = None
+        for start in range(len(words)):
+            for length in range(min(MAX_NAME_WORDS, len(words) - start), 0, -1):
+                place = self.places.get(' '.join(words[start:start + length]))
+                if place and (best is None or (place[0] == 'locality' and best[0] != 'locality')):
+                    best = place
+                    break
+        return best[1] if best else None
+
+
+_memory = LRUCache(MEMORY_CACHE_SIZE)
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+_remote_lock = threading.Lock()
+_next_remote_slot = 0.0  # monotonic time the next service request may start
+_stores = 0
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer()
+    return _gazetteer
+
+
+def _remote_lookup(query):
+    """Ask the geocoding service. Returns a ``Geocode`` (possibly ``NOT_FOUND``), or None if it failed."""
+    global _next_remote_slot
+    url = settings.GEOCODING_URL
+    if not url:
+        return None
+    import requests
+
+    # Reserve the next free slot, then wait and call outside the lock, so
+    # that one slow lookup does not hold up the other threads' bookkeeping
+    with _remote_lock:
+        now = time.monotonic()
+        slot = max(now, _next_remote_slot)
+        _next_remote_slot = slot + settings.GEOCODING_MIN_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
+    try:
+        response = requests.get(
+            url,
+            params={'q': query, 'format': 'jsonv2', 'limit': 1},
+            headers={'User-Agent': settings.GEOCODING_USER_AGENT},
+            timeout=settings.GEOCODING_TIMEOUT,
+        )
+        response.raise_for_status()
+        results = response.json()
+    except (requests.RequestException, ValueError):
+        logger.warning("Geocoding service lookup failed for %r", query, exc_info=True)
+        return None
+    if not results:
+        return NOT_FOUND
+    first = results[0]
+    return Geocode(float(first['lat']), float(first['lon']), first.get('display_name', '')[:255], 'remote')
+
+
+def _store(query, result):
+    global _stores
+    now = timezone.now()
+    GeocodeCacheEntry.objects.update_or_create(
+        query=query,
+        defaults={
+            'latitude': result.latitude, 'longitude': result.longitude,
+            'display_name': result.display_name, 'source': result.source, 'last_used_at': now,
+        },
+    )
+    _stores += 1
+    if _stores % 100 == 0:
+        evict()
+
+
+def evict(max_rows=None):
+    """Delete the least recently used cache rows beyond ``max_rows`` (``GEOCODING_CACHE_MAX_ROWS``)."""
+    max_rows = settings.GEOCODING_CACHE_MAX_ROWS if max_rows is None else max_rows
+    excess = GeocodeCacheEntry.objects.count() - max_rows
+    if excess <= 0:
+        return 0
+    oldest = GeocodeCacheEntry.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess]
+    return GeocodeCacheEntry.objects.filter(pk__in=list(oldest)).delete()[0]
+
+
+def _from_db(query):
+    entry = GeocodeCacheEntry.objects.filter(pk=query).first()
+    if entry is None:
+        return None
+    now = timezone.now()
+    if entry.source == 'none' and now - entry.last_used_at > NOT_FOUND_TTL:
+        return None
+    if now - entry.last_used_at > TOUCH_AFTER:
+        GeocodeCacheEntry.objects.filter(pk=query).update(last_used_at=now)
+    return Geocode(entry.latitude, entry.longitude, entry.display_name, entry.source)
+
+
+def geocode(query, remote=True):
+    """
+    Coordinates for a free-text place or address; ``NOT_FOUND`` if nothing
+    matches. ``remote=False`` never calls the geocoding service.
+    """
+    query = normalise(query)
+    if not query:
+        return NOT_FOUND
+    cached = _memory.get(query)
+    if cached is not None:
+        result, touched = cached
+        if time.monotonic() - touched < TOUCH_AFTER.total_seconds():
+            return result
+    result = _from_db(query)
+    if result is None:
+        gazetteer = get_gazetteer()
+        result = gazetteer.exact(query)
+        if result is None:
+            if not remote:
+                # Not remembered: a later call that may ask the service should
+                return gazetteer.search(query) or NOT_FOUND
+            answer = _remote_lookup(query)
+            result = answer if answer is not None and answer.found else gazetteer.search(query) or NOT_FOUND
+            if answer is not None:
+                _store(query, result)
+            # else: the service is off or failing; answer now and ask it again once this leaves memory
+        else:
+            _store(query, result)
+    _memory.set(query, (result, time.monotonic()))
+    return result
+
+
+def needs_coordinates():
+    """Users with an address but no usable coordinates (registration stores 0, 0 when none were picked)."""
+    return User.objects.exclude(address='').filter(
+        Q(latitude__isnull=True) | Q(longitude__isnull=True) | Q(latitude=0, longitude=0)
+    )
+
+
+def geocode_missing_addresses(limit=None, remote=True, progress=None):
+    """
+    Fill in coordinates for ``needs_coordinates()`` users, geocoding each
+    distinct address once. Returns ``(updated, not_found)`` user counts.
+    """
+    users = needs_coordinates().order_by('pk').only('pk', 'address')
+    if limit:
+        users = users[:limit]
+    by_query = {}
+    for user in users.iterator(chunk_size=2000):
+        by_query.setdefault(normalise(user.address), []).append(user)
+    updated = not_found = 0
+    for done, (query, group) in enumerate(by_query.items(), 1):
+        result = geocode(query, remote=remote)
+        if result.found:
+            for user in group:
+                user.latitude, user.longitude = result.latitude, result.longitude
+            User.objects.bulk_update(group, ['latitude', 'longitude'], batch_size=500)
+            updated += len(group)
+        else:
+            not_found += len(group)
+        if progress:
+            progress(done, len(by_query))
+    return updated, not_found
@@ -0,0 +1,105 @@
+"""
+Incremental maintenance of ``ImpactStats`` counters.
+
+Views call these helpers at the moment a claim or pickup changes state, so
+profile pages never aggregate history. ``rebuild_all`` recomputes every row
+from scratch for backfills and repairs.
+"""
+from collections import defaultdict
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import ImpactStats, Volunteer
+
+
+def _bump(user_id, **deltas):
+    """Atomically add ``deltas`` to a user's counters, creating the row if needed."""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if not ImpactStats.objects.filter(pk=user_id).update(**updates):
+        ImpactStats.objects.get_or_create(user_id=user_id)
+        ImpactStats.objects.filter(pk=user_id).update(**updates)
+
+
+def record_delivery(claim):
+    """A claim reached 'completed': credit the NGO and the donor."""
+    listing = claim.listing
+    kg = claim.claimed_kg
+    _bump(claim.claimant_id, kg_received=kg, completed_pickups=1)
+    _bump(listing.donor_id, kg_donated=kg, completed_pickups=1)
+
+
+def record_pickup_verified(assignment, pickup_otp):
+    """OTP verified: add the assignment → pickup duration to both parties' averages."""
+    seconds = max((pickup_otp.verified_at - assignment.assigned_at).total_seconds(), 0)
+    claim = assignment.claim
+    for user_id in (claim.claimant_id, claim.listing.donor_id):
+        _bump(user_id, pickup_seconds_total=seconds, timed_pickups=1)
+
+
+def refresh_volunteer_count(ngo_id, create=True):
+    """
+    Re-count an NGO's active volunteers (an indexed count on one NGO).
+
+    Deletions pass ``create=False``: they may be part of the NGO itself being
+    deleted, and must not resurrect its stats row.
+    """
+    active = Volunteer.objects.filter(ngo_id=ngo_id, status='active').count()
+    if create:
+        ImpactStats.objects.update_or_create(user_id=ngo_id, defaults={'active_volunteers': active})
+    else:
+        ImpactStats.objects.filter(pk=ngo_id).update(active_volunteers=active)
+
+
+def rebuild_all():
+    """Recompute every user's counters from claim, pickup and volunteer history."""
+    from listings.models import ArchivedClaim, ArchivedPickupAssignment, Claim, PickupOTP
+
+    stats = defaultdict(lambda: defaultdict(float))
+
+    # Live and archived claims (see listings.archive) share the lookups used here
+    for claims in (Claim.objects, ArchivedClaim.objects):
+        completed = claims.filter(status='completed')
+        claimed_kg = Sum(Coalesce('quantity_kg', 'listing__quantity_kg'))
+        for row in completed.values('claimant_id').annotate(kg=claimed_kg, n=Count('id')):
+            stats[row['claimant_id']]['kg_received'] += row['kg'] or 0
+            stats[row['claimant_id']]['completed_pickups'] += row['n']
+        for row in completed.values('listing__donor_id').annotate(kg=claimed_kg, n=Count('id')):
+            stats[row['listing__donor_id']]['kg_donated'] += row['kg'] or 0
+            stats[row['listing__donor_id']]['completed_pickups'] += row['n']
+
+    verified = PickupOTP.objects.filter(is_verified=True, verified_at__isnull=False).values_list(
+        'verified_at', 'assignment__assigned_at', 'assignment__claim__claimant_id',
+        'assignment__claim__listing__donor_id',
+    )
+    archived = ArchivedPickupAssignment.objects.filter(otp_verified_at__isnull=False).values_list(
+        'otp_verified_at', 'assigned_at', 'claim__claimant_id', 'claim__listing__donor_id',
+    )
+    for verified_at, assigned_at, claimant_id, donor_id in chain(verified.iterator(), archived.iterator()):
+        seconds = max((verified_at - assigned_at).total_seconds(), 0)
+        for user_id in (claimant_id, donor_id):
+            stats[user_id]['pickup_seconds_total'] += seconds
+            stats[user_id]['timed_pickups'] += 1
+
+    active = Volunteer.objects.filter(status='active').values('ngo_id').annotate(n=Count('id'))
+    for row in active:
+        stats[row['ngo_id']]['active_volunteers'] = row['n']
+
+    rows = [
+        ImpactStats(
+            user_id=user_id,
+            kg_donated=values['kg_donated'],
+            kg_received=values['kg_received'],
+            completed_pickups=int(values['completed_pickups']),
+            active_volunteers=int(values['active_volunteers']),
+            pickup_seconds_total=values['pickup_seconds_total'],
+            timed_pickups=int(values['timed_pickups']),
+        )
+        for user_id, values in stats.items()
+    ]
+    with transaction.atomic():
+        ImpactStats.objects.all().delete()
+        ImpactStats.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
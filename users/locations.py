@@ -0,0 +1,205 @@
+"""
+Live volunteer positions during pickups.
+
+Pings from volunteers' phones only touch memory: ``record`` keeps the
+latest position per volunteer in a buffer, and a background thread writes
+the buffer to ``VolunteerLocation`` every ``LOCATION_FLUSH_SECONDS`` as one
+bulk upsert, which never replaces a newer stored position. However often a
+volunteer pings, that is at most one row write per volunteer per interval,
+and the table holds one row per volunteer.
+
+``latest_positions`` is the read path for the donor and claimant
+dashboards: the stored rows, overlaid with this process's unflushed pings.
+"""
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .models import Volunteer, VolunteerLocation
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_PICKUP_STATUSES = ('assigned', 'picked_up')
+# How long a volunteer's "has an active pickup" check is trusted before asking the DB again
+ACTIVE_CHECK_SECONDS = 30
+
+# Columns of the upsert in ``write``; the conflict target comes first
+UPSERT_FIELDS = ('volunteer', 'latitude', 'longitude', 'accuracy', 'recorded_at')
+
+
+@dataclass(frozen=True)
+class Position:
+    latitude: float
+    longitude: float
+    accuracy: float | None
+    recorded_at: datetime
+
+    def as_dict(self):
+        return {
+            'lat': self.latitude,
+            'lng': self.longitude,
+            'accuracy': self.accuracy,
+            'recorded_at': self.recorded_at.isoformat(),
+        }
+
+
+class PingBuffer:
+    """Latest position per volunteer since the last drain."""
+
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, volunteer_id, position):
+        with self._lock:
+            current = self._positions.get(volunteer_id)
+            if current is None or current.recorded_at <= position.recorded_at:
+                self._positions[volunteer_id] = position
+
+    def drain(self):
+        with self._lock:
+            positions, self._positions = self._positions, {}
+        return positions
+
+    def restore(self, positions):
+        """Put back drained positions that were not written, unless newer ones arrived meanwhile."""
+        for volunteer_id, position in positions.items():
+            with self._lock:
+                self._positions.setdefault(volunteer_id, position)
+
+    def pending(self, volunteer_ids):
+        with self._lock:
+            return {pk: self._positions[pk] for pk in volunteer_ids if pk in self._positions}
+
+
+_buffer = PingBuffer()
+_flusher = None
+_flusher_lock = threading.Lock()
+_active = {}  # user id -> (volunteer id, checked at)
+
+
+def write(positions):
+    """
+    Upsert ``{volunteer_id: Position}`` into ``VolunteerLocation``, in one
+    statement per batch. A stored row is only replaced by a newer position,
+    so a flush from a process holding an older ping never moves it back.
+    """
+    if not positions:
+        return 0
+    table = connection.ops.quote_name(VolunteerLocation._meta.db_table)
+    columns = [VolunteerLocation._meta.get_field(name) for name in UPSERT_FIELDS]
+    names = [connection.ops.quote_name(field.column) for field in columns]
+    recorded_at = names[-1]
+    rows = [
+        (volunteer_id, p.latitude, p.longitude, p.accuracy, connection.ops.adapt_datetimefield_value(p.recorded_at))
+        for volunteer_id, p in positions.items()
+    ]
+    batch_size = connection.ops.bulk_batch_size(columns, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES "
+                + ', '.join([f"({', '.join(['%s'] * len(names))})"] * len(batch))
+                + f" ON CONFLICT ({names[0]}) DO UPDATE SET "
+                + ', '.join(f"{name} = excluded.{name}" for name in names[1:])
+                + f" WHERE excluded.{recorded_at} > {table}.{recorded_at}",
+                [value for row in batch for value in row],
+            )
+    return len(positions)
+
+
+def flush():
+    """Write the buffered positions now. Returns how many rows were written."""
+    positions = _buffer.drain()
+    try:
+        return write(positions)
+    except Exception:
+        _buffer.restore(positions)
+        raise
+
+
+def _flush_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Flushing %d volunteer positions failed", len(_buffer))
+            close_old_connections()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                interval = settings.LOCATION_FLUSH_SECONDS
+                _flusher = threading.Thread(
+                    target=_flush_forever, args=(interval,), name='location-flusher', daemon=True
+                )
+                _flusher.start()
+                atexit.register(flush)
+
+
+def record(volunteer_id, latitude, longitude, accuracy=None, recorded_at=None):
+    """Buffer a position; it reaches the database with the next flush."""
+    _ensure_flusher()
+    _buffer.add(volunteer_id, Position(latitude, longitude, accuracy, recorded_at or timezone.now()))
+
+
+def active_volunteer_id(user):
+    """
+    The ``Volunteer`` id of ``user`` if they have a pickup in progress, else
+    None. Positive answers are cached in-process for ``ACTIVE_CHECK_SECONDS``,
+    and ``forget`` only clears this process's entry.
+    """
+    cached = _active.get(user.pk)
+    now = time.monotonic()
+    if cached and now - cached[1] < ACTIVE_CHECK_SECONDS:
+        return cached[0]
+    volunteer_id = (
+        Volunteer.objects.filter(user=user, pickup_assignments__status__in=ACTIVE_PICKUP_STATUSES)
+        .values_list('pk', flat=True).first()
+    )
+    if volunteer_id is None:
+        _active.pop(user.pk, None)
+    else:
+        _active[user.pk] = (volunteer_id, now)
+    return volunteer_id
+
+
+def forget(user_id):
+    """
+    Drop the cached active-pickup check for ``user_id`` (a pickup was finished
+    or reassigned). This is per process: other workers keep accepting that
+    volunteer's pings until their own entry is ``ACTIVE_CHECK_SECONDS`` old,
+    which at worst stores a position a little longer than needed.
+    """
+    _active.pop(user_id, None)
+
+
+def latest_positions(volunteer_ids):
+    """``{volunteer_id: Position}`` for the volunteers that have reported one."""
+    volunteer_ids = set(volunteer_ids)
+    if not volunteer_ids:
+        return {}
+    positions = {
+        row.volunteer_id: Position(row.latitude, row.longitude, row.accuracy, row.recorded_at)
+        for row in VolunteerLocation.objects.filter(volunteer_id__in=volunteer_ids)
+    }
+    for volunteer_id, position in _buffer.pending(volunteer_ids).items():
+        stored = positions.get(volunteer_id)
+        if stored is None or stored.recorded_at <= position.recorded_at:
+            positions[volunteer_id] = position
+    return positions
@@ -0,0 +1,45 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodsaver.benchmarking import scratch_database, summary_ms, timings
+from users import directory
+from users.models import User
+
+WORDS = (
+    'annapurna akshaya seva trust foundation food bank relief society care hope roti ghar '
+    'helping hands community kitchen mission sewa samiti youth forum'
+).split()
+PREFIXES = ('a', 'an', 'seva', 'food ba', 'ngo123', 'zzz')
+
+
+class Command(BaseCommand):
+    help = (
+        "Time NGO directory type-ahead (users.directory) against a throwaway database seeded "
+        "with --ngos claimants: lookups, including the generation check, and a full rebuild."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ngos', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=200, help="Lookups timed per prefix.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(27)
+        with scratch_database():
+            User.objects.bulk_create(
+                [
+                    User(username=f'ngo{n}', role='claimant',
+                         institution_name=' '.join(rng.choices(WORDS, k=3)).title())
+                    for n in range(options['ngos'])
+                ],
+                batch_size=5000,
+            )
+            directory.invalidate()
+            start = time.perf_counter()
+            directory.get_index()
+            self.stdout.write(f"{'rebuild':24} {(time.perf_counter() - start) * 1000:8.2f} ms")
+            for prefix in PREFIXES:
+                ordered = timings(lambda: directory.get_index().lookup(prefix), options['repeat'])
+                self.stdout.write(f"lookup {prefix!r:17} {summary_ms(ordered)}")
+        directory._index = None
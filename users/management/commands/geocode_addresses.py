@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from users import geocoding
+
+
+class Command(BaseCommand):
+    help = "Look up coordinates for users that have an address but no location, each distinct address once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Only process this many users.")
+        parser.add_argument('--offline', action='store_true', help="Use only the cache and the bundled gazetteer.")
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity > 1 and (done % 100 == 0 or done == total):
+                self.stdout.write(f"  {done}/{total} addresses")
+
+        updated, not_found = geocoding.geocode_missing_addresses(
+            limit=options['limit'], remote=not options['offline'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Located {updated} users; {not_found} addresses could not be found."))
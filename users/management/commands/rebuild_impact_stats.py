@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.impact import rebuild_all
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's impact counters from claim, pickup and volunteer history."
+
+    def handle(self, *args, **options):
+        count = rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt impact stats for {count} users."))
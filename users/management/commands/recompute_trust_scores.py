@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.trust import recompute_all
+
+
+class Command(BaseCommand):
+    help = "Rescore every user's trust score from claim, listing and OTP history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = recompute_all(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rescored {count} users in {elapsed:.2f}s."))
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_volunteer_user_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpactStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='impact', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('kg_donated', models.FloatField(default=0)),
+                ('kg_received', models.FloatField(default=0)),
+                ('completed_pickups', models.PositiveIntegerField(default=0)),
+                ('active_volunteers', models.PositiveIntegerField(default=0)),
+                ('pickup_seconds_total', models.FloatField(default=0)),
+                ('timed_pickups', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Impact stats',
+                'verbose_name_plural': 'Impact stats',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_impactstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='trust_negative',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='trust_positive',
+            field=models.FloatField(default=0),
+        ),
+    ]
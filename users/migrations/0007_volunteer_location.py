@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_trust_evidence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VolunteerLocation',
+            fields=[
+                ('volunteer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='location', serialize=False, to='users.volunteer')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('accuracy', models.FloatField(blank=True, help_text='Metres, as reported by the device', null=True)),
+                ('recorded_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_geocode_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryGeneration',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(default=1, primary_key=True, serialize=False)),
+                ('generation', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
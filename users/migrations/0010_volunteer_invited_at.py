@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_directory_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='volunteer',
+            name='invited_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -23,8 +23,10 @@ class User(AbstractUser):
     # Institutional details
     institution_name = models.CharField(max_length=100, blank=True)
 
-    # Trust Score
+    # Trust Score (maintained by users.trust from weighted event evidence)
     trust_score = models.FloatField(default=5.0)
+    trust_positive = models.FloatField(default=0)
+    trust_negative = models.FloatField(default=0)
 
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
@@ -45,6 +47,9 @@ class Volunteer(models.Model):
     address = models.TextField(blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
     date_joined = models.DateField(auto_now_add=True)
+    # Set once the invitation email with the login has gone out, so a
+    # re-run of the job never resets the password that was sent
+    invited_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.volunteer_id:
@@ -55,3 +60,110 @@ class Volunteer(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.volunteer_id})"
+
+
+class ImpactStats(models.Model):
+    """
+    Precomputed per-user impact counters shown on public profiles.
+
+    Kept current by ``users.impact`` as claims, pickups and volunteers
+    change, and rebuilt from history with ``manage.py rebuild_impact_stats``.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='impact')
+    kg_donated = models.FloatField(default=0)
+    kg_received = models.FloatField(default=0)
+    completed_pickups = models.PositiveIntegerField(default=0)
+    active_volunteers = models.PositiveIntegerField(default=0)
+    # Sum/count of assignment → OTP-verified pickup durations, for the average
+    pickup_seconds_total = models.FloatField(default=0)
+    timed_pickups = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Impact stats'
+        verbose_name_plural = 'Impact stats'
+
+    @property
+    def total_kg(self):
+        return self.kg_donated + self.kg_received
+
+    @property
+    def meals_served(self):
+        # Same conversion the analytics dashboards use (≈3 meals per kg)
+        return int(self.total_kg * 3)
+
+    @property
+    def avg_pickup_minutes(self):
+        if not self.timed_pickups:
+            return None
+        return round(self.pickup_seconds_total / self.timed_pickups / 60)
+
+    def badges(self, is_verified=False):
+        badges = []
+        if is_verified:
+            badges.append('Verified')
+        if self.completed_pickups >= 50:
+            badges.append('Top Rated')
+        elif self.completed_pickups >= 10:
+            badges.append('Reliable Partner')
+        if self.total_kg >= 1000:
+            badges.append('1 Tonne Club')
+        avg = self.avg_pickup_minutes
+        if avg is not None and self.timed_pickups >= 5 and avg <= 30:
+            badges.append('Rapid Pickup')
+        return badges
+
+    def __str__(self):
+        return f"Impact for user #{self.user_id}"
+
+
+class VolunteerLocation(models.Model):
+    """
+    Latest reported position of a volunteer, one row per volunteer.
+
+    Written in coalesced batches by ``users.locations``; older positions are
+    overwritten rather than kept.
+    """
+    volunteer = models.OneToOneField(Volunteer, on_delete=models.CASCADE, primary_key=True, related_name='location')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    accuracy = models.FloatField(null=True, blank=True, help_text="Metres, as reported by the device")
+    recorded_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Location of volunteer #{self.volunteer_id}"
+
+
+class GeocodeCacheEntry(models.Model):
+    """Persistent geocoding cache keyed by the normalised query (see ``users.geocoding``)."""
+    SOURCE_CHOICES = (
+        ('remote', 'Geocoding service'),
+        ('gazetteer', 'Offline gazetteer'),
+        ('none', 'Not found'),
+    )
+
+    query = models.CharField(max_length=255, primary_key=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    display_name = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'Geocode cache entries'
+
+    def __str__(self):
+        return self.query
+
+
+class DirectoryGeneration(models.Model):
+    """
+    Single-row counter bumped whenever users change, so every process can
+    tell its in-memory NGO prefix index is stale (see ``users.directory``).
+    """
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    generation = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Directory generation {self.generation}"
@@ -0,0 +1,41 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import User, Volunteer
+from . import directory, impact
+
+
+@receiver(post_save, sender=User)
+def invalidate_directory_on_save(sender, instance, update_fields=None, **kwargs):
+    """Drop the NGO prefix index when a user changes (logins only touch last_login)."""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    directory.invalidate()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_directory_on_delete(sender, instance, **kwargs):
+    directory.invalidate()
+
+
+@receiver(pre_save, sender=Volunteer)
+def remember_volunteer_ngo(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note the NGO a volunteer is saved away from, so both NGOs are re-counted."""
+    instance._previous_ngo_id = None
+    if raw or instance.pk is None or (update_fields is not None and not {'ngo', 'ngo_id'} & set(update_fields)):
+        return
+    instance._previous_ngo_id = Volunteer.objects.filter(pk=instance.pk).values_list('ngo_id', flat=True).first()
+
+
+@receiver(post_save, sender=Volunteer)
+def refresh_impact_on_volunteer_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    impact.refresh_volunteer_count(instance.ngo_id)
+    previous = getattr(instance, '_previous_ngo_id', None)
+    if previous is not None and previous != instance.ngo_id:
+        impact.refresh_volunteer_count(previous)
+
+
+@receiver(post_delete, sender=Volunteer)
+def refresh_impact_on_volunteer_delete(sender, instance, **kwargs):
+    impact.refresh_volunteer_count(instance.ngo_id, create=False)
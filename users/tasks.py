@@ -0,0 +1,71 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from foodsaver import metrics
+from jobs.queue import task
+
+from . import geocoding
+from .models import User, Volunteer
+
+logger = logging.getLogger(__name__)
+
+
+@task
+def send_volunteer_invitation(volunteer_id):
+    """
+    Email a new volunteer their login. The password is set here rather than
+    passed in, so it is never stored in the job table. The invitation is
+    claimed with ``invited_at`` first: once it has gone out, a re-run does
+    nothing, and only a failed send is retried (with a new password, as the
+    old one never arrived).
+    """
+    from .views import _generate_password
+
+    volunteer = Volunteer.objects.select_related('user', 'ngo').filter(pk=volunteer_id).first()
+    if volunteer is None or volunteer.user is None or not volunteer.user.email:
+        return
+    if not Volunteer.objects.filter(pk=volunteer_id, invited_at__isnull=True).update(invited_at=timezone.now()):
+        return
+    user, ngo = volunteer.user, volunteer.ngo
+    raw_password = _generate_password()
+    user.set_password(raw_password)
+    user.save(update_fields=['password'])
+
+    ngo_name = ngo.institution_name or ngo.username
+    subject = f"Welcome to Food Saver — You've been invited by {ngo_name}"
+    message = (
+        f"Hello {volunteer.name},\n\n"
+        f"You have been added as a volunteer by {ngo_name} on Food Saver.\n\n"
+        f"Here are your login credentials:\n"
+        f"  Portal: http://localhost:8000/users/volunteer/login/\n"
+        f"  Username: {user.username}\n"
+        f"  Password: {raw_password}\n\n"
+        f"Your Volunteer ID: {volunteer.volunteer_id}\n\n"
+        f"Please log in and change your password at your earliest convenience.\n\n"
+        f"Together, let's end hunger!\n"
+        f"— Food Saver Team"
+    )
+    start, outcome = time.perf_counter(), 'error'
+    try:
+        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+        outcome = 'sent'
+    except Exception:
+        Volunteer.objects.filter(pk=volunteer_id).update(invited_at=None)
+        raise
+    finally:
+        metrics.EMAIL_SEND_DURATION.labels(outcome).observe(time.perf_counter() - start)
+
+
+@task
+def geocode_user_address(user_id):
+    """Look up a newly registered user's address with the geocoding service, off the request path."""
+    user = geocoding.needs_coordinates().filter(pk=user_id).only('pk', 'address').first()
+    if user is None:
+        return
+    place = geocoding.geocode(user.address)
+    if place.found:
+        User.objects.filter(pk=user_id).update(latitude=place.latitude, longitude=place.longitude)
@@ -1,3 +1,478 @@
-from django.test import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.worker import Worker
+from listings.models import Claim, Listing, PickupAssignment
+from listings.tasks import expire_overdue_listings
+
+from . import directory, geocoding, locations, tasks, trust
+from .models import GeocodeCacheEntry, ImpactStats, User, Volunteer, VolunteerLocation
+
+
+# The suite never runs collectstatic, so there is no manifest to look up the admin's {% static %} names in
+SOURCE_STATIC_FILES = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+
+@override_settings(STORAGES=SOURCE_STATIC_FILES)
+class AdminChangelistQueryTests(TestCase):
+    """Each changelist runs a fixed number of queries however many rows it shows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            ngo = User.objects.create(username=f'ngo{self.rows}', role='claimant')
+            Volunteer.objects.create(ngo=ngo, name=f'Volunteer {self.rows}')
+            ImpactStats.objects.get_or_create(user=ngo)
+
+    def queries(self, model, **params):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, model, expected, **params):
+        self.add_rows(2)
+        self.assertEqual(self.queries(model, **params), expected)
+        self.add_rows(10)
+        self.assertEqual(self.queries(model, **params), expected)
+
+    def test_user_changelist(self):
+        self.assert_constant_queries(User, 5)
+
+    def test_volunteer_changelist(self):
+        self.assert_constant_queries(Volunteer, 5)
+
+    def test_impact_stats_changelist(self):
+        self.assert_constant_queries(ImpactStats, 5)
+
+
+class NGODirectoryIndexTests(TestCase):
+    def setUp(self):
+        directory._index = None
+        self.addCleanup(setattr, directory, '_index', None)
+        User.objects.create(username='annapurna', role='claimant', institution_name='Annapurna Trust')
+
+    def names(self, prefix):
+        return [row['username'] for row in directory.get_index().lookup(prefix)]
+
+    def test_index_is_reused_until_users_change(self):
+        with mock.patch.object(directory, 'build_index', wraps=directory.build_index) as build:
+            self.assertEqual(self.names('anna'), ['annapurna'])
+            with self.assertNumQueries(1):  # just the generation
+                self.assertEqual(self.names('trust'), ['annapurna'])
+            self.assertEqual(build.call_count, 1)
+            User.objects.create(username='akshaya', role='claimant')
+            self.assertEqual(self.names('a'), ['akshaya', 'annapurna'])
+            self.assertEqual(build.call_count, 2)
+
+    def test_change_made_by_another_process_is_seen(self):
+        self.assertEqual(self.names('a'), ['annapurna'])
+        # Another process: rows written and the generation bumped, this process's index untouched
+        User.objects.bulk_create([User(username='akshaya', role='claimant')])
+        stale = directory._index
+        directory.invalidate()
+        self.assertIs(directory._index, stale)
+        self.assertEqual(self.names('a'), ['akshaya', 'annapurna'])
+
+    def test_change_during_a_rebuild_is_not_lost(self):
+        build = directory.build_index
+
+        def slow_build():
+            index = build()
+            User.objects.create(username='akshaya', role='claimant')  # lands after the rows were read
+            return index
+
+        with mock.patch.object(directory, 'build_index', slow_build):
+            self.assertEqual(self.names('a'), ['annapurna'])
+        self.assertEqual(self.names('a'), ['akshaya', 'annapurna'])
+
+
+class VolunteerImpactTests(TestCase):
+    def test_moving_a_volunteer_recounts_both_ngos(self):
+        first = User.objects.create(username='first', role='claimant')
+        second = User.objects.create(username='second', role='claimant')
+        volunteer = Volunteer.objects.create(ngo=first, name='Ravi')
+        self.assertEqual(ImpactStats.objects.get(pk=first.pk).active_volunteers, 1)
+
+        volunteer.ngo = second
+        volunteer.save()
+        self.assertEqual(ImpactStats.objects.get(pk=first.pk).active_volunteers, 0)
+        self.assertEqual(ImpactStats.objects.get(pk=second.pk).active_volunteers, 1)
+
+        volunteer.ngo = first
+        volunteer.save(update_fields=['ngo'])
+        self.assertEqual(ImpactStats.objects.get(pk=first.pk).active_volunteers, 1)
+        self.assertEqual(ImpactStats.objects.get(pk=second.pk).active_volunteers, 0)
+
+
+class VolunteerInvitationTests(TestCase):
+    def setUp(self):
+        self.ngo = User.objects.create(username='ngo', role='claimant', institution_name='Annadana')
+        self.client.force_login(self.ngo)
+
+    def invite(self):
+        self.client.post(reverse('add_volunteer'), {'name': 'Ravi', 'email': 'ravi@example.org'})
+        return Volunteer.objects.select_related('user').get(name='Ravi')
+
+    def run_jobs(self):
+        worker = Worker()
+        worker.process(worker.claim(), threading.Event())
+
+    def test_the_emailed_password_is_not_reset_by_a_rerun(self):
+        volunteer = self.invite()
+        self.run_jobs()
+        [message] = mail.outbox
+        password = message.body.split('Password: ')[1].split()[0]
+        self.assertIsNotNone(Volunteer.objects.get(pk=volunteer.pk).invited_at)
+
+        tasks.send_volunteer_invitation(volunteer.pk)
+        self.assertEqual(len(mail.outbox), 1)
+        volunteer.user.refresh_from_db()
+        self.assertTrue(volunteer.user.check_password(password))
+
+    def test_a_failed_send_is_retried(self):
+        volunteer = self.invite()
+        with mock.patch('users.tasks.send_mail', side_effect=OSError('SMTP down')), self.assertLogs('jobs.worker'):
+            self.run_jobs()
+        self.assertIsNone(Volunteer.objects.get(pk=volunteer.pk).invited_at)
+        self.assertEqual(Job.objects.get().attempts, 1)
+
+        Job.objects.update(run_at=timezone.now())
+        self.run_jobs()
+        [message] = mail.outbox
+        volunteer.user.refresh_from_db()
+        self.assertTrue(volunteer.user.check_password(message.body.split('Password: ')[1].split()[0]))
+
+
+class TrustTests(TestCase):
+    def setUp(self):
+        self.donor = User.objects.create(username='donor', role='donor')
+        self.ngo = User.objects.create(username='ngo', role='claimant')
+        self.volunteer_user = User.objects.create(username='asha', role='volunteer')
+        self.volunteer = Volunteer.objects.create(ngo=self.ngo, user=self.volunteer_user, name='Asha')
+
+    def claim(self, status='approved', hours=6):
+        listing = Listing.objects.create(
+            donor=self.donor, food_type='cooked', quantity_kg=10, description='Rice',
+            expiry_time=timezone.now() + timedelta(hours=hours),
+        )
+        return Claim.objects.create(listing=listing, claimant=self.ngo, status=status, quantity_kg=4)
+
+    def evidence(self, user):
+        user.refresh_from_db()
+        return user.trust_positive, user.trust_negative, user.trust_score
+
+    def verify(self, assignment):
+        self.client.force_login(self.volunteer_user)
+        url = reverse('verify_pickup_otp', args=[assignment.pk])
+        self.assertTrue(self.client.post(url, {'otp_code': assignment.otp.code}).json()['success'])
+
+    def test_each_event_moves_the_score_once(self):
+        on_time = PickupAssignment.objects.create(claim=self.claim(), volunteer=self.volunteer)
+        self.verify(on_time)
+        self.assertEqual(self.evidence(self.ngo), (0.5, 0, trust.score_for(0.5, 0)))
+
+        late = PickupAssignment.objects.create(claim=self.claim(), volunteer=self.volunteer)
+        PickupAssignment.objects.filter(pk=late.pk).update(assigned_at=timezone.now() - timedelta(hours=2))
+        self.verify(late)
+        self.assertEqual(self.evidence(self.ngo), (0.5, 0.5, trust.score_for(0.5, 0.5)))
+
+        self.client.post(reverse('update_pickup_status', args=[on_time.pk]), {'status': 'delivered'})
+        self.assertEqual(self.evidence(self.ngo), (1.5, 0.5, trust.score_for(1.5, 0.5)))
+        self.assertEqual(self.evidence(self.donor), (1, 0, trust.score_for(1, 0)))
+
+        pending = self.claim(status='pending')
+        self.client.force_login(self.donor)
+        for _ in range(2):  # a second click finds nothing open to reject
+            self.client.post(reverse('reject_claim', args=[pending.pk]))
+        self.assertEqual(self.evidence(self.ngo), (1.5, 0.75, trust.score_for(1.5, 0.75)))
+
+        overdue = self.claim(status='pending', hours=-1).listing
+        self.claim(status='pending', hours=-1)
+        expire_overdue_listings()
+        expire_overdue_listings()
+        self.assertEqual(Listing.objects.get(pk=overdue.pk).status, 'expired')
+        self.assertEqual(self.evidence(self.donor), (1, 1.0, trust.score_for(1, 1.0)))
+        self.assertEqual(self.evidence(self.ngo)[1], 0.75)  # its claims were rejected by the expiry, not the donor
+
+    def test_recompute_all_matches_the_incremental_scores(self):
+        self.test_each_event_moves_the_score_once()
+        incremental = [self.evidence(user) for user in (self.donor, self.ngo, self.volunteer_user)]
+        User.objects.update(trust_positive=0, trust_negative=0, trust_score=trust.MAX_SCORE)
+        self.assertEqual(trust.recompute_all(batch_size=2), 3)
+        self.assertEqual([self.evidence(user) for user in (self.donor, self.ngo, self.volunteer_user)], incremental)
+
+
+class VolunteerPortalTests(TestCase):
+    def setUp(self):
+        self.ngo = User.objects.create(username='ngo', role='claimant', institution_name='Annadana')
+        self.user = User.objects.create(username='asha', role='volunteer')
+        self.volunteer = Volunteer.objects.create(ngo=self.ngo, user=self.user, name='Asha')
+        donor = User.objects.create(username='donor', role='donor', institution_name='Hotel Annapurna')
+        listing = Listing.objects.create(
+            donor=donor, food_type='cooked', quantity_kg=10, description='Rice and dal',
+            expiry_time=timezone.now() + timedelta(hours=6),
+        )
+        claim = Claim.objects.create(listing=listing, claimant=self.ngo, status='approved', quantity_kg=4)
+        self.assignment = PickupAssignment.objects.create(claim=claim, volunteer=self.volunteer, notes='Ring twice')
+
+    def test_volunteer_dashboard(self):
+        url = reverse('volunteer_dashboard')
+        self.assertRedirects(self.client.get(url), f"{settings.LOGIN_URL}?next={url}", fetch_redirect_response=False)
+        self.client.force_login(self.ngo)
+        self.assertRedirects(self.client.get(url), reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['vol_id'], response.context['ngo_name']), (self.volunteer.volunteer_id, 'Annadana'))
+        self.assertEqual([a.id for a in response.context['active_list']], [self.assignment.pk])
+        self.assertEqual(response.context['completed_count'], 0)
+        for text in ('Rice and dal', 'from Hotel Annapurna', '4.0 kg', 'Note: Ring twice', f'otp-input-{self.assignment.pk}'):
+            self.assertContains(response, text)
+
+    def test_verify_pickup_otp(self):
+        url = reverse('verify_pickup_otp', args=[self.assignment.pk])
+        code = self.assignment.otp.code
+        self.assertRedirects(self.client.post(url, {'otp_code': code}), f"{settings.LOGIN_URL}?next={url}",
+                             fetch_redirect_response=False)
+        self.client.force_login(self.ngo)
+        self.assertEqual(self.client.post(url, {'otp_code': code}).status_code, 403)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url, {'otp_code': code}).status_code, 405)
+        wrong = self.client.post(url, {'otp_code': '000000' if code != '000000' else '111111'})
+        self.assertEqual((wrong.status_code, wrong.json()['success']), (400, False))
+        self.assertEqual(self.client.post(url, {'otp_code': code}).json(),
+                         {'success': True, 'message': 'OTP verified! Food marked as picked up.'})
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.status, 'picked_up')
+        self.assertEqual(self.client.post(url, {'otp_code': code}).status_code, 404)  # no longer assigned
+
+
+class TrustConcurrencyTests(TransactionTestCase):
+    def test_concurrent_events_never_lose_an_increment(self):
+        ngo = User.objects.create(username='ngo', role='claimant')
+        # As in listings.tests.ReservationTests: the threads write to a file
+        # copy of the in-memory test database, each on its own connection.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'trust.sqlite3')
+        with closing(sqlite3.connect(path)) as copy:
+            connection.connection.backup(copy)
+        barrier = threading.Barrier(40)
+
+        def event(n):
+            barrier.wait()
+            try:
+                trust._apply([ngo.pk], trust.COMPLETED_PICKUP if n % 2 else trust.REJECTED_CLAIM)
+            finally:
+                connections.close_all()
+
+        settings_dict = connection.settings_dict
+        original = settings_dict['NAME'], settings_dict['OPTIONS']
+        settings_dict['NAME'], settings_dict['OPTIONS'] = path, {**original[1], 'timeout': 60}
+        try:
+            threads = [threading.Thread(target=event, args=(n,)) for n in range(40)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            settings_dict['NAME'], settings_dict['OPTIONS'] = original
+
+        with closing(sqlite3.connect(path)) as copy:
+            row = copy.execute(
+                'SELECT trust_positive, trust_negative, trust_score FROM users_user WHERE id = ?', [ngo.pk],
+            ).fetchone()
+        self.assertEqual(row, (20.0, 5.0, trust.score_for(20, 5)))
+
+
+class VolunteerLocationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(locations, '_ensure_flusher')  # flushed by hand here
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        locations._buffer.drain()
+        self.addCleanup(locations._buffer.drain)
+        ngo = User.objects.create(username='ngo', role='claimant')
+        self.first, self.second, self.third = (
+            Volunteer.objects.create(ngo=ngo, name=f'Volunteer {n}').pk for n in range(3)
+        )
+        self.start = timezone.now()
+
+    def at(self, seconds):
+        return self.start + timedelta(seconds=seconds)
+
+    def stored(self):
+        return dict(VolunteerLocation.objects.values_list('volunteer_id', 'latitude'))
+
+    def test_pings_are_coalesced_into_one_upsert(self):
+        for n in range(20):
+            locations.record(self.first, 12.0 + n, 77.0, recorded_at=self.at(n))
+            locations.record(self.second, 13.0 + n, 77.0, recorded_at=self.at(n))
+        locations.record(self.first, 99.0, 77.0, recorded_at=self.at(-5))  # arrived late, older
+        with self.assertNumQueries(1):
+            self.assertEqual(locations.flush(), 2)
+        self.assertEqual(self.stored(), {self.first: 31.0, self.second: 32.0})
+
+        locations.record(self.first, 40.0, 77.0, recorded_at=self.at(30))
+        with self.assertNumQueries(1):
+            self.assertEqual(locations.flush(), 1)
+        self.assertEqual(self.stored(), {self.first: 40.0, self.second: 32.0})
+        self.assertEqual(locations.flush(), 0)
+
+    def test_flush_never_replaces_a_newer_stored_position(self):
+        locations.record(self.first, 12.0, 77.0, recorded_at=self.at(10))
+        locations.flush()
+        # An older ping flushed later, e.g. by another process
+        locations.record(self.first, 13.0, 77.0, recorded_at=self.at(5))
+        locations.record(self.second, 14.0, 77.0, recorded_at=self.at(5))
+        locations.record(self.third, 15.0, 77.0, recorded_at=self.at(5))
+        with mock.patch.object(connection.ops, 'bulk_batch_size', return_value=2), self.assertNumQueries(2):
+            self.assertEqual(locations.flush(), 3)
+        self.assertEqual(self.stored(), {self.first: 12.0, self.second: 14.0, self.third: 15.0})
+
+    def test_failed_flush_puts_pings_back(self):
+        locations.record(self.first, 12.0, 77.0, recorded_at=self.at(0))
+        locations.record(self.second, 13.0, 77.0, recorded_at=self.at(0))
+
+        def fail(positions):
+            locations.record(self.first, 14.0, 77.0, recorded_at=self.at(1))  # arrives during the write
+            raise RuntimeError("database is locked")
+
+        with mock.patch.object(locations, 'write', side_effect=fail):
+            with self.assertRaises(RuntimeError):
+                locations.flush()
+        self.assertEqual(self.stored(), {})
+        self.assertEqual(locations.flush(), 2)
+        self.assertEqual(self.stored(), {self.first: 14.0, self.second: 13.0})
+
+    def test_latest_positions_overlay_unflushed_pings(self):
+        locations.record(self.first, 12.0, 77.0, recorded_at=self.at(0))
+        locations.record(self.second, 13.0, 77.0, recorded_at=self.at(10))
+        locations.flush()
+        locations.record(self.first, 14.0, 77.0, recorded_at=self.at(20))  # newer than stored
+        locations._buffer.add(self.second, locations.Position(15.0, 77.0, None, self.at(5)))  # older
+        locations.record(self.third, 16.0, 77.0, recorded_at=self.at(0))  # never stored
+        positions = locations.latest_positions([self.first, self.second, self.third, self.third + 100])
+        self.assertEqual(
+            {pk: position.latitude for pk, position in positions.items()},
+            {self.first: 14.0, self.second: 13.0, self.third: 16.0},
+        )
+
+
+def _service_answer(*results):
+    response = mock.Mock()
+    response.json.return_value = list(results)
+    return response
+
+
+@override_settings(GEOCODING_URL='https://geocoder.test/search', GEOCODING_MIN_INTERVAL=0)
+class GeocodingTests(TestCase):
+    def setUp(self):
+        geocoding._memory.clear()
+        self.addCleanup(geocoding._memory.clear)
+
+    def service(self, *results, **kwargs):
+        return mock.patch('requests.get', return_value=_service_answer(*results), **kwargs)
+
+    def test_normalise(self):
+        self.assertEqual(geocoding.normalise('  KORAMANGALA ,, Bengaluru!! '), 'koramangala, bengaluru')
+        self.assertEqual(geocoding.normalise('São  Tomé'), 'sao tome')
+        self.assertEqual(geocoding.normalise(None), '')
+
+    def test_gazetteer_answers_exact_names_and_backs_up_the_service(self):
+        with self.service() as get:
+            self.assertEqual(geocoding.geocode('Bangalore').display_name, 'Bengaluru')
+            get.assert_not_called()
+        import requests
+        with mock.patch('requests.get', side_effect=requests.ConnectionError), self.assertLogs('users.geocoding'):
+            place = geocoding.geocode('12 Main Road, Koramangala, Bengaluru')
+        self.assertEqual(place.display_name, 'Koramangala, Bengaluru')
+        # The service was unreachable: remembered in memory only, asked again later
+        self.assertFalse(GeocodeCacheEntry.objects.filter(pk='12 main road, koramangala, bengaluru').exists())
+
+    def test_not_found_is_cached_for_a_day(self):
+        with self.service() as get:
+            self.assertFalse(geocoding.geocode('Nowhere Lane').found)
+            geocoding._memory.clear()
+            self.assertFalse(geocoding.geocode('Nowhere Lane').found)
+        self.assertEqual(get.call_count, 1)
+        GeocodeCacheEntry.objects.filter(pk='nowhere lane').update(
+            last_used_at=timezone.now() - geocoding.NOT_FOUND_TTL - timedelta(minutes=1)
+        )
+        geocoding._memory.clear()
+        with self.service({'lat': '1.5', 'lon': '2.5', 'display_name': 'Nowhere Lane'}) as get:
+            self.assertEqual(geocoding.geocode('Nowhere Lane').latitude, 1.5)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.get(pk='nowhere lane').source, 'remote')
+
+    def test_eviction_drops_least_recently_used(self):
+        now = timezone.now()
+        for n in range(5):
+            GeocodeCacheEntry.objects.create(query=f'place {n}', source='none', last_used_at=now - timedelta(hours=n))
+        self.assertEqual(geocoding.evict(max_rows=2), 3)
+        self.assertEqual(sorted(GeocodeCacheEntry.objects.values_list('pk', flat=True)), ['place 0', 'place 1'])
+
+    def test_lookups_wait_for_their_slot_but_not_for_each_other(self):
+        started = []
+        both_in_flight = threading.Barrier(2, timeout=5)
+
+        def slow_service(*args, **kwargs):
+            started.append(time.monotonic())
+            both_in_flight.wait()  # would time out if one lookup held the lock for the other's call
+            return _service_answer()
+
+        with override_settings(GEOCODING_MIN_INTERVAL=0.05), mock.patch('requests.get', side_effect=slow_service):
+            threads = [threading.Thread(target=geocoding._remote_lookup, args=(f'q{n}',)) for n in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertFalse(both_in_flight.broken)
+        self.assertGreaterEqual(abs(started[1] - started[0]), 0.04)
+
+    def test_registration_leaves_the_service_to_a_job(self):
+        form = {
+            'username': 'kitchen', 'email': 'kitchen@example.com', 'role': 'claimant',
+            'ngo_registration': '12345678901234', 'institution_name': 'Kitchen',
+            'address': '4 Unknown Street', 'password1': 'a-Long-pass-41', 'password2': 'a-Long-pass-41',
+        }
+        with self.service() as get:
+            self.assertEqual(self.client.post(reverse('register'), form).status_code, 302)
+        get.assert_not_called()
+        user = User.objects.get(username='kitchen')
+        self.assertIsNone(user.latitude)
+        self.assertEqual(Job.objects.get().unique_key, f'geocode-user:{user.pk}')
+
+        with self.service({'lat': '12.5', 'lon': '77.5', 'display_name': 'Unknown Street'}):
+            worker = Worker()
+            worker.process(worker.claim(), threading.Event())
+        user.refresh_from_db()
+        self.assertEqual((user.latitude, user.longitude), (12.5, 77.5))
@@ -0,0 +1,126 @@
+"""
+Event-driven trust scores for donors and NGOs.
+
+Each user carries two weighted evidence counters, ``trust_positive`` and
+``trust_negative``. The score is a smoothed success ratio on a 0–5 scale:
+
+    trust_score = 5 * (PRIOR + positive) / (PRIOR + positive + negative)
+
+so a new account starts at 5.0 and a handful of bad events cannot sink an
+otherwise reliable partner. Every event updates the counters and the score
+in a single ``UPDATE`` built from ``F()`` expressions, so concurrent events
+never lose an increment. ``recompute_all`` derives the same counters from
+history with a few grouped queries.
+"""
+from collections import defaultdict
+from itertools import chain
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Round
+
+from .models import User
+
+MAX_SCORE = 5.0
+PRIOR = 5.0
+
+# Event weights: (positive, negative)
+COMPLETED_PICKUP = (1.0, 0.0)   # donor and NGO, claim delivered
+REJECTED_CLAIM = (0.0, 0.25)    # NGO, claim turned down by the donor
+EXPIRED_LISTING = (0.0, 0.5)    # donor, listing expired unclaimed
+ON_TIME_PICKUP = (0.5, 0.0)     # NGO, OTP verified within the window
+LATE_PICKUP = (0.0, 0.5)        # NGO, OTP verified after the window
+
+ON_TIME_WINDOW = timedelta(hours=1)
+
+
+def score_for(positive, negative):
+    return round(MAX_SCORE * (PRIOR + positive) / (PRIOR + positive + negative), 2)
+
+
+def _apply(user_ids, weight, times=1):
+    """Add ``weight`` (``times`` over) to the users' counters and rescore them atomically."""
+    positive, negative = weight[0] * times, weight[1] * times
+    new_positive = F('trust_positive') + positive
+    new_negative = F('trust_negative') + negative
+    User.objects.filter(pk__in=user_ids).update(
+        trust_positive=new_positive,
+        trust_negative=new_negative,
+        trust_score=Round(MAX_SCORE * (PRIOR + new_positive) / (PRIOR + new_positive + new_negative), 2),
+    )
+
+
+def record_delivery(claim):
+    _apply([claim.claimant_id, claim.listing.donor_id], COMPLETED_PICKUP)
+
+
+def record_rejection(claim):
+    _apply([claim.claimant_id], REJECTED_CLAIM)
+
+
+def record_pickup_verified(assignment, pickup_otp):
+    on_time = pickup_otp.verified_at - assignment.assigned_at <= ON_TIME_WINDOW
+    _apply([assignment.claim.claimant_id], ON_TIME_PICKUP if on_time else LATE_PICKUP)
+
+
+def record_expiries(expired_per_donor):
+    """``expired_per_donor`` maps donor id → number of listings that just expired with no share claimed."""
+    for donor_id, count in expired_per_donor.items():
+        _apply([donor_id], EXPIRED_LISTING, times=count)
+
+
+def recompute_all(batch_size=1000):
+    """Rescore every user from claim, listing and OTP history. Returns users rescored."""
+    from listings.models import ArchivedClaim, ArchivedListing, ArchivedPickupAssignment, Claim, Listing, PickupOTP
+
+    evidence = defaultdict(lambda: [0.0, 0.0])
+
+    def add(rows, key, weight):
+        for row in rows:
+            totals = evidence[row[key]]
+            totals[0] += weight[0] * row['n']
+            totals[1] += weight[1] * row['n']
+
+    # Live and archived rows (see listings.archive) share the lookups used here
+    for claims, listings in ((Claim.objects, Listing.objects), (ArchivedClaim.objects, ArchivedListing.objects)):
+        completed = claims.filter(status='completed')
+        add(completed.values('claimant_id').annotate(n=Count('id')), 'claimant_id', COMPLETED_PICKUP)
+        add(completed.values('listing__donor_id').annotate(n=Count('id')), 'listing__donor_id', COMPLETED_PICKUP)
+        add(
+            claims.filter(status='rejected', rejected_by_donor=True).values('claimant_id').annotate(n=Count('id')),
+            'claimant_id', REJECTED_CLAIM,
+        )
+        # Only listings nobody got a share of, as in listings.tasks.expire_overdue_listings
+        unclaimed = listings.filter(status='expired').exclude(claims__status__in=['approved', 'completed'])
+        add(unclaimed.values('donor_id').annotate(n=Count('id')), 'donor_id', EXPIRED_LISTING)
+
+    on_time = Q(verified_at__lte=F('assignment__assigned_at') + ON_TIME_WINDOW)
+    otp_rows = PickupOTP.objects.filter(is_verified=True, verified_at__isnull=False).values(
+        claimant_id=F('assignment__claim__claimant_id')
+    ).annotate(on_time=Count('id', filter=on_time), late=Count('id', filter=~on_time))
+    archived_on_time = Q(otp_verified_at__lte=F('assigned_at') + ON_TIME_WINDOW)
+    archived_rows = ArchivedPickupAssignment.objects.filter(otp_verified_at__isnull=False).values(
+        claimant_id=F('claim__claimant_id')
+    ).annotate(on_time=Count('id', filter=archived_on_time), late=Count('id', filter=~archived_on_time))
+    for row in chain(otp_rows, archived_rows):
+        totals = evidence[row['claimant_id']]
+        totals[0] += ON_TIME_PICKUP[0] * row['on_time'] + LATE_PICKUP[0] * row['late']
+        totals[1] += ON_TIME_PICKUP[1] * row['on_time'] + LATE_PICKUP[1] * row['late']
+
+    count = 0
+    users = User.objects.only('id', 'trust_positive', 'trust_negative', 'trust_score').order_by('pk')
+    batch = []
+    with transaction.atomic():
+        for user in users.iterator(chunk_size=batch_size):
+            user.trust_positive, user.trust_negative = evidence.get(user.pk, (0.0, 0.0))
+            user.trust_score = score_for(user.trust_positive, user.trust_negative)
+            batch.append(user)
+            if len(batch) >= batch_size:
+                User.objects.bulk_update(batch, ['trust_positive', 'trust_negative', 'trust_score'])
+                count += len(batch)
+                batch = []
+        if batch:
+            User.objects.bulk_update(batch, ['trust_positive', 'trust_negative', 'trust_score'])
+            count += len(batch)
+    return count
@@ -1,16 +1,24 @@
 import secrets
 import string
 
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.core.mail import send_mail
-from django.conf import settings
+from django.core.paginator import Paginator
+from foodsaver import metrics
+from foodsaver.aio import arender, gather_reads
+from foodsaver.microcache import micro_cache
+from jobs.queue import enqueue
+from listings import read_models
+from listings.pagination import cached_stat, keyset_page, load_more
 from .forms import CustomUserCreationForm
-from .models import User, Volunteer
+from .models import User, Volunteer, ImpactStats
+from . import geocoding, impact, locations, tasks, trust
 
 
 def _generate_password(length=10):
@@ -48,7 +56,17 @@ def register(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            user = form.save(commit=False)
+            lookup = bool(user.address and not (user.latitude and user.longitude))
+            if lookup:
+                # Cache and gazetteer only; the service is asked by a background job
+                place = geocoding.geocode(user.address, remote=False)
+                if place.found:
+                    user.latitude, user.longitude = place.latitude, place.longitude
+                    lookup = False
+            user.save()
+            if lookup:
+                enqueue(tasks.geocode_user_address, [user.pk], unique_key=f'geocode-user:{user.pk}')
             login(request, user)
             return redirect('dashboard')
     else:
@@ -107,28 +125,10 @@ def add_volunteer(request):
             volunteer.user = vol_user
             volunteer.save()
 
-            # Send email with credentials
+            # Emailed by a background job, which sets the password it sends
             if email:
-                ngo_name = request.user.institution_name or request.user.username
-                subject = f"Welcome to Food Saver — You've been invited by {ngo_name}"
-                message = (
-                    f"Hello {name},\n\n"
-                    f"You have been added as a volunteer by {ngo_name} on Food Saver.\n\n"
-                    f"Here are your login credentials:\n"
-                    f"  Portal: http://localhost:8000/users/volunteer/login/\n"
-                    f"  Username: {username}\n"
-                    f"  Password: {raw_password}\n\n"
-                    f"Your Volunteer ID: {volunteer.volunteer_id}\n\n"
-                    f"Please log in and change your password at your earliest convenience.\n\n"
-                    f"Together, let's end hunger!\n"
-                    f"— Food Saver Team"
-                )
-                try:
-                    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [email])
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"Failed to send volunteer invitation email to {email}: {e}")
+                enqueue(tasks.send_volunteer_invitation, [volunteer.pk], priority=10,
+                        unique_key=f'volunteer-invitation:{volunteer.pk}')
 
     return redirect('claimant_dashboard')
 
@@ -151,66 +151,50 @@ def volunteer_login(request):
     return render(request, 'users/volunteer_login.html')
 
 
+def _delivered_assignments(volunteer):
+    from listings.models import PickupAssignment
+    return PickupAssignment.objects.filter(volunteer=volunteer, status='delivered').select_related(
+        'claim__listing__donor'
+    )
+
+
 @login_required
-def volunteer_dashboard(request):
+def volunteer_deliveries_more(request):
+    volunteer = Volunteer.objects.filter(user=request.user).first()
+    if request.user.role != 'volunteer' or volunteer is None:
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+    return load_more(
+        request, _delivered_assignments(volunteer), 'users/_completed_assignment_row.html', 'a', field='assigned_at'
+    )
+
+
+@login_required
+async def volunteer_dashboard(request):
     """Volunteer's main dashboard: status, assigned pickups."""
-    if request.user.role != 'volunteer':
+    user = await request.auser()
+    if user.role != 'volunteer':
         return redirect('dashboard')
 
-    volunteer = get_object_or_404(Volunteer, user=request.user)
+    volunteer = await aget_object_or_404(Volunteer.objects.select_related('ngo'), user=user)
 
-    from listings.models import PickupAssignment
-    assignments = PickupAssignment.objects.filter(
-        volunteer=volunteer
-    ).select_related('claim', 'claim__listing', 'claim__listing__donor').order_by('-assigned_at')
-
-    active_assignments = assignments.filter(status__in=['assigned', 'picked_up'])
-    completed_assignments = assignments.filter(status='delivered')
-
-    # Pre-process active assignments for template (short variable names)
-    active_list = []
-    for a in active_assignments:
-        listing = a.claim.listing
-        donor = listing.donor
-        active_list.append({
-            'id': a.id,
-            'desc': listing.description,
-            'ftype': listing.food_type,
-            'ftype_display': listing.get_food_type_display(),
-            'qty': listing.quantity_kg,
-            'donor_name': getattr(donor, 'institution_name', '') or donor.username,
-            'assigntime': a.assigned_at,
-            'status': a.status,
-            'pickup_instructions': getattr(listing, 'pickup_instructions', ''),
-            'notes': a.notes if hasattr(a, 'notes') else '',
-        })
-
-    # Pre-process completed assignments for template
-    completed_list = []
-    for a in completed_assignments:
-        listing = a.claim.listing
-        donor = listing.donor
-        completed_list.append({
-            'id': a.id,
-            'desc': listing.description,
-            'donor_name': getattr(donor, 'institution_name', '') or donor.username,
-            'qty': listing.quantity_kg,
-            'assigntime': a.assigned_at,
-        })
+    active_list, completed_assignments, completed_count = await gather_reads(
+        (read_models.active_assignments, volunteer),
+        # Completed deliveries: first page here, the rest via volunteer_deliveries_more
+        (keyset_page, _delivered_assignments(volunteer), None, 'assigned_at'),
+        (cached_stat, user.pk, 'deliveries', lambda: _delivered_assignments(volunteer).count()),
+    )
 
     vol_id = volunteer.volunteer_id
     ngo_name = getattr(volunteer.ngo, 'institution_name', '') or volunteer.ngo.username
 
-    return render(request, 'users/volunteer_dashboard.html', {
+    return await arender(request, 'users/volunteer_dashboard.html', {
         'volunteer': volunteer,
         'vol_id': vol_id,
         'ngo_name': ngo_name,
-        'active_assignments': active_assignments,
         'completed_assignments': completed_assignments,
         'active_list': active_list,
-        'completed_list': completed_list,
         'active_count': len(active_list),
-        'completed_count': len(completed_list),
+        'completed_count': completed_count,
     })
 
 
@@ -250,35 +234,44 @@ def update_pickup_status(request, assignment_id):
         assignment.status = 'delivered'
         assignment.save()
 
-        # Mark the claim and listing as completed
+        # Mark the claim completed, and the listing once every share of it is
         claim = assignment.claim
         claim.status = 'completed'
         claim.save()
         listing = claim.listing
-        listing.status = 'completed'
-        listing.save()
+        if listing.status == 'claimed' and not listing.claims.filter(status__in=['pending', 'approved']).exists():
+            listing.status = 'completed'
+            listing.save()
+        impact.record_delivery(claim)
+        trust.record_delivery(claim)
         messages.success(request, 'Delivery confirmed! Great work.')
 
     return redirect('volunteer_dashboard')
 
 
+def _record_pickup_verified(assignment, pickup_otp):
+    impact.record_pickup_verified(assignment, pickup_otp)
+    trust.record_pickup_verified(assignment, pickup_otp)
+
+
 @login_required
 @require_POST
-def verify_pickup_otp(request, assignment_id):
+async def verify_pickup_otp(request, assignment_id):
     """Verify the 6-digit OTP to confirm food pickup.
     
     This is the ONLY way to transition an assignment to 'picked_up' status.
     """
-    if request.user.role != 'volunteer':
+    user = await request.auser()
+    if user.role != 'volunteer':
         return JsonResponse({'success': False, 'error': 'Unauthorized'}, status=403)
 
     from listings.models import PickupAssignment, PickupOTP
     from django.utils import timezone
 
-    assignment = get_object_or_404(
-        PickupAssignment,
+    assignment = await aget_object_or_404(
+        PickupAssignment.objects.select_related('otp', 'claim__listing'),
         id=assignment_id,
-        volunteer__user=request.user,
+        volunteer__user=user,
         status='assigned',
     )
 
@@ -287,42 +280,122 @@ def verify_pickup_otp(request, assignment_id):
     try:
         pickup_otp = assignment.otp
     except PickupOTP.DoesNotExist:
+        metrics.OTP_VERIFICATIONS.labels('missing').inc()
         return JsonResponse({'success': False, 'error': 'No OTP found for this assignment.'}, status=400)
 
     if pickup_otp.is_verified:
+        metrics.OTP_VERIFICATIONS.labels('already_used').inc()
         return JsonResponse({'success': False, 'error': 'OTP has already been used.'}, status=400)
 
     if pickup_otp.code != otp_code:
+        metrics.OTP_VERIFICATIONS.labels('incorrect').inc()
         return JsonResponse({'success': False, 'error': 'Incorrect OTP. Please check with the restaurant.'}, status=400)
 
-    # OTP is correct — mark verified and update assignment status
+    # OTP is correct — mark verified and update assignment status. The
+    # conditional UPDATE lets only one of two concurrent submissions through.
     pickup_otp.is_verified = True
     pickup_otp.verified_at = timezone.now()
-    pickup_otp.save()
+    verified = await PickupOTP.objects.filter(pk=pickup_otp.pk, is_verified=False).aupdate(
+        is_verified=True, verified_at=pickup_otp.verified_at,
+    )
+    if not verified:
+        metrics.OTP_VERIFICATIONS.labels('already_used').inc()
+        return JsonResponse({'success': False, 'error': 'OTP has already been used.'}, status=400)
 
     assignment.status = 'picked_up'
-    assignment.save()
+    await assignment.asave()
+    await sync_to_async(_record_pickup_verified)(assignment, pickup_otp)
+    metrics.OTP_VERIFICATIONS.labels('verified').inc()
 
     return JsonResponse({'success': True, 'message': 'OTP verified! Food marked as picked up.'})
 
 
+@login_required
+@require_POST
+def volunteer_location_ping(request):
+    """Report the volunteer's current position while a pickup is in progress.
+
+    Only buffered here; see users.locations for how pings reach the database.
+    """
+    if request.user.role != 'volunteer':
+        return JsonResponse({'success': False, 'error': 'Unauthorized'}, status=403)
+
+    try:
+        latitude = float(request.POST['lat'])
+        longitude = float(request.POST['lng'])
+        accuracy = float(request.POST['accuracy']) if request.POST.get('accuracy') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': 'lat and lng are required numbers.'}, status=400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return JsonResponse({'success': False, 'error': 'Position out of range.'}, status=400)
+
+    volunteer_id = locations.active_volunteer_id(request.user)
+    if volunteer_id is None:
+        return JsonResponse({'success': False, 'error': 'No pickup in progress.'}, status=409)
+
+    locations.record(volunteer_id, latitude, longitude, accuracy)
+    return JsonResponse({'success': True})
+
+
+@login_required
+def geocode(request):
+    """Coordinates for the ``q`` place or address, served from the geocoding cache where possible."""
+    place = geocoding.geocode(request.GET.get('q', ''))
+    if not place.found:
+        return JsonResponse({'error': 'Location not found.'}, status=404)
+    return JsonResponse(place.as_dict())
+
 # ======== EXISTING VIEWS ========
 
+NGOS_PER_PAGE = 24
+
+
+def _ngo_page(request, ngos):
+    """Paginate an NGO queryset, narrowing it to the ``q`` prefix when given."""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        paginator = Paginator(ngos.order_by('institution_name', 'username', 'id'), NGOS_PER_PAGE)
+        return paginator.get_page(request.GET.get('page')), query
+
+    # Page over the matching ids from the prefix index, then load only that page.
+    from .directory import get_index
+    page_obj = Paginator(get_index().lookup_ids(query), NGOS_PER_PAGE).get_page(request.GET.get('page'))
+    by_id = ngos.in_bulk(page_obj.object_list)
+    page_obj.object_list = [by_id[i] for i in page_obj.object_list if i in by_id]
+    return page_obj, query
+
+
+@micro_cache(ttl=10, stale=60)
 def ngo_directory(request):
-    ngos = User.objects.filter(role='claimant')
-    return render(request, 'users/ngo_directory.html', {'ngos': ngos})
+    page_obj, query = _ngo_page(request, User.objects.filter(role='claimant'))
+    return render(request, 'users/ngo_directory.html', {
+        'ngos': page_obj,
+        'page_obj': page_obj,
+        'query': query,
+    })
 
 
+def ngo_autocomplete(request):
+    """Type-ahead suggestions for the NGO directory, served from the in-memory prefix index."""
+    from .directory import get_index
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    return JsonResponse({'results': get_index().lookup(request.GET.get('q', ''), limit)})
+
+
+@micro_cache(ttl=10, stale=60)
 def profile_view(request, user_id):
-    user_profile = get_object_or_404(User, pk=user_id)
-    impact_stats = {
-        'meals_served': 1200 + (user_profile.id * 50),
-        'volunteers': 5 + (user_profile.id % 20),
-        'badges': ['Top Rated', 'Verified'] if user_profile.is_verified else []
-    }
+    user_profile = get_object_or_404(User.objects.select_related('impact'), pk=user_id)
+    try:
+        impact_stats = user_profile.impact
+    except ImpactStats.DoesNotExist:
+        impact_stats = ImpactStats(user=user_profile)
     return render(request, 'users/ngo_profile.html', {
         'profile_user': user_profile,
-        'stats': impact_stats
+        'stats': impact_stats,
+        'badges': impact_stats.badges(user_profile.is_verified),
     })
 
 
@@ -331,6 +404,10 @@ def connected_ngos(request):
     if request.user.role != 'donor':
         return redirect('dashboard')
 
-    all_ngos = User.objects.filter(role='claimant')
+    page_obj, query = _ngo_page(request, User.objects.filter(role='claimant'))
 
-    return render(request, 'users/connected_ngos.html', {'ngos': all_ngos})
+    return render(request, 'users/connected_ngos.html', {
+        'ngos': page_obj,
+        'page_obj': page_obj,
+        'query': query,
+    })